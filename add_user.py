@@ -2,6 +2,9 @@ import sys
 import sqlite3
 from flask_bcrypt import Bcrypt
 
+import database
+from user_cache import bump_generation
+
 bcrypt = Bcrypt()
 
 # 引数が4つ（ファイル名, ユーザー名, パスワード, 役職）あるかチェック
@@ -23,11 +26,13 @@ if role not in allowed_roles:
 hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
 
 try:
-    connection = sqlite3.connect('wiki.db')
+    connection = database.connect()
     cur = connection.cursor()
     # roleも一緒にINSERTする
     cur.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
                 (username, hashed_password, role))
+    # 動いているアプリにユーザー情報のキャッシュを捨てさせる
+    bump_generation(connection)
     connection.commit()
     print(f"ユーザー '{username}' (役職: {role}) が正常に作成されました。")
 except sqlite3.IntegrityError:
@@ -0,0 +1,103 @@
+import math
+
+import faiss
+
+# --- FAISSインデックスの種類 ---
+# 総当たりの Flat は件数に比例して検索が遅くなり、メモリも増えるため、
+# 規模に応じて近似最近傍探索（ANN）のインデックスを選べるようにする。
+#   flat     : 総当たり（正確・小規模向け）
+#   ivf_flat : クラスタに分けて、近いクラスタ（nprobe個）だけを探す
+#   ivf_pq   : IVF + 直積量子化でベクトルを圧縮する（省メモリ・大規模向け）
+#   hnsw     : グラフ探索（高速・高精度だが削除 remove_ids に対応していない）
+#   sq8      : 各次元を8bitに量子化した総当たり（メモリ1/4）
+# 検索時のパラメータ（nprobe / efSearch）は set_search_params で変更する。
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw', 'sq8')
+DEFAULT_INDEX_TYPE = 'flat'
+
+HNSW_M = 32
+# PQのサブベクトル数（次元数を割り切れる値にする。384次元なら48）
+PQ_M = 48
+# IVFの学習に必要な「クラスタ1つあたりの学習ベクトル数」の目安
+MIN_POINTS_PER_CENTROID = 39
+# PQ（8bit = 256個の代表点）の学習に必要なベクトル数
+MIN_PQ_TRAINING_POINTS = 256
+
+
+def choose_nlist(n_vectors, n_training=None):
+    """件数からIVFのクラスタ数を決める（4√N を基準に、学習データが足りる範囲に収める）"""
+    nlist = int(4 * math.sqrt(max(n_vectors, 1)))
+    nlist = min(nlist, (n_vectors if n_training is None else n_training) // MIN_POINTS_PER_CENTROID)
+    return max(nlist, 1)
+
+
+def factory_string(index_type, dim, n_vectors, n_training=None):
+    """インデックスの種類から faiss.index_factory に渡す文字列を作る"""
+    if index_type == 'flat':
+        return 'IDMap,Flat'
+    if index_type == 'ivf_flat':
+        return f'IDMap,IVF{choose_nlist(n_vectors, n_training)},Flat'
+    if index_type == 'ivf_pq':
+        pq_m = PQ_M if dim % PQ_M == 0 else next(m for m in (32, 24, 16, 8, 4, 2, 1) if dim % m == 0)
+        return f'IDMap,IVF{choose_nlist(n_vectors, n_training)},PQ{pq_m}'
+    if index_type == 'hnsw':
+        return f'IDMap,HNSW{HNSW_M}'
+    if index_type == 'sq8':
+        return 'IDMap,SQ8'
+    raise ValueError(f"不明なインデックスの種類です: {index_type}（{', '.join(INDEX_TYPES)} のいずれか）")
+
+
+def build_index(index_type, training_vectors, n_vectors=None):
+    """空のインデックスを作り、必要なら training_vectors で学習させて返す。
+
+    n_vectors は追加するベクトルの総数（IVFのクラスタ数を決める。省略すると training_vectors の件数）。
+    全件の一部だけで学習させる場合に指定する。学習データが少なすぎる場合は flat にフォールバックする。
+    """
+    n_training, dim = training_vectors.shape
+    n_vectors = n_training if n_vectors is None else n_vectors
+    if index_type in ('ivf_flat', 'ivf_pq') and n_training < MIN_POINTS_PER_CENTROID * 2:
+        print(f"注意: ベクトルが{n_training}件しかないため、{index_type} ではなく flat を使います。")
+        index_type = 'flat'
+    if index_type == 'ivf_pq' and n_training < MIN_PQ_TRAINING_POINTS:
+        print(f"注意: ベクトルが{n_training}件しかないため、ivf_pq ではなく ivf_flat を使います。")
+        index_type = 'ivf_flat'
+
+    index = faiss.index_factory(dim, factory_string(index_type, dim, n_vectors, n_training))
+    if not index.is_trained:
+        index.train(training_vectors)
+    return index
+
+
+def supports_remove(index):
+    """remove_ids（差分更新での削除）に対応しているかどうか"""
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    return not isinstance(inner, faiss.IndexHNSW)
+
+
+def set_search_params(index, params):
+    """'nprobe=16,efSearch=64' のような文字列で検索時のパラメータを設定する。
+
+    そのインデックスに関係ないパラメータ（flatに対するnprobeなど）は無視する。
+    """
+    if not params:
+        return
+    parameter_space = faiss.ParameterSpace()
+    for item in params.split(','):
+        name, value = item.split('=')
+        try:
+            parameter_space.set_index_parameter(index, name.strip(), float(value))
+        except RuntimeError:
+            pass
+
+
+def make_search_params(index, selector):
+    """IDSelector で検索対象を絞り込むための SearchParameters を作る。
+
+    IVF / HNSW は専用の型が必要で、nprobe / efSearch もここで引き継がないと既定値に戻ってしまう。
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=inner.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
@@ -1,38 +1,123 @@
-import faiss
-import pickle
-import numpy as np
-from sentence_transformers import SentenceTransformer
+import hmac
+import json
 import os
+import random
 import sqlite3
-import markdown
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
-from flask import Flask, render_template, g, abort, request, redirect, url_for, flash, send_from_directory
+from flask import Flask, Request, render_template, g, abort, request, redirect, url_for, flash, send_from_directory, send_file, jsonify, has_request_context, make_response, session, Response, stream_with_context, before_render_template, template_rendered
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
-import openai
-
-print("AIモデルとベクトルDBを読み込み中...")
-try:
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-    faiss_index = faiss.read_index('wiki_faiss.index')
-    with open('chunks.pkl', 'rb') as f:
-        chunk_data = pickle.load(f)
-    print("読み込み完了。")
-except FileNotFoundError:
-    print("エラー: ベクトルデータベースが見つかりません。")
-    print("先に `python create_vector_store.py` を実行してください。")
-    embedding_model = None
-    faiss_index = None
-    chunk_data = None
-
+from search_index import search_pages, RESULTS_PER_PAGE
+import markdown
+from render_cache import RenderCache, content_hash, MARKDOWN_EXTENSIONS
+from retrieval import RetrievalService, STATE_ERROR
+from query_batcher import QueryBatcher
+from hybrid_retrieval import HybridRetriever, MODES as RETRIEVAL_MODES, MODE_LEXICAL
+from llm_client import LLMClient
+from tag_service import parse_tag_names, set_page_tags, rename_tag, merge_tags
+from tag_index import TagIndex, bump_generation, parse_tag_query, read_generation as read_tag_generation
+from listing import list_pages, page_id_window, InvalidCursor, ORDERS as LISTING_ORDERS, PAGE_SIZE, MAX_PAGE_SIZE
+from permissions import can_view, required_level, viewer_level
+from database import ConnectionManager
+from user_cache import UserCache, UserRecord
+from http_cache import make_etag, StaticFingerprints, PRIVATE_REVALIDATE, IMMUTABLE
+from upload_store import UploadStore, PREVIEW_SIZES, PREVIEW_FORMAT, is_image
+from revisions import record_revision, list_revisions, get_revision, diff_lines
+from vector_queue import enqueue_page, queue_stats, read_generation as read_vector_generation
+import metrics
+from metrics import TracedConnection
+from profiling import RequestProfiler, KINDS as PROFILE_KINDS, KIND_CPROFILE
 
 # --- アプリケーションの設定 ---
 DATABASE = 'wiki.db'
 SECRET_KEY = 'your_secret_key_here'
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif'}
+# リクエスト全体の大きさの上限（添付ファイルはメモリに貯めずにディスクへ書くので、大きくしてよい）
+MAX_CONTENT_LENGTH = 1024 * 1024 * 1024
+# 画像のサムネイル・プレビューを作るスレッド数
+UPLOAD_PREVIEW_WORKERS = 2
+# 添付ファイルをブラウザにキャッシュさせる秒数（同じURLの中身は変わらない）
+UPLOAD_MAX_AGE = 24 * 60 * 60
+RENDER_CACHE_MAX_ENTRIES = 512
+# 起動時にバックグラウンドでAIモデルを読み込むか（0にすると最初の /ask まで読み込まない）
+RETRIEVAL_PRELOAD = os.environ.get('RETRIEVAL_PRELOAD', '1') == '1'
+# /ask の質問をまとめてベクトル化する上限件数と最大待ち時間（件数を1にするとまとめない）
+EMBED_BATCH_MAX_SIZE = 16
+EMBED_BATCH_MAX_WAIT_MS = 5
+# FAISSの検索パラメータ（IVF系は nprobe、HNSWは efSearch。インデックスに関係ないものは無視される）
+FAISS_SEARCH_PARAMS = 'nprobe=16,efSearch=64'
+# /ask の検索方法（hybrid: キーワード検索+ベクトル検索, vector: ベクトル検索のみ, lexical: キーワード検索のみ）
+# リクエストの retrieval_mode で質問ごとに変更できる
+RETRIEVAL_MODE = 'hybrid'
+# 各検索の時間の上限（ミリ秒）。超えた側の結果は使わない
+VECTOR_BUDGET_MS = 1000
+LEXICAL_BUDGET_MS = 200
+# ログイン中のユーザー情報をキャッシュする件数と秒数
+USER_CACHE_MAX_ENTRIES = 1024
+USER_CACHE_TTL_SECONDS = 300
+# ログイン時のパスワード照合（bcrypt）を行うスレッド数
+LOGIN_HASH_WORKERS = 2
+# 照合中・照合待ちのログインの上限（超えた分は待たせずに 429 を返す）
+LOGIN_MAX_PENDING = 8
+# /metrics を見るのに必要なトークン（Prometheus から Authorization: Bearer <トークン> で送る。未設定なら同じホストからだけ見られる）
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# 管理者がこのヘッダー（値は cprofile / pyinstrument）を付けたリクエストはプロファイルを取る
+PROFILE_HEADER = 'X-Profile'
+# ヘッダーがなくてもプロファイルを取るリクエストの割合（0なら取らない）と、保存先
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_FOLDER = 'profiles'
+class WikiRequest(Request):
+    """フォームの添付ファイルを、メモリに貯めずに添付ファイルの置き場所の一時ファイルへ直接書き込む"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_store.temp_file()
+
 app = Flask(__name__)
 app.config.from_object(__name__)
+app.request_class = WikiRequest
+
+# スレッドごとのSQLite接続（リクエストごとに開き直さずに使い回す。SQLの回数と時間を計る）
+db_connections = ConnectionManager(app.config['DATABASE'], factory=TracedConnection)
+
+# MarkdownをHTMLに変換した結果のキャッシュ
+render_cache = RenderCache(max_entries=app.config['RENDER_CACHE_MAX_ENTRIES'])
+
+# RAG用の検索サービス（モデルとベクトルDBはバックグラウンドで読み込む）
+retrieval = RetrievalService(search_params=app.config['FAISS_SEARCH_PARAMS'], database=app.config['DATABASE'])
+if app.config['RETRIEVAL_PRELOAD']:
+    retrieval.start()
+query_batcher = QueryBatcher(
+    retrieval,
+    max_batch_size=app.config['EMBED_BATCH_MAX_SIZE'],
+    max_wait_ms=app.config['EMBED_BATCH_MAX_WAIT_MS']
+)
+hybrid_retriever = HybridRetriever(
+    query_batcher.search,
+    app.config['DATABASE'],
+    vector_budget_ms=app.config['VECTOR_BUDGET_MS'],
+    lexical_budget_ms=app.config['LEXICAL_BUDGET_MS']
+)
+# タグ → ページIDのインメモリ索引（最初に使うときにDBから読み込む）
+tag_index = TagIndex()
+# ログイン中のユーザー情報（load_user がリクエストごとにDBを引かないように）
+user_cache = UserCache(ttl_seconds=app.config['USER_CACHE_TTL_SECONDS'], max_entries=app.config['USER_CACHE_MAX_ENTRIES'])
+# bcryptの照合は重いので専用のスレッドで行い、CPUを使うのは LOGIN_HASH_WORKERS 個までにする。
+# 照合の間はリクエストのスレッドも結果を待つので、照合中・照合待ちのログインは LOGIN_MAX_PENDING 件までとし、
+# それを超えたログインはすぐに 429 を返す（ログインが集中しても、それ以外のスレッドはページ表示に使える）
+login_executor = ThreadPoolExecutor(max_workers=app.config['LOGIN_HASH_WORKERS'], thread_name_prefix='login-bcrypt')
+login_slots = threading.BoundedSemaphore(app.config['LOGIN_MAX_PENDING'])
+# static/ のファイルの中身のハッシュ（URLに付けて長くキャッシュさせる）
+static_fingerprints = StaticFingerprints(app.static_folder)
+# 添付ファイルの置き場所（画像のプレビューはワーカーのスレッドで作る）
+upload_store = UploadStore(app.config['UPLOAD_FOLDER'], preview_workers=app.config['UPLOAD_PREVIEW_WORKERS'])
+# 回答を生成するLLM（OPENAI_API_KEY が未設定ならデモとしてプロンプトを返す）
+llm_client = LLMClient()
+# 管理者が指定したリクエストのプロファイル
+request_profiler = RequestProfiler(app.config['PROFILE_FOLDER'])
 
 # --- 拡張機能の初期化 ---
 bcrypt = Bcrypt(app)
@@ -44,96 +129,255 @@ login_manager.login_message_category = "error"
 
 
 # --- データベース接続の管理 ---
-def connect_db():
-    """データベースへの接続を返す"""
-    rv = sqlite3.connect(app.config['DATABASE'])
-    rv.row_factory = sqlite3.Row
-    return rv
-
 def get_db():
-    """リクエストごとにデータベース接続を取得し、なければ作成する"""
+    """このスレッドのデータベース接続を返す。GETのリクエストでは読み込み専用の接続を返す。"""
     if not hasattr(g, 'sqlite_db'):
-        g.sqlite_db = connect_db()
+        readonly = has_request_context() and request.method in ('GET', 'HEAD')
+        g.sqlite_db = db_connections.connection(readonly=readonly)
     return g.sqlite_db
 
+def get_write_db():
+    """GETのリクエストの中で書き込む場合（変換結果のキャッシュなど）の接続を返す"""
+    return db_connections.connection()
+
 @app.teardown_appcontext
 def close_db(error):
-    """リクエストの終了時にデータベース接続を閉じる"""
-    if hasattr(g, 'sqlite_db'):
-        g.sqlite_db.close()
+    """リクエストの終了時に、コミットされなかった変更を取り消す（接続は次のリクエストで使い回す）"""
+    db_connections.release()
 
 @app.context_processor
 def inject_permission_checker():
     return dict(
         get_page_tags=get_page_tags,
-        check_permission=check_permission
+        check_permission=check_permission,
+        static_url=static_url
     )
+
+def static_url(filename):
+    """static/ のファイルのURLに中身のハッシュを付ける（中身が変わるとURLも変わる）"""
+    fingerprint = static_fingerprints.fingerprint(filename)
+    if fingerprint is None:
+        return url_for('static', filename=filename)
+    return url_for('static', filename=filename, v=fingerprint)
+
+# --- 計測（/metrics） ---
+# リクエストごとの時間・SQLの回数と時間・区間（テンプレートの描画など）の時間を metrics のヒストグラムに記録する
+# ストリーミングの応答（/ask/stream）は、ヘッダーを返すまでの時間になる
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+    kind = request.headers.get(app.config['PROFILE_HEADER'])
+    if kind is not None and current_user.is_authenticated and current_user.role == 'Admin':
+        g.profiler = request_profiler.start(kind if kind in PROFILE_KINDS else KIND_CPROFILE)
+    elif app.config['PROFILE_SAMPLE_RATE'] and random.random() < app.config['PROFILE_SAMPLE_RATE']:
+        g.profiler = request_profiler.start()
+
+@app.after_request
+def finish_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    profiler = g.pop('profiler', None)
+    trace = metrics.finish_request(endpoint, request.method, response.status_code)
+    if profiler is not None:
+        # プロファイルはいつも保存するが、ファイル名と内訳（Server-Timing）は管理者への応答にだけ付ける
+        # （割合で選んだリクエストは誰のものでもありうるので、内部の情報を見せない）
+        filename = request_profiler.stop(profiler, endpoint)
+        if current_user.is_authenticated and current_user.role == 'Admin':
+            response.headers['X-Profile-File'] = filename
+            if trace is not None:
+                timings = [f'sql;desc="{trace.sql_count} queries";dur={trace.sql_seconds * 1000:.1f}']
+                timings += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in trace.spans.items()]
+                response.headers['Server-Timing'] = ', '.join(timings)
+    return response
+
+def start_template_span(sender, template, context, **extra):
+    g.setdefault('template_started', []).append(time.perf_counter())
+
+def finish_template_span(sender, template, context, **extra):
+    started = g.get('template_started')
+    if started:
+        metrics.record_span('template', time.perf_counter() - started.pop())
+
+before_render_template.connect(start_template_span, app)
+template_rendered.connect(finish_template_span, app)
+
+@app.after_request
+def set_static_cache_control(response):
+    """中身のハッシュ付きURLの静的ファイルは、ブラウザに長くキャッシュさせる。
+
+    ?v= が今のファイルのハッシュと一致するときだけにする（違う値なら通常のキャッシュの指定のまま）。
+    """
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code == 200:
+        filename = (request.view_args or {}).get('filename')
+        if filename and request.args['v'] == static_fingerprints.fingerprint(filename):
+            response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+# --- 条件付きGET（ETag / 304） ---
+def wiki_generation():
+    """ページ・タグの変更で進む世代番号（一覧の ETag に使う）"""
+    cur = get_db().execute("SELECT name, value FROM generations WHERE name IN ('pages', 'tags')")
+    return tuple(sorted((row['name'], row['value']) for row in cur.fetchall()))
+
+def viewer_etag(*parts):
+    """閲覧しているユーザー（ヘッダーの表示や閲覧できるページが変わる）を含めた ETag を作る"""
+    user = (current_user.id, current_user.role) if current_user.is_authenticated else None
+    return make_etag(user, *parts)
+
+def conditional_response(etag, render):
+    """If-None-Match が etag と一致すれば描画せずに 304 を返し、一致しなければ render() の結果に ETag を付けて返す。
+
+    表示待ちのフラッシュメッセージがあるときは、毎回描画し ETag も付けない（メッセージを表示させるため）。
+    権限のチェックはこれを呼ぶ前に済ませておく。
+    """
+    cacheable = '_flashes' not in session
+    if cacheable and request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = make_response(render())
+    if cacheable:
+        response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = PRIVATE_REVALIDATE
+    response.vary.add('Cookie')
+    return response
+def get_tag_index():
+    """他のワーカーの変更を反映したタグの索引を返す"""
+    tag_index.ensure_fresh(get_db())
+    return tag_index
+
+def get_pages_by_ids(page_ids):
+    """ページIDの配列から、その順番で (id, title) の行を返す（閲覧できないページは除く）"""
+    page_ids = [int(page_id) for page_id in page_ids]
+    if not page_ids:
+        return []
+    placeholders = ', '.join('?' for _ in page_ids)
+    cur = get_db().execute(f'SELECT id, title FROM pages WHERE id IN ({placeholders}) AND required_level >= ?',
+                           page_ids + [current_viewer_level()])
+    titles = {row['id']: row['title'] for row in cur.fetchall()}
+    return [{'id': page_id, 'title': titles[page_id]} for page_id in page_ids if page_id in titles]
+
 def get_page_tags(page_id):
     """指定されたページのタグをセットで返す"""
     db = get_db()
     cur = db.execute("SELECT t.name FROM tags t JOIN page_tags pt ON t.id = pt.tag_id WHERE pt.page_id = ?", (page_id,))
     return {row['name'] for row in cur.fetchall()}
 
+def get_page_uploads(page_id):
+    """指定されたページの添付ファイルを、添付した順に返す"""
+    cur = get_db().execute('SELECT id, sha256, filename, content_type, size FROM uploads WHERE page_id = ? ORDER BY id',
+                           (page_id,))
+    return [dict(row, is_image=is_image(row['filename'])) for row in cur.fetchall()]
+
+def save_uploads(db, page_id):
+    """フォームの添付ファイルを保存してページに紐付け、プレビューを作る画像のハッシュのリストを返す（コミットは呼び出し側）"""
+    image_hashes = []
+    # ファイルの保存から uploads への INSERT までを書き込みのトランザクションの中で行い、
+    # 同じ内容のファイルを削除する remove_unreferenced と重ならないようにする
+    if not db.in_transaction:
+        db.execute('BEGIN IMMEDIATE')
+    for file in request.files.getlist('upload_file'):
+        if not file or not file.filename:
+            continue
+        # 表示・ダウンロード用の名前は元のまま残し、拡張子だけを確かめる
+        filename = os.path.basename(file.filename.replace('\\', '/'))
+        extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        if extension not in app.config['ALLOWED_EXTENSIONS']:
+            flash(f'{filename} は添付できない種類のファイルです。', 'error')
+            continue
+        sha256, size = upload_store.store(file.stream)
+        db.execute(
+            'INSERT INTO uploads (page_id, sha256, filename, content_type, size, uploaded_by_id) VALUES (?, ?, ?, ?, ?, ?)',
+            (page_id, sha256, filename, file.mimetype or None, size, current_user.id)
+        )
+        if is_image(filename):
+            image_hashes.append(sha256)
+    return image_hashes
+
+def current_viewer_level():
+    """ログイン中のユーザーのレベル（リクエストごとに1回だけ計算する）"""
+    if 'viewer_level' not in g:
+        g.viewer_level = viewer_level(current_user)
+    return g.viewer_level
+
 def check_permission(page_permission_level, action='view'):
     """ユーザーが特定の権限レベルのページに対してアクションを実行できるかチェックする"""
-    # 役職の階層を定義（数字が小さいほど偉い）
-    role_hierarchy = {'Admin': 0, 'Member': 1, 'Intern': 2, 'Customer': 3}
-    
-    # ページの権限レベルを定義
-    permission_map = {
-        '管理者のみ': 0,
-        '社員以上': 1,
-        'インターン生以上': 2,
-        '全員に公開': 4 # ログインしていない人も含めて全員
-    }
-
-    # ページの権限レベルを取得
-    required_level = permission_map.get(page_permission_level, 0) # 不明な場合は最も厳しい「管理者のみ」
-
-    # ログインしていない場合
-    if not current_user.is_authenticated:
-        return required_level == 4 # 「全員に公開」のページのみ許可
-
-    # ログインしている場合
-    user_level = role_hierarchy.get(current_user.role, 4) # 不明な役職は最も権限が低い
-    
-    # ユーザーの役職レベルが、要求されるレベル以上（数字が同じか小さい）かチェック
-    return user_level <= required_level
+    # 役職とページの権限レベルの対応は permissions.py で定義している
+    return can_view(current_viewer_level(), required_level(page_permission_level))
 
 class User(UserMixin):
-    def __init__(self, id, username, password, role): # ★roleを追加
+    def __init__(self, id, username, role): # ★roleを追加
         self.id = id
         self.username = username
-        self.password = password
         self.role = role # ★role属性をセット
 
 # --- ログイン管理 ---
 @login_manager.user_loader
 def load_user(user_id):
-    db = get_db()
-    cur = db.execute('SELECT id, username, password, role FROM users WHERE id = ?', (user_id,)) # ★roleを取得
-    user_data = cur.fetchone()
-    if user_data is None:
+    # ユーザー情報はキャッシュから取り出す（なければDBから読む）
+    record = user_cache.get(get_db(), user_id)
+    if record is None:
         return None
-    return User(id=user_data['id'], username=user_data['username'], password=user_data['password'], role=user_data['role']) # ★roleを渡す
+    return User(id=record.id, username=record.username, role=record.role) # ★roleを渡す
 
 # --- ルーティング（公開ページ） ---
 @app.route('/')
 def show_pages():
-    """トップページ。全タグ一覧と全ページ一覧を表示する。"""
-    db = get_db()
-    
-    # 既存のロジック：全ページを取得
-    cur_pages = db.execute('SELECT id, title FROM pages ORDER BY id DESC')
-    pages = cur_pages.fetchall()
-    
-    # ★追加ロジック：全タグをアルファベット順で取得
-    cur_tags = db.execute('SELECT name FROM tags ORDER BY name')
-    tags = cur_tags.fetchall()
-    
-    # ★ページ一覧とタグ一覧の両方をテンプレートに渡す
-    return render_template('index.html', pages=pages, tags=tags)
+    """トップページ。全タグ一覧とページ一覧（新しい順に1ページ分）を表示する。"""
+    # ページ・タグが変わっていなければ、前回と同じ内容なので 304 を返す
+    etag = viewer_etag('index', wiki_generation(), request.args.get('cursor'))
+
+    def render():
+        # ページ一覧は cursor で続きを取り出す（続きはスクロールに合わせて /api/pages から読み込む）
+        try:
+            pages, next_cursor = list_pages(get_db(), cursor=request.args.get('cursor'), user_level=current_viewer_level())
+        except InvalidCursor:
+            abort(400)
+
+        # ★追加ロジック：全タグを名前順で、ページ数つきで取得（タグクラウド）
+        tags = [
+            {'name': name, 'count': count, 'weight': weight}
+            for name, count, weight in get_tag_index().cloud(current_viewer_level())
+        ]
+
+        # ★ページ一覧とタグ一覧の両方をテンプレートに渡す
+        return render_template('index.html', pages=pages, tags=tags, next_cursor=next_cursor)
+
+    return conditional_response(etag, render)
     
+@app.route('/api/pages')
+def api_pages():
+    """ページ一覧をJSONで1ページ分返す（無限スクロール用）。
+
+    ?cursor= に前の応答の next_cursor を渡すと続きを返す。
+    ?order=new|updated で並び順、?tag= （複数指定でAND）でタグの絞り込み、?limit= で件数を指定する。
+    """
+    order = request.args.get('order', 'new')
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    tag_names = request.args.getlist('tag')
+    if order not in LISTING_ORDERS:
+        return jsonify({'error': f"order は {', '.join(LISTING_ORDERS)} のいずれかを指定してください。"}), 400
+    if tag_names and order != 'new':
+        return jsonify({'error': 'タグで絞り込む場合、order は new だけです。'}), 400
+    # ページ・タグが変わっていなければ 304 を返す（スクロールで同じ範囲を読み直すとき）
+    etag = viewer_etag('api_pages', wiki_generation(), request.query_string)
+
+    def render():
+        if tag_names:
+            # タグで絞り込む場合はタグの索引から新しい順に取り出す
+            index = get_tag_index()
+            page_ids = index.query(tag_names, user_level=current_viewer_level()) if index.has_tags(tag_names) else []
+            window, next_cursor = page_id_window(page_ids, request.args.get('cursor'), limit)
+            pages = get_pages_by_ids(window)
+        else:
+            pages, next_cursor = list_pages(get_db(), order, request.args.get('cursor'), limit, current_viewer_level())
+        for page in pages:
+            page['url'] = url_for('view_page', page_id=page['id'])
+        return jsonify({'pages': pages, 'next_cursor': next_cursor})
+
+    try:
+        return conditional_response(etag, render)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/page/<int:page_id>')
 def view_page(page_id):
     """個別ページ。新しい権限レベルに基づいて閲覧可能かチェックする。"""
@@ -152,24 +396,35 @@ def view_page(page_id):
         abort(404)
 
     # --- 新しい権限チェック ---
-    # ページの権限レベルを引数として渡す
-    if not check_permission(page['permission_level'], action='view'):
+    # ページの閲覧に必要なレベル（required_level 列）とユーザーのレベルを比べる
+    if not can_view(current_viewer_level(), page['required_level']):
         abort(403) # 閲覧権限がなければ403エラー
 
-    # タグを取得する
-    page_tags = get_page_tags(page_id)
+    # 権限のチェックのあとで、ページ（更新日時・本文）とタグが変わっていなければ 304 を返す
+    etag = viewer_etag('page', page_id, page['updated_at'], content_hash(page['content']),
+                       read_tag_generation(get_db()))
 
-    # MarkdownをHTMLに変換
-    extensions = ['tables', 'fenced_code', 'nl2br', 'sane_lists']
-    content_html = markdown.markdown(page['content'], extensions=extensions)
-    
-    return render_template('page.html', page=page, content_html=content_html, tags=list(page_tags))
+    def render():
+        # タグを取得する
+        page_tags = get_page_tags(page_id)
+
+        # MarkdownをHTMLに変換（変換結果はキャッシュする）
+        content_html = render_cache.render(get_write_db(), page_id, page['content'])
+
+        return render_template('page.html', page=page, content_html=content_html, tags=list(page_tags),
+                               uploads=get_page_uploads(page_id))
+
+    return conditional_response(etag, render)
 
 @app.route('/search')
 def search():
     """ページを横断検索する（キーワード、著者、複数タグ対応）"""
     query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
     results = []
+    total = 0
+    is_fulltext = False
+    next_url = None
     
     if query:
         db = get_db()
@@ -179,62 +434,169 @@ def search():
         
         if search_terms:
             # --- タグ検索ロジック ---
-            # 検索ワードがすべて存在するタグと仮定して検索を試みる
-            placeholders = ', '.join('?' for _ in search_terms)
-            sql_query = f"""
-                SELECT p.id, p.title
-                FROM pages p
-                JOIN page_tags pt ON p.id = pt.page_id
-                JOIN tags t ON pt.tag_id = t.id
-                WHERE t.name IN ({placeholders})
-                GROUP BY p.id, p.title
-                HAVING COUNT(DISTINCT t.name) = ?
-            """
-            
-            # 実行するクエリに渡す引数リスト
-            params = search_terms + [len(search_terms)]
-            
-            cur = db.execute(sql_query, params)
-            results = cur.fetchall()
+            # 検索ワードがすべて存在するタグと仮定して、インメモリのタグ索引で検索を試みる
+            # 'a b' は両方のタグ、'a|b' はどちらかのタグ、'-a' はそのタグが付いていないページ
+            required, any_of, excluded = parse_tag_query(search_terms)
+            index = get_tag_index()
+            if index.has_tags(required + [name for names in any_of for name in names] + excluded):
+                page_ids = index.query(required, any_of, excluded, current_viewer_level())
+                try:
+                    window, next_cursor = page_id_window(page_ids, request.args.get('cursor'))
+                except InvalidCursor:
+                    abort(400)
+                results = get_pages_by_ids(window)
+                total = len(page_ids)
+                if next_cursor:
+                    next_url = url_for('search', q=query, cursor=next_cursor)
 
             # --- 全文検索ロジック (タグ検索でヒットしなかった場合) ---
+            # FTS5インデックスをbm25で順位付けして検索する
+            # （bm25の順位はヒットした行をすべて採点して決まるので、ここはページ番号で分割する）
             if not results:
-                search_query = f'%{query}%'
-                cur = db.execute("""
-                    SELECT DISTINCT p.id, p.title
-                    FROM pages p
-                    JOIN users author ON p.author_id = author.id
-                    LEFT JOIN users updater ON p.updated_by_id = updater.id
-                    LEFT JOIN page_tags pt ON p.id = pt.page_id
-                    LEFT JOIN tags t ON pt.tag_id = t.id
-                    WHERE p.title LIKE ? 
-                       OR p.content LIKE ? 
-                       OR author.username LIKE ? 
-                       OR updater.username LIKE ?
-                       OR t.name LIKE ?
-                """, (search_query, search_query, search_query, search_query, search_query))
-                results = cur.fetchall()
-
-    return render_template('search_results.html', query=query, results=results)
+                results, total = search_pages(db, search_terms, page=page, user_level=current_viewer_level())
+                is_fulltext = True
+
+    has_next = is_fulltext and page * RESULTS_PER_PAGE < total
+    return render_template('search_results.html', query=query, results=results, total=total,
+                           page=page, has_next=has_next, is_fulltext=is_fulltext, next_url=next_url)
     
 @app.route('/tag/<string:tag_name>')
 def show_pages_by_tag(tag_name):
     """指定されたタグが付いたページを一覧表示する"""
+    index = get_tag_index()
+    if not index.has_tags([tag_name]):
+        abort(404)
+    page_ids = index.pages_with(tag_name, current_viewer_level())
+    try:
+        window, next_cursor = page_id_window(page_ids, request.args.get('cursor'))
+    except InvalidCursor:
+        abort(400)
+    pages = get_pages_by_ids(window)
+    return render_template('search_results.html', query=f"タグ: {tag_name}", results=pages, total=len(page_ids),
+                           next_url=url_for('show_pages_by_tag', tag_name=tag_name, cursor=next_cursor) if next_cursor else None)
+
+# --- ページの版の履歴 ---
+def get_viewable_page(page_id):
+    """ページの行を返す。なければ404、閲覧できなければ403。"""
+    page = get_db().execute('SELECT * FROM pages WHERE id = ?', (page_id,)).fetchone()
+    if page is None:
+        abort(404)
+    if not can_view(current_viewer_level(), page['required_level']):
+        abort(403)
+    return page
+
+@app.route('/page/<int:page_id>/history')
+def page_history(page_id):
+    """ページの版の一覧"""
+    page = get_viewable_page(page_id)
+    return render_template('history.html', page=page, revisions=list_revisions(get_db(), page_id))
+
+@app.route('/page/<int:page_id>/revisions/<int:revision>')
+def view_revision(page_id, revision):
+    """過去の版を表示する"""
+    page = get_viewable_page(page_id)
+    found = get_revision(get_db(), page_id, revision)
+    if found is None:
+        abort(404)
+    title, content, created_at, edited_by_id = found
+    content_html = markdown.markdown(content, extensions=MARKDOWN_EXTENSIONS)
+    return render_template('revision.html', page=page, revision=revision, title=title, created_at=created_at,
+                           content_html=content_html)
+
+@app.route('/page/<int:page_id>/diff')
+def diff_revisions(page_id):
+    """2つの版の差分を表示する（?from=版&to=版。from を省略すると to の1つ前の版）"""
+    page = get_viewable_page(page_id)
+    to_revision = request.args.get('to', type=int)
+    if to_revision is None:
+        abort(400)
+    from_revision = request.args.get('from', to_revision - 1, type=int)
     db = get_db()
-    cur = db.execute('SELECT id FROM tags WHERE name = ?', (tag_name,))
-    tag = cur.fetchone()
-    if tag is None:
+    old = get_revision(db, page_id, from_revision)
+    new = get_revision(db, page_id, to_revision)
+    if old is None or new is None:
         abort(404)
-    cur = db.execute("""
-        SELECT p.id, p.title FROM pages p JOIN page_tags pt ON p.id = pt.page_id
-        WHERE pt.tag_id = ?
-    """, (tag['id'],))
-    pages = cur.fetchall()
-    return render_template('search_results.html', query=f"タグ: {tag_name}", results=pages)
+    lines = diff_lines(old[1], new[1], f'版 {from_revision}', f'版 {to_revision}')
+    return render_template('diff.html', page=page, from_revision=from_revision, to_revision=to_revision, lines=lines)
+
+@app.route('/page/<int:page_id>/revisions/<int:revision>/restore', methods=['POST'])
+@login_required
+def restore_revision(page_id, revision):
+    """過去の版のタイトル・本文に戻す（戻した内容を新しい版として記録する）"""
+    page = get_viewable_page(page_id)
+    db = get_db()
+    found = get_revision(db, page_id, revision)
+    if found is None:
+        abort(404)
+    title, content, created_at, edited_by_id = found
+    try:
+        db.execute(
+            "UPDATE pages SET title = ?, content = ?, updated_by_id = ?, updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = ?",
+            (title, content, current_user.id, page_id)
+        )
+    except sqlite3.IntegrityError:
+        db.rollback()
+        flash(f'「{title}」というタイトルのページが既にあるため、戻せませんでした。', 'error')
+        return redirect(url_for('page_history', page_id=page_id))
+    render_cache.invalidate(db, page_id)
+    record_revision(db, page_id, title, content, current_user.id, previous=page)
+    enqueue_page(db, page_id)
+    db.commit()
+    flash(f'版 {revision} に戻しました。', 'success')
+    return redirect(url_for('view_page', page_id=page_id))
+
+@app.route('/uploads/<int:upload_id>/<path:filename>')
+def download_upload(upload_id, filename):
+    """ページの添付ファイルを提供する。?size=thumb|preview で画像のプレビューを返す。"""
+    cur = get_db().execute("""
+        SELECT u.sha256, u.filename, u.content_type, p.required_level
+        FROM uploads u JOIN pages p ON p.id = u.page_id
+        WHERE u.id = ?
+    """, (upload_id,))
+    upload = cur.fetchone()
+    if upload is None:
+        abort(404)
+    # 添付先のページを閲覧できるユーザーだけに返す
+    if not can_view(current_viewer_level(), upload['required_level']):
+        abort(403)
+
+    sha256 = upload['sha256']
+    size_name = request.args.get('size')
+    if size_name in PREVIEW_SIZES and is_image(upload['filename']):
+        if upload_store.has_preview(sha256, size_name):
+            download_name = f"{os.path.splitext(upload['filename'])[0]}-{size_name}.{PREVIEW_FORMAT}"
+            return private_file_response(send_file(upload_store.preview_path(sha256, size_name), download_name=download_name,
+                                                   etag=f'{sha256}-{size_name}', max_age=app.config['UPLOAD_MAX_AGE']))
+        # プレビューがまだなければ作成を頼み、今回は元の画像を返す。
+        # 同じURLでプレビューに置き換わるよう、元の画像とは別の ETag にしてキャッシュさせない
+        upload_store.schedule_previews(sha256)
+        response = private_file_response(send_file(
+            upload_store.object_path(sha256), mimetype=upload['content_type'], download_name=upload['filename'],
+            etag=f'{sha256}-{size_name}-pending'
+        ))
+        response.cache_control.no_cache = True
+        response.cache_control.max_age = None
+        return response
+    # 中身のハッシュを ETag にする。Range による部分的な取得にも対応する（send_file）
+    return private_file_response(send_file(
+        upload_store.object_path(sha256), mimetype=upload['content_type'], download_name=upload['filename'],
+        as_attachment=not is_image(upload['filename']), etag=sha256, max_age=app.config['UPLOAD_MAX_AGE']
+    ))
+
+def private_file_response(response):
+    """閲覧権限のある添付ファイルは、共有キャッシュには置かせない"""
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.vary.add('Cookie')
+    return response
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    """アップロードされたファイルを提供する"""
+    """以前の形式（uploads/ の直下）でアップロードされたファイルを提供する"""
+    # 添付ファイルの置き場所（objects/ など）は、権限を確かめる download_upload からだけ返す
+    if os.path.normpath(filename).split(os.sep, 1)[0] in ('objects', 'previews', 'tmp'):
+        abort(404)
+    # ETag・Last-Modified（ファイルの更新日時とサイズ）による 304 と、Range による部分的な取得は send_from_directory が行う
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
 @app.route('/new', methods=['GET', 'POST'])
@@ -251,29 +613,30 @@ def add_page():
             flash('タイトルを入力してください。', 'error')
             return render_template('new.html', title=title, content=content, existing_tags=tags_string)
 
-        # (ファイルアップロードのロジックは省略しています)
-
         db = get_db()
-        # ★permission_levelも一緒に保存
+        # ★permission_levelも一緒に保存（一覧・検索の絞り込み用に、整数の required_level も保存する）
+        page_required_level = required_level(permission_level)
         cur = db.execute(
-            'INSERT INTO pages (title, content, author_id, permission_level) VALUES (?, ?, ?, ?)',
-            (title, content, current_user.id, permission_level)
+            "INSERT INTO pages (title, content, author_id, permission_level, required_level, updated_at) VALUES (?, ?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'))",
+            (title, content, current_user.id, permission_level, page_required_level)
         )
         new_page_id = cur.lastrowid
+        # 最初の版として履歴に記録する
+        record_revision(db, new_page_id, title, content, current_user.id)
+        # ベクトル化を予約する（vector_worker.py が数秒後にベクトルDBへ反映する）
+        enqueue_page(db, new_page_id)
         
         # (タグの保存処理)
-        tag_names = [tag.strip() for tag in tags_string.split(',') if tag.strip()]
-        for name in tag_names:
-            cur = db.execute('SELECT id FROM tags WHERE name = ?', (name,))
-            tag = cur.fetchone()
-            if tag:
-                tag_id = tag['id']
-            else:
-                cur = db.execute('INSERT INTO tags (name) VALUES (?)', (name,))
-                tag_id = cur.lastrowid
-            db.execute('INSERT INTO page_tags (page_id, tag_id) VALUES (?, ?)', (new_page_id, tag_id))
+        added_tags, removed_tags = set_page_tags(db, new_page_id, parse_tag_names(tags_string))
+        generation = bump_generation(db)
+
+        # 添付ファイルを保存する（画像のプレビューはコミット後にバックグラウンドで作る）
+        image_hashes = save_uploads(db, new_page_id)
         
         db.commit()
+        tag_index.update_page(new_page_id, added_tags, removed_tags, generation, page_required_level)
+        for sha256 in image_hashes:
+            upload_store.schedule_previews(sha256)
         flash('新しいページが保存されました。', 'success')
         return redirect(url_for('view_page', page_id=new_page_id))
             
@@ -291,7 +654,7 @@ def edit_page(page_id):
         abort(404)
 
     # --- 新しい権限チェック ---
-    if not check_permission(page['permission_level'], action='edit'):
+    if not can_view(current_viewer_level(), page['required_level']):
         abort(403)
 
     # POSTリクエスト（フォームが更新された）の場合
@@ -301,28 +664,34 @@ def edit_page(page_id):
         tags_string = request.form['tags']
         permission_level = request.form['permission_level'] # ★フォームから権限レベルを取得
         
-        # (ファイルアップロードのロジックは省略しています)
-
-        # ★permission_levelも一緒に更新
+        # ★permission_levelも一緒に更新（updated_atを更新すると、ベクトルDBの差分更新の対象になる）
+        page_required_level = required_level(permission_level)
         db.execute(
-            'UPDATE pages SET title = ?, content = ?, updated_by_id = ?, permission_level = ? WHERE id = ?',
-            (title, content, current_user.id, permission_level, page_id)
+            "UPDATE pages SET title = ?, content = ?, updated_by_id = ?, permission_level = ?, required_level = ?, updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = ?",
+            (title, content, current_user.id, permission_level, page_required_level, page_id)
         )
-
-        # (タグの更新処理)
-        db.execute('DELETE FROM page_tags WHERE page_id = ?', (page_id,))
-        tag_names = [tag.strip() for tag in tags_string.split(',') if tag.strip()]
-        for name in tag_names:
-            cur = db.execute('SELECT id FROM tags WHERE name = ?', (name,))
-            tag = cur.fetchone()
-            if tag:
-                tag_id = tag['id']
-            else:
-                cur = db.execute('INSERT INTO tags (name) VALUES (?)', (name,))
-                tag_id = cur.lastrowid
-            db.execute('INSERT INTO page_tags (page_id, tag_id) VALUES (?, ?)', (page_id, tag_id))
+        render_cache.invalidate(db, page_id)
+        # タイトルか本文が変わったら、新しい版として履歴に記録する（直前の版からの差分で保存する）
+        if title != page['title'] or content != page['content']:
+            record_revision(db, page_id, title, content, current_user.id, previous=page)
+        # ベクトルDBのチャンクに関わる項目が変わったら、ベクトル化を予約する
+        if title != page['title'] or content != page['content'] or permission_level != page['permission_level']:
+            enqueue_page(db, page_id)
+
+        # (タグの更新処理：変わったタグだけを追加・削除する)
+        added_tags, removed_tags = set_page_tags(db, page_id, parse_tag_names(tags_string))
+        # タグか閲覧に必要なレベルが変わったら、タグの索引にも反映する
+        changed = added_tags or removed_tags or page_required_level != page['required_level']
+        generation = bump_generation(db) if changed else None
+
+        # 追加された添付ファイルを保存する
+        image_hashes = save_uploads(db, page_id)
         
         db.commit()
+        if generation is not None:
+            tag_index.update_page(page_id, added_tags, removed_tags, generation, page_required_level)
+        for sha256 in image_hashes:
+            upload_store.schedule_previews(sha256)
         flash('ページが更新されました。', 'success')
         return redirect(url_for('view_page', page_id=page_id))
             
@@ -339,9 +708,19 @@ def delete_page(page_id):
     db = get_db()
     # 先にpage_tagsテーブルから関連データを削除
     db.execute('DELETE FROM page_tags WHERE page_id = ?', (page_id,))
+    render_cache.invalidate(db, page_id)
+    # 添付ファイルの記録も削除する（ファイル自体は、他のページで使われていなければコミット後に削除する）
+    upload_hashes = [row['sha256'] for row in db.execute('SELECT sha256 FROM uploads WHERE page_id = ?', (page_id,))]
+    db.execute('DELETE FROM uploads WHERE page_id = ?', (page_id,))
+    db.execute('DELETE FROM page_revisions WHERE page_id = ?', (page_id,))
     # 次にpagesテーブルから本体を削除
     db.execute('DELETE FROM pages WHERE id = ?', (page_id,))
+    # ベクトルDBからも取り除くように予約する
+    enqueue_page(db, page_id)
+    generation = bump_generation(db)
     db.commit()
+    tag_index.remove_page(page_id, generation)
+    upload_store.remove_unreferenced(db, upload_hashes)
     flash('ページが削除されました。', 'success')
     return redirect(url_for('show_pages'))
 
@@ -357,9 +736,23 @@ def login():
         cur = db.execute('SELECT id, username, password, role FROM users WHERE username = ?', (username,))
         user_data = cur.fetchone()
 
-        if user_data and bcrypt.check_password_hash(user_data['password'], password):
+        # パスワードの照合はログイン用のスレッドで行う（空きがなければ待たずに断る）
+        if user_data and not login_slots.acquire(blocking=False):
+            flash('ログインが混み合っています。しばらくしてからもう一度お試しください。', 'error')
+            response = make_response(render_template('login.html'), 429)
+            response.headers['Retry-After'] = '1'
+            return response
+        try:
+            password_ok = bool(user_data) and login_executor.submit(
+                bcrypt.check_password_hash, user_data['password'], password
+            ).result()
+        finally:
+            if user_data:
+                login_slots.release()
+        if password_ok:
             # 修正点2：取得したroleをUserオブジェクトに渡す
-            user = User(id=user_data['id'], username=user_data['username'], password=user_data['password'], role=user_data['role'])
+            user = User(id=user_data['id'], username=user_data['username'], role=user_data['role'])
+            user_cache.put(UserRecord(user_data['id'], user_data['username'], user_data['role']))
             
             login_user(user)
             flash('ログインしました。', 'success')
@@ -384,51 +777,216 @@ def chat():
     """チャットBotページを表示する"""
     return render_template('chat.html')
 
-from flask import Flask, render_template, g, abort, request, redirect, url_for, flash, send_from_directory, jsonify
+def retrieve_context(user_message, retrieval_mode):
+    """質問に関係するWikiの本文を検索し、(コンテキスト, 参照ページ, 検索の情報, エラーのレスポンス) を返す"""
+    # 読み込みが終わっていなければ「準備中」を返す（初回はここで読み込みを開始する）
+    # キーワード検索だけならAIモデルは不要なので、準備中でも回答できる
+    retrieval.start()
+    if retrieval_mode != MODE_LEXICAL:
+        if retrieval.state == STATE_ERROR:
+            return None, None, None, jsonify({'response': "エラー: ベクトルデータベースが読み込まれていません。"})
+        if not retrieval.is_ready:
+            response = jsonify({
+                'status': 'warming_up',
+                'response': "AIモデルを準備中です。しばらくしてからもう一度お試しください。"
+            })
+            response.headers['Retry-After'] = '5'
+            return None, None, None, (response, 503)
+
+        # 差分更新されたベクトルDBがあれば読み込み直す（ワーカーが進めた世代番号が変わっていればすぐに）
+        retrieval.reload_if_changed(read_vector_generation(get_db()))
+
+    # キーワード検索（FTS5のbm25）とベクトル検索を並列に行い、順位を統合して上位3件を使う
+    # ベクトル検索は同時に届いた質問とまとめてベクトル化・検索する
+    # 閲覧権限のないページは、どちらの検索でも検索の段階で除外される
+    search_results, retrieval_info = hybrid_retriever.retrieve(
+        user_message, k=3, user_level=current_viewer_level(), mode=retrieval_mode
+    )
+    if retrieval_info['dropped'] or retrieval_info['errors']:
+        app.logger.warning('検索の一部を使いませんでした: %s', retrieval_info)
+
+    # 検索結果のページタイトルをまとめて取得する
+    # （ベクトルDBの差分更新前に権限が変更された場合に備えて、ここでも権限を確認する）
+    page_ids = sorted({page_id for page_id, chunk in search_results})
+    placeholders = ', '.join('?' for _ in page_ids)
+    cur = get_db().execute(f'SELECT id, title FROM pages WHERE id IN ({placeholders}) AND required_level >= ?',
+                           page_ids + [current_viewer_level()])
+    titles = {row['id']: row['title'] for row in cur.fetchall()}
+
+    # 検索結果のチャンクをコンテキストとして結合（削除済みのページは除く）
+    context_list = [
+        f"【記事タイトル】{titles[page_id]}\n【内容】\n{chunk}"
+        for page_id, chunk in search_results if page_id in titles
+    ]
+    sources = [
+        {'id': page_id, 'title': titles[page_id], 'url': url_for('view_page', page_id=page_id)}
+        for page_id, chunk in search_results if page_id in titles
+    ]
+    return "\n\n---\n\n".join(context_list), sources, retrieval_info, None
+
+def parse_ask_request():
+    """/ask へのリクエストから (質問, 検索方法, エラーのレスポンス) を取り出す"""
+    user_message = request.json.get('message')
+    if not user_message:
+        return None, None, (jsonify({'error': 'メッセージが空です。'}), 400)
+    retrieval_mode = request.json.get('retrieval_mode') or app.config['RETRIEVAL_MODE']
+    if retrieval_mode not in RETRIEVAL_MODES:
+        return None, None, (jsonify({'error': f"retrieval_mode は {', '.join(RETRIEVAL_MODES)} のいずれかを指定してください。"}), 400)
+    return user_message, retrieval_mode, None
 
 @app.route('/ask', methods=['POST'])
 @login_required
 def ask():
-    """RAGのベクトル検索を使って質問に回答するAPI"""
-    user_message = request.json.get('message')
-    if not user_message:
-        return jsonify({'error': 'メッセージが空です。'}), 400
+    """RAGの検索（キーワード検索+ベクトル検索）を使って質問に回答するAPI（回答全体をまとめて返す）"""
+    user_message, retrieval_mode, error = parse_ask_request()
+    if error:
+        return error
+    context, sources, retrieval_info, error = retrieve_context(user_message, retrieval_mode)
+    if error:
+        return error
 
-    if faiss_index is None:
-        return jsonify({'response': "エラー: ベクトルデータベースが読み込まれていません。"})
+    try:
+        bot_response = llm_client.complete(context, user_message)
+    except Exception as e:
+        print(f"Error: {e}")
+        bot_response = "AIとの通信中にエラーが発生しました。"
 
-    # --- 1. ベクトル検索 (Retrieval) ---
-    # ユーザーの質問をベクトルに変換
-    query_embedding = embedding_model.encode([user_message])
-    
-    # FAISSで類似度が高いチャンクを検索 (上位3件)
-    D, I = faiss_index.search(np.array(query_embedding, dtype=np.float32), 3)
+    return jsonify({'response': bot_response, 'sources': sources, 'retrieval': retrieval_info})
 
-    # 検索結果のチャンクをコンテキストとして結合
-    context_list = [f"【記事タイトル】{chunk_data['references'][i]['title']}\n【内容】\n{chunk_data['chunks'][i]}" for i in I[0]]
-    context = "\n\n---\n\n".join(context_list)
-    
-    # (以降のプロンプト作成とLLMへの送信部分は変更なし)
+def sse_event(event, data):
+    """Server-Sent Events の1イベント分の文字列を作る"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/ask/stream', methods=['POST'])
+@login_required
+def ask_stream():
+    """/ask と同じ質問を受け取り、Server-Sent Events で回答を少しずつ返すAPI。
+
+    最初に参照ページ（sources）を送り、続けてLLMが生成したそばから回答の断片（token）を送る。
+    ブラウザが切断するとジェネレーターが閉じられ、LLMへの接続も閉じて生成を打ち切る。
+    """
+    user_message, retrieval_mode, error = parse_ask_request()
+    if error:
+        return error
+    context, sources, retrieval_info, error = retrieve_context(user_message, retrieval_mode)
+    if error:
+        return error
+
+    def generate():
+        yield sse_event('sources', {'sources': sources, 'retrieval': retrieval_info})
+        tokens = llm_client.stream(context, user_message)
+        try:
+            for token in tokens:
+                yield sse_event('token', {'text': token})
+        except Exception as e:
+            print(f"Error: {e}")
+            yield sse_event('error', {'response': "AIとの通信中にエラーが発生しました。"})
+            return
+        finally:
+            tokens.close()
+        yield sse_event('done', {})
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    # プロキシ（nginx）にバッファリングさせない
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# --- タグの一括変更（管理者のみ） ---
+@app.route('/admin/tags/rename', methods=['POST'])
+@login_required
+def admin_rename_tag():
+    """タグ名を変更する（変更後の名前のタグが既にあれば統合する）。{"old": "...", "new": "..."}"""
+    if current_user.role != 'Admin':
+        abort(403)
+    old_name = (request.json.get('old') or '').strip()
+    new_name = (request.json.get('new') or '').strip()
+    if not old_name or not new_name:
+        return jsonify({'error': 'old と new を指定してください。'}), 400
+    db = get_db()
     try:
-        prompt = f"""
-        あなたは優秀な社内アシスタントです。以下の社内Wikiの情報だけを使って、ユーザーからの質問に日本語で回答してください。
-        情報が見つからない場合は、「関連情報が見つかりませんでした」と正直に答えてください。
+        page_count = rename_tag(db, old_name, new_name)
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+    return jsonify({'pages': page_count})
 
-        --- 参考情報 ---
-        {context}
-        ---
+@app.route('/admin/tags/merge', methods=['POST'])
+@login_required
+def admin_merge_tags():
+    """複数のタグを1つに統合する。{"sources": ["...", ...], "target": "..."}"""
+    if current_user.role != 'Admin':
+        abort(403)
+    source_names = [name.strip() for name in request.json.get('sources') or [] if name.strip()]
+    target_name = (request.json.get('target') or '').strip()
+    if not source_names or not target_name:
+        return jsonify({'error': 'sources と target を指定してください。'}), 400
+    db = get_db()
+    try:
+        page_count = merge_tags(db, source_names, target_name)
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+    return jsonify({'pages': page_count})
 
-        質問: {user_message}
-        回答:
-        """
-        # (デモ用にプロンプトを返す部分はそのまま)
-        bot_response = f"【AIへのプロンプト（デモ）】\n{prompt}"
+@app.route('/admin/render-cache')
+@login_required
+def render_cache_stats():
+    """レンダリングキャッシュのヒット率などを返す（管理者のみ）"""
+    if current_user.role != 'Admin':
+        abort(403)
+    return jsonify(render_cache.stats())
 
-    except Exception as e:
-        print(f"Error: {e}")
-        bot_response = "AIとの通信中にエラーが発生しました。"
+@app.route('/admin/user-cache')
+@login_required
+def user_cache_stats():
+    """ユーザー情報のキャッシュのヒット率などを返す（管理者のみ）"""
+    if current_user.role != 'Admin':
+        abort(403)
+    return jsonify(user_cache.stats())
 
-    return jsonify({'response': bot_response})
+@app.route('/admin/vector-queue')
+@login_required
+def vector_queue_stats():
+    """ベクトル化の予約の件数と遅れを返す（管理者のみ）"""
+    if current_user.role != 'Admin':
+        abort(403)
+    return jsonify(queue_stats(get_db()))
+
+# --- 計測値（Prometheus） ---
+metrics.REGISTRY.register(metrics.Gauge(
+    'wiki_vector_queue_depth', 'ベクトル化を待っているページの数', lambda: queue_stats(get_db())['depth']))
+metrics.REGISTRY.register(metrics.Gauge(
+    'wiki_vector_queue_lag_seconds', 'いちばん古いベクトル化の予約からの秒数', lambda: queue_stats(get_db())['lag_seconds']))
+for stage in ('vector', 'lexical'):
+    metrics.REGISTRY.register(metrics.Gauge(
+        f'wiki_retrieval_{stage}_abandoned', f'時間の上限に間に合わずに捨てたが、まだ動いている検索（{stage}）の数',
+        lambda stage=stage: hybrid_retriever.abandoned[stage]))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """計測値を Prometheus のテキスト形式で返す（このワーカーの分だけ）"""
+    token = app.config['METRICS_TOKEN']
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(403)
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(403)
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# --- ヘルスチェック ---
+@app.route('/healthz')
+def healthz():
+    """プロセスが応答できるかどうか（Wikiページは常に表示できる）"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """AIチャットを受け付けられるかどうか（ロードバランサー用）"""
+    status = retrieval.status()
+    return jsonify(status), (200 if retrieval.is_ready else 503)
 
 # --- エラーハンドリング ---
 @app.errorhandler(404)
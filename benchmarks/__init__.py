@@ -0,0 +1 @@
+# 性能計測用のスクリプト群（リポジトリのルートから python -m benchmarks.<名前> で実行する）
@@ -0,0 +1,75 @@
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from ann_index import INDEX_TYPES, build_index, set_search_params
+
+# FAISSインデックスの種類ごとに、recall@k・検索レイテンシ・インデックスサイズを比較する。
+# 使い方: python -m benchmarks.bench_ann --vectors 100000 --queries 500
+# 埋め込みに近い分布にするため、クラスタ状の乱数ベクトル（384次元）を使う。flat の結果を正解とする。
+
+DIM = 384
+
+
+def synthetic_vectors(n, n_clusters, rng):
+    centers = rng.normal(size=(n_clusters, DIM)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, size=n)
+    vectors = centers[labels] + rng.normal(scale=0.5, size=(n, DIM)).astype(np.float32)
+    return vectors.astype(np.float32)
+
+
+def measure(index, queries, k):
+    """1件ずつ検索したときのレイテンシ (ms) と結果を返す"""
+    latencies = []
+    results = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        D, I = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - started)
+        results[i] = I[0]
+    return np.array(latencies) * 1000, results
+
+
+def recall_at_k(results, ground_truth):
+    hits = sum(len(set(result) & set(truth)) for result, truth in zip(results, ground_truth))
+    return hits / ground_truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vectors', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('-k', type=int, default=3)
+    parser.add_argument('--search-params', default='nprobe=16,efSearch=64')
+    parser.add_argument('--threads', type=int, default=1, help='FAISSが使うスレッド数（Webワーカー1つを想定して既定は1）')
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    rng = np.random.default_rng(0)
+    data = synthetic_vectors(args.vectors + args.queries, max(args.vectors // 200, 10), rng)
+    vectors, queries = data[:args.vectors], data[args.vectors:]
+    ids = np.arange(args.vectors)
+
+    ground_truth = None
+    print(f"ベクトル {args.vectors}件, 質問 {args.queries}件, k={args.k}, 検索パラメータ {args.search_params}")
+    print(f"{'種類':<10}{'構築(秒)':>10}{'サイズ(MB)':>12}{'p50(ms)':>10}{'p99(ms)':>10}{'recall':>10}")
+    for index_type in INDEX_TYPES:
+        started = time.perf_counter()
+        index = build_index(index_type, vectors)
+        index.add_with_ids(vectors, ids)
+        build_seconds = time.perf_counter() - started
+        set_search_params(index, args.search_params)
+
+        size_mb = faiss.serialize_index(index).nbytes / 1024 / 1024
+        latencies, results = measure(index, queries, args.k)
+        if ground_truth is None:
+            ground_truth = results
+        recall = recall_at_k(results, ground_truth)
+        print(f"{index_type:<10}{build_seconds:>10.1f}{size_mb:>12.1f}"
+              f"{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 99):>10.2f}{recall:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
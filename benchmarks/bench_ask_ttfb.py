@@ -0,0 +1,118 @@
+import argparse
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from benchmarks import fake_llm_server
+
+# /ask（回答全体をまとめて返す）と /ask/stream（SSEで少しずつ返す）の
+# 最初の1バイトまでの時間（TTFB）・最初のトークンまでの時間・全体の時間を比較する。
+# LLMは benchmarks.fake_llm_server を使うので、APIキーは不要。
+# 使い方: python -m benchmarks.bench_ask_ttfb --requests 10 --first-token-ms 500 --token-ms 30
+# 既存の wiki.db と、ログインできるユーザー（既定は admin / admin）を使う。
+
+
+def login(port, username, password):
+    """ログインしてセッションのCookieを返す"""
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    body = urllib.parse.urlencode({'username': username, 'password': password})
+    connection.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    cookie = response.getheader('Set-Cookie')
+    if not cookie:
+        raise RuntimeError("ログインに失敗しました。")
+    return cookie.split(';')[0]
+
+
+def post_ask(port, cookie, path, message, retrieval_mode):
+    """質問を送り、(TTFB, 最初のトークンまでの時間, 全体の時間) をミリ秒で返す"""
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    body = json.dumps({'message': message, 'retrieval_mode': retrieval_mode})
+    started = time.perf_counter()
+    connection.request('POST', path, body, {'Content-Type': 'application/json', 'Cookie': cookie})
+    response = connection.getresponse()
+    first_byte = first_token = None
+    while True:
+        line = response.readline()
+        if first_byte is None:
+            first_byte = time.perf_counter()
+        if not line:
+            break
+        if first_token is None and (line.startswith(b'event: token') or path == '/ask'):
+            first_token = time.perf_counter()
+    finished = time.perf_counter()
+    connection.close()
+    return tuple((t - started) * 1000 for t in (first_byte, first_token or finished, finished))
+
+
+def check_cancel(port, cookie, retrieval_mode):
+    """最初のトークンを受け取った時点で切断し、偽LLMサーバー側の生成が打ち切られたかを返す"""
+    before = fake_llm_server.FakeLLMHandler.cancelled
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    body = json.dumps({'message': '経費精算の締め日', 'retrieval_mode': retrieval_mode})
+    connection.request('POST', '/ask/stream', body, {'Content-Type': 'application/json', 'Cookie': cookie})
+    sock = connection.sock
+    response = connection.getresponse()
+    while not response.readline().startswith(b'event: token'):
+        pass
+    response.close()
+    sock.close()
+    # 偽LLMサーバーが次のトークンを書き込もうとして失敗するまで待つ
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        if fake_llm_server.FakeLLMHandler.cancelled > before:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--first-token-ms', type=float, default=500)
+    parser.add_argument('--token-ms', type=float, default=30)
+    parser.add_argument('--retrieval-mode', default='lexical',
+                        help='lexical ならAIモデルを読み込まずにLLM部分だけを比較できる')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin')
+    args = parser.parse_args()
+
+    llm_server, base_url = fake_llm_server.start_server(first_token_ms=args.first_token_ms, token_ms=args.token_ms)
+    # app を import する前に、LLMの接続先を偽LLMサーバーに向ける
+    os.environ['OPENAI_API_KEY'] = 'dummy'
+    os.environ['OPENAI_BASE_URL'] = base_url
+    if args.retrieval_mode == 'lexical':
+        os.environ.setdefault('RETRIEVAL_PRELOAD', '0')
+    from werkzeug.serving import make_server
+    import app as wiki_app
+
+    if args.retrieval_mode != 'lexical':
+        wiki_app.retrieval.start()
+        wiki_app.retrieval.wait()
+    server = make_server('127.0.0.1', 0, wiki_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+    cookie = login(port, args.username, args.password)
+
+    for path in ('/ask', '/ask/stream'):
+        results = np.array([
+            post_ask(port, cookie, path, '経費精算の締め日はいつですか', args.retrieval_mode)
+            for _ in range(args.requests)
+        ])
+        ttfb, first_token, total = (np.percentile(results[:, i], 50) for i in range(3))
+        print(f"{path:12s}: TTFB p50 {ttfb:.0f} ms, 最初のトークン p50 {first_token:.0f} ms, 全体 p50 {total:.0f} ms")
+
+    print(f"切断時にLLMの生成を打ち切れたか: {'はい' if check_cancel(port, cookie, args.retrieval_mode) else 'いいえ'}")
+    server.shutdown()
+    llm_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
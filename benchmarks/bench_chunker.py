@@ -0,0 +1,149 @@
+import argparse
+import os
+import random
+import re
+import tempfile
+
+import faiss
+import numpy as np
+
+from chunk_store import META_DTYPE
+from chunker import SENTENCE_PATTERN, chunk_page, count_tokens, embedding_text, split_paragraphs
+
+# 以前の段落ごとの分割（split_paragraphs）と、Markdownの構造に沿った分割（chunk_page）を比べる。
+#   - チャンク数とトークン数の分布（短すぎる断片・モデルが切り捨てる長さのチャンクの割合）
+#   - FAISSインデックスとチャンクストアのサイズ（本文をコピーする以前の形式と、位置だけを持つ今の形式）
+#   - 検索の品質: ページ本文から取り出した1文を質問にして、その文を含むページ・チャンクが上位k件に入るか
+# 使い方: python -m benchmarks.bench_chunker --pages 2000 --queries 300
+#         python -m benchmarks.bench_chunker --database wiki.db   # 実際のWikiで比べる
+
+# これより短いチャンクを「断片」として数える
+FRAGMENT_TOKENS = 16
+# all-MiniLM-L6-v2 がこれより後ろを切り捨てるトークン数
+MODEL_MAX_TOKENS = 256
+# 以前の形式の meta.npy の1件あたりのバイト数（id・page_id・chunk_no・required_level）
+LEGACY_META_BYTES = 8 + 8 + 4 + 1
+# 質問にする文の最小トークン数（短すぎる文はどのページにもあるので除く）
+MIN_QUERY_TOKENS = 8
+# 質問にしない行（見出し・コード・表の区切り）
+SKIP_LINE_PATTERN = re.compile(r'\s*(#|```|~~~|\|\s*-)')
+
+
+def load_pages(path):
+    import database
+
+    connection = database.connect(path, readonly=True)
+    pages = [(row['id'], row['content']) for row in connection.execute('SELECT id, content FROM pages ORDER BY id')]
+    connection.close()
+    return pages
+
+
+def make_queries(pages, n, rng):
+    """ページ本文から文を取り出し、(質問文, その文を含むページIDの集合) を返す"""
+    candidates = []
+    for page_id, content in rng.sample(pages, min(len(pages), n * 3)):
+        in_code = False
+        sentences = []
+        for line in content.splitlines():
+            if line.lstrip().startswith(('```', '~~~')):
+                in_code = not in_code
+            if in_code or SKIP_LINE_PATTERN.match(line):
+                continue
+            line = re.sub(r'^\s*(?:[-*+]|\d+[.)])\s+|\|', ' ', line)
+            sentences.extend(s.strip() for s in SENTENCE_PATTERN.findall(line)
+                             if count_tokens(s) >= MIN_QUERY_TOKENS)
+        if sentences:
+            candidates.append(rng.choice(sentences))
+        if len(candidates) == n:
+            break
+    return [(query, {page_id for page_id, content in pages if query in content}) for query in candidates]
+
+
+def evaluate(model, pages, splitter, queries, k):
+    """splitter でチャンクに分けて検索し、統計と検索の品質を返す"""
+    page_ids, texts, embed_texts = [], [], []
+    for page_id, content in pages:
+        for chunk in splitter(content):
+            page_ids.append(page_id)
+            texts.append(content[chunk.start:chunk.end])
+            embed_texts.append(embedding_text(content, chunk))
+    tokens = np.array([count_tokens(text) for text in embed_texts])
+    text_bytes = sum(len(text.encode('utf-8')) for text in texts)
+
+    vectors = np.asarray(model.encode(embed_texts, batch_size=64, convert_to_tensor=False), dtype=np.float32)
+    index = faiss.IndexIDMap(faiss.IndexFlatL2(vectors.shape[1]))
+    index.add_with_ids(vectors, np.arange(len(vectors)))
+    with tempfile.NamedTemporaryFile() as f:
+        faiss.write_index(index, f.name)
+        index_bytes = os.path.getsize(f.name)
+
+    query_vectors = np.asarray(model.encode([query for query, _ in queries], convert_to_tensor=False), dtype=np.float32)
+    # 同じページのチャンクが続くことがあるので、多めに取ってからページ単位にまとめる
+    D, I = index.search(query_vectors, k * 4)
+    page_hit_1 = page_hit_k = passage_hit_k = reciprocal_rank = 0
+    for (query, relevant), row in zip(queries, I):
+        ranked_pages = list(dict.fromkeys(page_ids[i] for i in row if i >= 0))[:k]
+        if ranked_pages and ranked_pages[0] in relevant:
+            page_hit_1 += 1
+        for rank, page_id in enumerate(ranked_pages, 1):
+            if page_id in relevant:
+                page_hit_k += 1
+                reciprocal_rank += 1 / rank
+                break
+        if any(query in texts[i] for i in row[:k] if i >= 0):
+            passage_hit_k += 1
+    n = len(queries)
+    return {
+        'chunks': len(texts),
+        'tokens_mean': tokens.mean(),
+        'tokens_p95': np.percentile(tokens, 95),
+        'fragments': np.mean(tokens < FRAGMENT_TOKENS),
+        'truncated': np.mean(tokens > MODEL_MAX_TOKENS),
+        'index_mb': index_bytes / 1024 / 1024,
+        'legacy_store_mb': (text_bytes + 8 * (len(texts) + 1) + LEGACY_META_BYTES * len(texts)) / 1024 / 1024,
+        'store_mb': META_DTYPE.itemsize * len(texts) / 1024 / 1024,
+        'page_hit_1': page_hit_1 / n,
+        'page_hit_k': page_hit_k / n,
+        'mrr': reciprocal_rank / n,
+        'passage_hit_k': passage_hit_k / n,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', help='比べるデータベース（省略すると benchmarks.corpus で作る）')
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    from retrieval import MODEL_NAME
+
+    if args.database:
+        pages = load_pages(args.database)
+    else:
+        from benchmarks.corpus import generate
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'wiki.db')
+            print(f"{args.pages}ページのテストデータを作成中...")
+            generate(path, args.pages, n_tags=50, n_users=20, seed=args.seed)
+            pages = load_pages(path)
+    queries = make_queries(pages, args.queries, random.Random(args.seed))
+    model = SentenceTransformer(MODEL_NAME)
+
+    print(f"ページ {len(pages)}件, 質問 {len(queries)}件, k={args.k}")
+    print(f"{'分け方':<10}{'チャンク数':>10}{'平均トークン':>12}{'p95':>6}{'断片':>8}{'切り捨て':>8}"
+          f"{'索引(MB)':>10}{'本文コピー(MB)':>15}{'位置のみ(MB)':>13}"
+          f"{'page@1':>8}{f'page@{args.k}':>8}{'MRR':>7}{f'passage@{args.k}':>11}")
+    for name, splitter in (('paragraph', split_paragraphs), ('markdown', chunk_page)):
+        r = evaluate(model, pages, splitter, queries, args.k)
+        print(f"{name:<10}{r['chunks']:>10}{r['tokens_mean']:>12.1f}{r['tokens_p95']:>6.0f}{r['fragments']:>8.1%}"
+              f"{r['truncated']:>8.1%}{r['index_mb']:>10.1f}{r['legacy_store_mb']:>15.1f}{r['store_mb']:>13.1f}"
+              f"{r['page_hit_1']:>8.3f}{r['page_hit_k']:>8.3f}{r['mrr']:>7.3f}{r['passage_hit_k']:>11.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import time
+
+import numpy as np
+
+from hybrid_retrieval import HybridRetriever, MODES
+from query_batcher import QueryBatcher
+from retrieval import RetrievalService
+
+# /ask の検索部分の所要時間を、検索方法（vector / hybrid / lexical）ごとに比較する。
+# 使い方: python -m benchmarks.bench_hybrid --requests 200
+# 既存の wiki.db・wiki_faiss.index・チャンクストアを使うので、先に create_vector_store.py を実行しておくこと。
+
+QUESTIONS = [
+    "経費精算の締め日はいつですか",
+    "How do I reset my VPN password?",
+    "新しいページの作り方を教えてください",
+    "議事録のテンプレートはどこにありますか",
+    "What is the on-call rotation policy?",
+    "ABC-123 のチケットの対応状況",
+]
+
+
+def run(retriever, mode, requests, user_level):
+    """1件ずつ検索し、全体と各段階の所要時間（ミリ秒）の一覧と、捨てられた回数を返す"""
+    timings = {'total_ms': [], 'vector_ms': [], 'lexical_ms': []}
+    dropped = 0
+    for i in range(requests):
+        started = time.perf_counter()
+        results, info = retriever.retrieve(QUESTIONS[i % len(QUESTIONS)], k=3, user_level=user_level, mode=mode)
+        timings['total_ms'].append((time.perf_counter() - started) * 1000)
+        for name in ('vector_ms', 'lexical_ms'):
+            if name in info:
+                timings[name].append(info[name])
+        dropped += len(info['dropped'])
+    return timings, dropped
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--database', default='wiki.db')
+    parser.add_argument('--user-level', type=int, default=1, help='検索するユーザーの権限レベル')
+    parser.add_argument('--vector-budget-ms', type=float, default=1000)
+    parser.add_argument('--lexical-budget-ms', type=float, default=200)
+    args = parser.parse_args()
+
+    retrieval = RetrievalService()
+    if not retrieval.wait():
+        print(f"読み込みに失敗しました: {retrieval.error}")
+        return
+    batcher = QueryBatcher(retrieval)
+    retriever = HybridRetriever(batcher.search, args.database,
+                                vector_budget_ms=args.vector_budget_ms, lexical_budget_ms=args.lexical_budget_ms)
+    # ウォームアップ
+    for mode in MODES:
+        retriever.retrieve(QUESTIONS[0], k=3, user_level=args.user_level, mode=mode)
+
+    for mode in ('vector', 'hybrid', 'lexical'):
+        timings, dropped = run(retriever, mode, args.requests, args.user_level)
+        line = [f"{mode:8s}"]
+        for name, values in timings.items():
+            if values:
+                line.append(f"{name[:-3]} p50 {np.percentile(values, 50):.1f} ms / p99 {np.percentile(values, 99):.1f} ms")
+        print(', '.join(line) + f", 上限超過 {dropped}回")
+
+
+if __name__ == '__main__':
+    main()
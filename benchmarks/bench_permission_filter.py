@@ -0,0 +1,131 @@
+import argparse
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from ann_index import build_index, set_search_params
+from chunk_store import ChunkStore, ChunkStoreWriter, text_checksum
+from permissions import PERMISSION_MAP, VIEWER_LEVELS
+from retrieval import STATE_READY, RetrievalService
+
+# 権限付きのベクトル検索を検証・計測する。
+# 1. IDSelectorで絞り込んだ検索が、閲覧できないチャンクを一度も返さず、常にk件返すことを確認する
+# 2. 同じ結果を「多めに取ってからPythonで取り除く」方式と比べたレイテンシを表示する
+# 使い方: python -m benchmarks.bench_permission_filter --chunks 100000 --index-type flat
+
+DIM = 384
+# 1ページあたりのチャンク数（ページ本文は "chunk 00000000\n" の行を並べたもの）
+CHUNKS_PER_PAGE = 8
+LINE_LENGTH = len('chunk 00000000\n')
+
+
+class VectorModel:
+    """質問文の代わりにベクトルをそのまま受け取る、計測用の埋め込みモデル"""
+
+    def encode(self, queries):
+        return np.vstack(queries)
+
+
+def page_content(page_id):
+    first = page_id * CHUNKS_PER_PAGE
+    return ''.join(f"chunk {i:08d}\n" for i in range(first, first + CHUNKS_PER_PAGE))
+
+
+def build_service(directory, n_chunks, index_type, search_params, rng):
+    vectors = rng.normal(size=(n_chunks, DIM)).astype(np.float32)
+    # 公開範囲の狭いページほど少なくなるように、権限レベルを割り当てる
+    levels = rng.choice(sorted(PERMISSION_MAP.values()), size=n_chunks, p=[0.1, 0.5, 0.2, 0.2])
+
+    prefix = os.path.join(directory, 'wiki_chunks')
+    writer = ChunkStoreWriter(prefix)
+    for i in range(n_chunks):
+        start = i % CHUNKS_PER_PAGE * LINE_LENGTH
+        writer.add(i, i // CHUNKS_PER_PAGE, i % CHUNKS_PER_PAGE, start, start + LINE_LENGTH - 1,
+                   text_checksum(f"chunk {i:08d}"), int(levels[i]))
+    writer.close()
+
+    index = build_index(index_type, vectors)
+    index.add_with_ids(vectors, np.arange(n_chunks))
+    set_search_params(index, search_params)
+
+    service = RetrievalService(chunk_store_prefix=prefix)
+    service.embedding_model = VectorModel()
+    service.faiss_index = index
+    service.chunk_store = ChunkStore(prefix)
+    # データベースの代わりに、ページ本文をその場で作る
+    service.page_contents = lambda page_ids: {page_id: page_content(page_id) for page_id in page_ids}
+    service.state = STATE_READY
+    return service
+
+
+def post_filter_search(service, query, k, user_level):
+    """比較用: 多めに検索し、閲覧できないチャンクをPythonで取り除く（足りなければ取り直す）"""
+    fetch = k * 4
+    while True:
+        D, I = service.faiss_index.search(query, fetch)
+        results = []
+        for i in I[0]:
+            if i < 0:
+                continue
+            page_id, chunk_no, start, end = service.chunk_store.get(int(i))
+            if service.chunk_store.meta[service.chunk_store.position(int(i))]['required_level'] >= user_level:
+                results.append((page_id, page_content(page_id)[start:end]))
+                if len(results) == k:
+                    return results
+        if fetch >= service.faiss_index.ntotal:
+            return results
+        fetch *= 4
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=3)
+    parser.add_argument('--index-type', default='flat')
+    parser.add_argument('--search-params', default='nprobe=16,efSearch=64')
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        service = build_service(directory, args.chunks, args.index_type, args.search_params, rng)
+        store = service.chunk_store
+        queries = rng.normal(size=(args.queries, DIM)).astype(np.float32)
+
+        print(f"チャンク {args.chunks}件, 質問 {args.queries}件, k={args.k}, インデックス {args.index_type}")
+        for user_level in VIEWER_LEVELS:
+            # ウォームアップ（レベル別のIDSelectorを作っておく）
+            service.search(queries[:1], args.k, user_level)
+
+            selector_times, post_times = [], []
+            for query in queries:
+                query = query.reshape(1, -1)
+                started = time.perf_counter()
+                results = service.search(query, args.k, user_level)
+                selector_times.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                post_filter_search(service, query, args.k, user_level)
+                post_times.append(time.perf_counter() - started)
+
+                # 閲覧できないチャンクが含まれていないこと・k件そろっていることを確認する
+                assert len(results) == args.k, f"レベル{user_level}で{len(results)}件しか返りませんでした"
+                for page_id, text in results:
+                    faiss_id = int(text.split()[1])
+                    level = int(store.meta[store.position(faiss_id)]['required_level'])
+                    assert level >= user_level, f"レベル{user_level}のユーザーにレベル{level}のチャンクが返りました"
+
+            visible = len(store.allowed_ids(user_level)) / len(store)
+            print(f"レベル{user_level} (閲覧可能 {visible:.0%}): "
+                  f"IDSelector p50 {np.percentile(selector_times, 50) * 1000:.2f} ms / "
+                  f"後から除外 p50 {np.percentile(post_times, 50) * 1000:.2f} ms, "
+                  f"p99 {np.percentile(selector_times, 99) * 1000:.2f} ms / {np.percentile(post_times, 99) * 1000:.2f} ms")
+        print("閲覧できないチャンクは一度も返りませんでした。")
+
+
+if __name__ == '__main__':
+    main()
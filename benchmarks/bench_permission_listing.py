@@ -0,0 +1,100 @@
+import argparse
+import sqlite3
+import time
+
+from listing import list_pages
+from permissions import ANONYMOUS_LEVEL, PERMISSION_MAP
+
+# ページ一覧の権限の絞り込みを検証・計測する。
+# 閲覧できるページの数は変えずに、閲覧できない（管理者のみの）ページだけを増やしていき、
+#   1. 一覧に閲覧できないページが1件も出ず、閲覧できるページが漏れなく出ること
+#   2. 1ページ分を取り出す手間（SQLiteの仮想マシンの命令数と時間）が増えないこと
+# を確かめる。比較用に「required_level >= ? で絞って id 順に読む」だけの1本のSQLも計測する。
+# 一時的なインメモリDBに schema.sql を流して計測するので、wiki.db には触れない。
+# 使い方: python -m benchmarks.bench_permission_listing --visible 2000 --hidden 0 10000 100000
+
+# 命令数を数える間隔（progress handler は N 命令ごとに呼ばれる）
+PROGRESS_STEP = 100
+
+
+def connect(n_visible, n_hidden):
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    with open('schema.sql', encoding='utf-8') as f:
+        db.executescript(f.read())
+    db.execute("INSERT INTO users (username, password, role) VALUES ('bench', '', 'Admin')")
+    # 閲覧できるページを、閲覧できないページの間に均等に混ぜる
+    total = n_visible + n_hidden
+    step = total / n_visible
+    visible_positions = {int(i * step) for i in range(n_visible)}
+    rows = []
+    for i in range(total):
+        permission_level = '全員に公開' if i in visible_positions else '管理者のみ'
+        rows.append((f'ページ{i}', '本文', permission_level, PERMISSION_MAP[permission_level],
+                     f'2026-01-01 00:00:{i % 60:02d}.{i % 1000:03d}'))
+    db.executemany(
+        'INSERT INTO pages (title, content, author_id, permission_level, required_level, updated_at) VALUES (?, ?, 1, ?, ?, ?)',
+        rows
+    )
+    db.commit()
+    return db
+
+
+def count_steps(db, func):
+    """func() を実行し、(結果, SQLiteの仮想マシンの命令数, 秒数) を返す"""
+    steps = [0]
+
+    def progress():
+        steps[0] += PROGRESS_STEP
+        return 0
+
+    db.set_progress_handler(progress, PROGRESS_STEP)
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    db.set_progress_handler(None, PROGRESS_STEP)
+    return result, steps[0], elapsed
+
+
+def naive_list(db, user_level, limit):
+    """比較用: 1本のSQLで id の降順に読みながら、閲覧できないページを読み飛ばす"""
+    return db.execute('SELECT id, title FROM pages WHERE required_level >= ? ORDER BY id DESC LIMIT ?',
+                      (user_level, limit)).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--visible', type=int, default=2000)
+    parser.add_argument('--hidden', type=int, nargs='+', default=[0, 10000, 100000])
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+    user_level = ANONYMOUS_LEVEL
+
+    for n_hidden in args.hidden:
+        db = connect(args.visible, n_hidden)
+
+        # 1. 最後までたどって、閲覧できるページだけが漏れなく出ることを確認する
+        seen = []
+        cursor = None
+        page_steps = []
+        while True:
+            (pages, cursor), steps, elapsed = count_steps(
+                db, lambda: list_pages(db, 'new', cursor, args.limit, user_level))
+            page_steps.append(steps)
+            seen.extend(page['id'] for page in pages)
+            if not cursor:
+                break
+        visible_ids = {row['id'] for row in db.execute('SELECT id FROM pages WHERE required_level >= ?', (user_level,))}
+        assert set(seen) == visible_ids and len(seen) == len(visible_ids), "閲覧できるページが正しく一覧に出ていません"
+
+        # 2. 1ページ目を取り出す手間
+        (pages, cursor), steps, elapsed = count_steps(db, lambda: list_pages(db, 'new', None, args.limit, user_level))
+        _, naive_steps, naive_elapsed = count_steps(db, lambda: naive_list(db, user_level, args.limit))
+        print(f"隠れたページ {n_hidden:7d}件: レベル別インデックス {steps:6d}命令 {elapsed * 1000:.2f} ms "
+              f"(全ページの平均 {sum(page_steps) / len(page_steps):.0f}命令), "
+              f"1本のSQL {naive_steps:7d}命令 {naive_elapsed * 1000:.2f} ms")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
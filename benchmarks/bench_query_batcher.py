@@ -0,0 +1,77 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from query_batcher import QueryBatcher
+from retrieval import RetrievalService
+
+# /ask の検索部分を、1件ずつ処理する場合とまとめて処理する場合で比較する。
+# 使い方: python -m benchmarks.bench_query_batcher --clients 32 --requests 20
+# 既存の wiki_faiss.index とチャンクストアを使うので、先に create_vector_store.py を実行しておくこと。
+
+QUESTIONS = [
+    "経費精算の締め日はいつですか",
+    "How do I reset my VPN password?",
+    "新しいページの作り方を教えてください",
+    "議事録のテンプレートはどこにありますか",
+    "What is the on-call rotation policy?",
+    "タグの付け方",
+]
+
+
+def run(search, clients, requests_per_client):
+    """clients個のスレッドから同時に検索し、(スループット, p50, p99) を返す"""
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def client(n):
+        barrier.wait()
+        local = []
+        for i in range(requests_per_client):
+            question = QUESTIONS[(n + i) % len(QUESTIONS)]
+            started = time.perf_counter()
+            search(question, 3)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array(latencies) * 1000
+    return len(latencies) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=20, help='1クライアントあたりの質問数')
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    retrieval = RetrievalService()
+    if not retrieval.wait():
+        print(f"読み込みに失敗しました: {retrieval.error}")
+        return
+    # ウォームアップ
+    retrieval.search(QUESTIONS[0], 3)
+
+    batcher = QueryBatcher(retrieval, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    for name, search in (('1件ずつ', retrieval.search), ('まとめて', batcher.search)):
+        throughput, p50, p99 = run(search, args.clients, args.requests)
+        print(f"{name}: {throughput:.1f} 件/秒, p50 {p50:.1f} ms, p99 {p99:.1f} ms")
+    print(f"平均バッチサイズ: {batcher.stats()['average_batch_size']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import random
+import sqlite3
+import time
+import zlib
+
+import numpy as np
+
+from revisions import MAX_CHAIN_LENGTH, get_revision, record_revision
+
+# 何千回も編集されたページの版の履歴について、保存サイズと過去の版を読む時間を計測する。
+# 比較用に「版ごとに本文を丸ごと保存した場合」と「丸ごと zlib で圧縮した場合」のサイズも出す。
+# 一時的なインメモリDBに schema.sql を流して計測するので、wiki.db には触れない。
+# 使い方: python -m benchmarks.bench_revisions --edits 3000 --lines 400 --reads 500
+
+
+def connect():
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    with open('schema.sql', encoding='utf-8') as f:
+        db.executescript(f.read())
+    db.execute("INSERT INTO users (username, password, role) VALUES ('bench', '', 'Admin')")
+    return db
+
+
+def random_line(rng):
+    return ''.join(rng.choice('あいうえおかきくけこさしすせそabcdefg0123456789 ') for _ in range(rng.randint(20, 80))) + '\n'
+
+
+def edit(lines, rng):
+    """1〜3行を書き換え・挿入・削除する"""
+    lines = list(lines)
+    for _ in range(rng.randint(1, 3)):
+        i = rng.randrange(len(lines))
+        action = rng.random()
+        if action < 0.6:
+            lines[i] = random_line(rng)
+        elif action < 0.8 or len(lines) < 10:
+            lines.insert(i, random_line(rng))
+        else:
+            del lines[i]
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--edits', type=int, default=3000)
+    parser.add_argument('--lines', type=int, default=400)
+    parser.add_argument('--reads', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    db = connect()
+    lines = [random_line(rng) for _ in range(args.lines)]
+    content = ''.join(lines)
+    cur = db.execute("INSERT INTO pages (title, content, author_id) VALUES ('bench', ?, 1)", (content,))
+    page_id = cur.lastrowid
+    record_revision(db, page_id, 'bench', content, 1)
+    full_bytes = len(content.encode('utf-8'))
+    full_zlib_bytes = len(zlib.compress(content.encode('utf-8')))
+
+    write_times = []
+    for _ in range(args.edits):
+        previous = db.execute('SELECT * FROM pages WHERE id = ?', (page_id,)).fetchone()
+        lines = edit(lines, rng)
+        content = ''.join(lines)
+        db.execute('UPDATE pages SET content = ? WHERE id = ?', (content, page_id))
+        started = time.perf_counter()
+        record_revision(db, page_id, 'bench', content, 1, previous=previous)
+        write_times.append(time.perf_counter() - started)
+        full_bytes += len(content.encode('utf-8'))
+        full_zlib_bytes += len(zlib.compress(content.encode('utf-8')))
+    db.commit()
+
+    stored_bytes, revisions, snapshots = db.execute(
+        'SELECT sum(length(data)), count(*), sum(is_snapshot) FROM page_revisions WHERE page_id = ?', (page_id,)
+    ).fetchone()
+
+    read_times = []
+    for revision in (rng.randint(1, revisions) for _ in range(args.reads)):
+        started = time.perf_counter()
+        found = get_revision(db, page_id, revision)
+        read_times.append(time.perf_counter() - started)
+        assert found is not None
+    # 最新の版が pages の本文と一致すること
+    assert get_revision(db, page_id, revisions)[1] == content
+
+    write_ms = np.array(write_times) * 1000
+    read_ms = np.array(read_times) * 1000
+    print(f"{revisions}版（スナップショット {snapshots}、差分の最大連続 {MAX_CHAIN_LENGTH - 1}）")
+    print(f"保存サイズ: 丸ごと {full_bytes / 1024 / 1024:.1f} MB, 丸ごと+zlib {full_zlib_bytes / 1024 / 1024:.2f} MB, "
+          f"スナップショット+差分 {stored_bytes / 1024 / 1024:.2f} MB")
+    print(f"版の保存: p50 {np.percentile(write_ms, 50):.2f} ms, p99 {np.percentile(write_ms, 99):.2f} ms")
+    print(f"任意の版の読み込み: p50 {np.percentile(read_ms, 50):.2f} ms, p99 {np.percentile(read_ms, 99):.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
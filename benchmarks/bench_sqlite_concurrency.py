@@ -0,0 +1,129 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from database import ConnectionManager
+from listing import list_pages
+from permissions import ANONYMOUS_LEVEL
+
+# 読み込みと書き込みが同時に走るときのSQLiteの接続方式を比べる。
+#   old : 操作ごとに sqlite3.connect() で開いて閉じる（以前の app.py と同じ。ジャーナルは既定の DELETE）
+#   new : database.ConnectionManager でスレッドごとの接続を使い回す（WAL, synchronous=NORMAL など）
+# 読み込みスレッドはページ一覧と個別ページを読み、書き込みスレッドはページ本文を更新してコミットする。
+# 一時ディレクトリにDBを作って計測するので、wiki.db には触れない。
+# 使い方: python -m benchmarks.bench_sqlite_concurrency --pages 5000 --readers 8 --writers 2 --seconds 5
+
+
+def create_database(path, n_pages):
+    connection = sqlite3.connect(path)
+    with open('schema.sql', encoding='utf-8') as f:
+        connection.executescript(f.read())
+    connection.execute("INSERT INTO users (username, password, role) VALUES ('bench', '', 'Admin')")
+    connection.executemany(
+        'INSERT INTO pages (title, content, author_id, permission_level, required_level) VALUES (?, ?, 1, ?, ?)',
+        ((f'ページ{i}', f'本文{i}\n\n' * 20, '全員に公開', 5) for i in range(n_pages))
+    )
+    connection.commit()
+    connection.close()
+
+
+def read_once(db, page_id):
+    list_pages(db, 'updated', None, 50, ANONYMOUS_LEVEL)
+    db.execute('SELECT * FROM pages WHERE id = ?', (page_id,)).fetchone()
+
+
+def write_once(db, page_id, i):
+    db.execute('UPDATE pages SET content = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', (f'更新{i}', page_id))
+    db.commit()
+
+
+def run(mode, path, n_pages, n_readers, n_writers, seconds):
+    manager = ConnectionManager(path)
+
+    def get_connection(readonly):
+        if mode == 'new':
+            return manager.connection(readonly=readonly)
+        connection = sqlite3.connect(path)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    latencies = {'read': [], 'write': []}
+    errors = {'read': 0, 'write': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(kind, seed):
+        rng = np.random.default_rng(seed)
+        own = []
+        failed = 0
+        i = 0
+        while time.perf_counter() < deadline:
+            page_id = int(rng.integers(1, n_pages + 1))
+            started = time.perf_counter()
+            db = get_connection(readonly=(kind == 'read'))
+            try:
+                if kind == 'read':
+                    read_once(db, page_id)
+                else:
+                    write_once(db, page_id, i)
+                own.append(time.perf_counter() - started)
+            except sqlite3.OperationalError:
+                # busy_timeout を過ぎてもロックが取れなかった（database is locked）
+                failed += 1
+                if db.in_transaction:
+                    db.rollback()
+            finally:
+                if mode == 'old':
+                    db.close()
+            i += 1
+        if mode == 'new':
+            manager.close()
+        with lock:
+            latencies[kind].extend(own)
+            errors[kind] += failed
+
+    threads = [threading.Thread(target=worker, args=('read', n)) for n in range(n_readers)]
+    threads += [threading.Thread(target=worker, args=('write', 1000 + n)) for n in range(n_writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = {}
+    for kind in ('read', 'write'):
+        values = np.array(latencies[kind]) * 1000
+        results[kind] = {
+            'ops_per_sec': len(values) / seconds,
+            'p50_ms': float(np.percentile(values, 50)) if len(values) else 0.0,
+            'p99_ms': float(np.percentile(values, 99)) if len(values) else 0.0,
+            'errors': errors[kind],
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=5000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ('old', 'new'):
+            path = os.path.join(directory, f'{mode}.db')
+            create_database(path, args.pages)
+            results = run(mode, path, args.pages, args.readers, args.writers, args.seconds)
+            for kind, label in (('read', '読み込み'), ('write', '書き込み')):
+                r = results[kind]
+                print(f"{mode:3s} {label}: {r['ops_per_sec']:8.0f} 回/秒  p50 {r['p50_ms']:7.2f} ms  "
+                      f"p99 {r['p99_ms']:7.2f} ms  ロックエラー {r['errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import sqlite3
+import time
+
+from tag_service import merge_tags, rename_tag, set_page_tags
+
+# タグの保存処理を、これまでの「タグごとに SELECT → INSERT」のループと、
+# tag_service（まとめて解決し、差分だけを反映）で比較する。
+# 一時的なインメモリDBに schema.sql を流して計測するので、wiki.db には触れない。
+# 使い方: python -m benchmarks.bench_tags --pages 200 --tags 50
+
+
+def connect():
+    db = sqlite3.connect(':memory:')
+    with open('schema.sql', encoding='utf-8') as f:
+        db.executescript(f.read())
+    db.execute("INSERT INTO users (username, password, role) VALUES ('bench', '', 'Admin')")
+    return db
+
+
+def add_pages(db, n_pages):
+    db.executemany('INSERT INTO pages (title, content, author_id) VALUES (?, ?, 1)',
+                   ((f'ページ{i}', f'本文{i}') for i in range(n_pages)))
+    db.commit()
+    return [row[0] for row in db.execute('SELECT id FROM pages ORDER BY id')]
+
+
+def loop_set_tags(db, page_id, names):
+    """比較用: これまでの app.py の処理（全部消してから1つずつ引いて入れ直す）"""
+    db.execute('DELETE FROM page_tags WHERE page_id = ?', (page_id,))
+    for name in names:
+        cur = db.execute('SELECT id FROM tags WHERE name = ?', (name,))
+        tag = cur.fetchone()
+        if tag:
+            tag_id = tag[0]
+        else:
+            cur = db.execute('INSERT INTO tags (name) VALUES (?)', (name,))
+            tag_id = cur.lastrowid
+        db.execute('INSERT INTO page_tags (page_id, tag_id) VALUES (?, ?)', (page_id, tag_id))
+
+
+def page_tags(db):
+    cur = db.execute('SELECT pt.page_id, t.name FROM page_tags pt JOIN tags t ON t.id = pt.tag_id')
+    return sorted(cur.fetchall())
+
+
+def run(set_tags, n_pages, n_tags):
+    """全ページにタグを付けてから、各ページのタグを1つだけ変えて保存し直す。(作成, 編集) の秒数を返す。"""
+    db = connect()
+    page_ids = add_pages(db, n_pages)
+    tag_sets = {page_id: [f'タグ{(page_id + j) % (n_tags * 2)}' for j in range(n_tags)] for page_id in page_ids}
+
+    started = time.perf_counter()
+    for page_id in page_ids:
+        set_tags(db, page_id, tag_sets[page_id])
+        db.commit()
+    create_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for page_id in page_ids:
+        set_tags(db, page_id, tag_sets[page_id][1:] + [f'新タグ{page_id % 10}'])
+        db.commit()
+    edit_elapsed = time.perf_counter() - started
+    return create_elapsed, edit_elapsed, db
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--tags', type=int, default=50, help='1ページあたりのタグ数')
+    args = parser.parse_args()
+
+    results = {}
+    for name, set_tags in (('ループ', loop_set_tags), ('tag_service', set_page_tags)):
+        create_elapsed, edit_elapsed, db = run(set_tags, args.pages, args.tags)
+        results[name] = db
+        print(f"{name:12s}: 作成 {create_elapsed / args.pages * 1000:.2f} ms/ページ, "
+              f"編集 {edit_elapsed / args.pages * 1000:.2f} ms/ページ")
+    assert page_tags(results['ループ']) == page_tags(results['tag_service']), "保存結果が一致しません"
+
+    # タグ名の変更・統合（全ページに付いているタグを一括で付け替える）
+    db = results['tag_service']
+    started = time.perf_counter()
+    renamed = rename_tag(db, 'タグ1', 'タグ名変更')
+    merged = merge_tags(db, ['タグ2', 'タグ3', 'タグ4'], 'タグ名変更')
+    db.commit()
+    elapsed = time.perf_counter() - started
+    fts_hits = db.execute("SELECT count(*) FROM pages_fts WHERE pages_fts MATCH '\"タグ名変更\"'").fetchone()[0]
+    with_tag = db.execute("SELECT count(*) FROM page_tags pt JOIN tags t ON t.id = pt.tag_id "
+                          "WHERE t.name = 'タグ名変更'").fetchone()[0]
+    assert fts_hits == with_tag, "全文検索インデックスのタグが更新されていません"
+    print(f"名前の変更（{renamed}ページ）+ 統合（{merged}ページ）: {elapsed * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
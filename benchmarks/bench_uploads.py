@@ -0,0 +1,86 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# 大きな添付ファイルをアップロードしても、メモリの使用量が増えないことを確かめる。
+# ファイルの大きさを変えて /new に添付し、Pythonのメモリ確保の最大値（tracemalloc）を比べる。
+# 同じ内容のファイルを2回添付して、ファイルが1つしか置かれないこと（重複排除）も確かめる。
+# 一時ディレクトリに wiki.db と uploads/ を作って計測するので、実際のデータには触れない。
+# 使い方: python -m benchmarks.bench_uploads --sizes-mb 1 64 256
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WRITE_BLOCK = 1024 * 1024
+
+
+def make_file(path, size):
+    """size バイトのランダムなファイルを少しずつ書いて作る"""
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            block = os.urandom(min(WRITE_BLOCK, remaining))
+            f.write(block)
+            remaining -= len(block)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes-mb', type=int, nargs='+', default=[1, 64, 256])
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench-uploads-')
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(work_dir)
+    os.environ['RETRIEVAL_PRELOAD'] = '0'
+    try:
+        import database
+        from flask_bcrypt import Bcrypt
+        connection = database.connect()
+        with open(os.path.join(REPO_ROOT, 'schema.sql'), encoding='utf-8') as f:
+            connection.executescript(f.read())
+        password = Bcrypt().generate_password_hash('bench').decode('utf-8')
+        connection.execute("INSERT INTO users (username, password, role) VALUES ('bench', ?, 'Admin')", (password,))
+        connection.commit()
+        connection.close()
+
+        import app as wiki
+        client = wiki.app.test_client()
+        client.post('/login', data={'username': 'bench', 'password': 'bench'})
+
+        for size_mb in args.sizes_mb:
+            path = os.path.join(work_dir, f'data-{size_mb}.pdf')
+            make_file(path, size_mb * 1024 * 1024)
+            tracemalloc.start()
+            started = time.perf_counter()
+            for i in range(2):
+                with open(path, 'rb') as f:
+                    response = client.post('/new', data={
+                        'title': f'{size_mb}MB-{i}', 'content': '本文', 'tags': '', 'permission_level': '全員に公開',
+                        'upload_file': (f, f'{size_mb}MB.pdf'),
+                    })
+                assert response.status_code == 302, response.status_code
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            db = database.connect()
+            rows = db.execute('SELECT DISTINCT sha256 FROM uploads WHERE filename = ?', (f'{size_mb}MB.pdf',)).fetchall()
+            db.close()
+            assert len(rows) == 1, "同じ内容のファイルが別々に保存されています"
+            stored = os.path.getsize(wiki.upload_store.object_path(rows[0]['sha256']))
+            assert stored == size_mb * 1024 * 1024
+            leftovers = os.listdir(wiki.upload_store.tmp_dir)
+            assert not leftovers, f"一時ファイルが残っています: {leftovers}"
+            print(f"{size_mb:5d} MB x2: メモリ確保の最大 {peak / 1024 / 1024:6.2f} MB  "
+                  f"{elapsed:6.2f} 秒  保存されたファイル 1個 ({stored // 1024 // 1024} MB)")
+            os.remove(path)
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
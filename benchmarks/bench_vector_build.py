@@ -0,0 +1,93 @@
+import argparse
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from benchmarks.corpus import generate
+from benchmarks.suite import REPO_ROOT, run_script
+
+# ベクトルDBの全件作成を、以前の方式（全件を読み込んでから一度に encode する）と
+# 流れ作業の create_vector_store.py で比べ、ページ/秒と最大RSSを表示する。
+# どちらも埋め込みキャッシュが空の状態から実行する（モデルの読み込み時間も含む）。
+# 使い方: python -m benchmarks.bench_vector_build --pages 10000 --workers 1 4
+
+
+def legacy_build():
+    """子プロセス: 以前の create_vector_store.py と同じ手順でベクトルDBを作る"""
+    import faiss
+    from sentence_transformers import SentenceTransformer
+
+    import database
+    from ann_index import DEFAULT_INDEX_TYPE, build_index
+    from chunk_store import ChunkStoreWriter, text_checksum
+    from chunker import split_paragraphs
+    from embedding_cache import EmbeddingCache
+    from permissions import required_level
+    from retrieval import INDEX_PATH, MODEL_NAME
+
+    model = SentenceTransformer(MODEL_NAME)
+    connection = database.connect()
+    pages = connection.execute('SELECT id, title, content, permission_level, updated_at FROM pages').fetchall()
+    chunks = []
+    references = []
+    for page in pages:
+        for chunk_no, chunk in enumerate(split_paragraphs(page['content'])):
+            text = page['content'][chunk.start:chunk.end]
+            chunks.append(text)
+            references.append((page['id'], chunk_no, chunk.start, chunk.end, text_checksum(text),
+                               required_level(page['permission_level'])))
+    embedding_cache = EmbeddingCache()
+    embeddings = np.array(embedding_cache.encode(model, MODEL_NAME, chunks), dtype=np.float32)
+    embedding_cache.close()
+    index = build_index(DEFAULT_INDEX_TYPE, embeddings)
+    index.add_with_ids(embeddings, np.arange(len(chunks)))
+    faiss.write_index(index, INDEX_PATH)
+    writer = ChunkStoreWriter()
+    for faiss_id, reference in enumerate(references):
+        writer.add(faiss_id, *reference)
+    writer.close()
+    connection.executemany('UPDATE pages SET vectorized_at = ? WHERE id = ?',
+                           [(page['updated_at'], page['id']) for page in pages])
+    connection.commit()
+    connection.close()
+
+
+def fresh_workdir(directory, name, db_path):
+    """計測ごとに、同じデータベースをコピーした作業用のディレクトリを作る"""
+    workdir = os.path.join(directory, name)
+    os.makedirs(workdir)
+    shutil.copy(db_path, os.path.join(workdir, 'wiki.db'))
+    return workdir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=10000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--legacy', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.legacy:
+        legacy_build()
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'wiki.db')
+        print(f"{args.pages}ページのテストデータを作成中...")
+        generate(db_path, args.pages, n_tags=50, n_users=20, seed=args.seed)
+
+        runs = [('以前の方式', ['-m', 'benchmarks.bench_vector_build', '--legacy'])]
+        for workers in args.workers:
+            runs.append((f"流れ作業 workers={workers}",
+                         [os.path.join(REPO_ROOT, 'create_vector_store.py'), '--workers', str(workers)]))
+        for i, (name, script_args) in enumerate(runs):
+            seconds, rss = run_script(script_args, fresh_workdir(directory, f"run{i}", db_path))
+            # create_vector_store.py の encode のプロセスの分は含まない（ワーカー数に比例して増える）
+            print(f"{name:>22}: {seconds:8.1f} 秒, {args.pages / seconds:8.1f} ページ/秒, 最大RSS {rss:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
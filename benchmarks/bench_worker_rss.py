@@ -0,0 +1,116 @@
+import argparse
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+# chunks.pkl（旧形式）と mmap のチャンクストアで、ワーカー1つあたりのメモリ使用量を比較する。
+# （チャンクストアには本文がないので、mmap 側は検索したチャンクの位置を引くところまでを計る）
+# 使い方: python -m benchmarks.bench_worker_rss --chunks 200000 --workers 4
+# 同じファイルを開いたワーカーを複数起動し、各プロセスの RSS と PSS（共有分を按分した値）を表示する。
+
+DIM = 384
+
+
+def build_corpus(directory, n_chunks):
+    """ダミーのチャンクとFAISSインデックスを両方の形式で作る"""
+    import faiss
+    from chunk_store import ChunkStoreWriter, text_checksum
+
+    rng = np.random.default_rng(0)
+    chunks = [f"ページ{i // 8}の段落{i % 8}。" + "社内Wikiのサンプル本文です。" * 10 for i in range(n_chunks)]
+    references = [{'page_id': i // 8, 'title': f"ページ{i // 8}"} for i in range(n_chunks)]
+
+    with open(os.path.join(directory, 'chunks.pkl'), 'wb') as f:
+        pickle.dump({'chunks': chunks, 'references': references}, f)
+
+    writer = ChunkStoreWriter(os.path.join(directory, 'wiki_chunks'))
+    for i, chunk in enumerate(chunks):
+        writer.add(i, i // 8, i % 8, 0, len(chunk), text_checksum(chunk))
+    writer.close()
+
+    index = faiss.IndexIDMap(faiss.IndexFlatL2(DIM))
+    index.add_with_ids(rng.random((n_chunks, DIM), dtype=np.float32), np.arange(n_chunks))
+    faiss.write_index(index, os.path.join(directory, 'wiki_faiss.index'))
+
+
+def memory_usage():
+    """/proc から RSS と PSS (kB) を読む"""
+    usage = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            key, value = line.split(':', 1)
+            if key in ('Rss', 'Pss', 'Pss_Anon', 'Pss_File'):
+                usage[key] = int(value.split()[0])
+    return usage
+
+
+def worker(directory, mode):
+    """子プロセス: 指定された形式で読み込み、何回か検索してからメモリ量を出力する"""
+    import faiss
+
+    if mode == 'pickle':
+        index = faiss.read_index(os.path.join(directory, 'wiki_faiss.index'))
+        with open(os.path.join(directory, 'chunks.pkl'), 'rb') as f:
+            chunk_data = pickle.load(f)
+        get_text = lambda i: chunk_data['chunks'][i]
+    else:
+        from chunk_store import ChunkStore
+        from retrieval import read_index_mmap
+
+        index = read_index_mmap(os.path.join(directory, 'wiki_faiss.index'))
+        store = ChunkStore(os.path.join(directory, 'wiki_chunks'))
+        get_text = lambda i: store.get(i)
+
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        D, I = index.search(rng.random((1, DIM), dtype=np.float32), 3)
+        for i in I[0]:
+            get_text(int(i))
+
+    usage = memory_usage()
+    print(f"{usage['Rss']} {usage['Pss']}", flush=True)
+    # 全ワーカーが読み込み終わるまで待つ（PSSを正しく按分させるため）
+    sys.stdin.read()
+
+
+def measure(directory, mode, workers):
+    procs = [
+        subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_worker_rss', '--worker', mode, '--dir', directory],
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        for _ in range(workers)
+    ]
+    first = [proc.stdout.readline() for proc in procs]
+    for proc in procs:
+        proc.stdin.close()
+        proc.wait()
+    rss = [int(line.split()[0]) for line in first]
+    pss = [int(line.split()[1]) for line in first]
+    return sum(rss) / workers / 1024, sum(pss) / workers / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--worker', choices=['pickle', 'mmap'])
+    parser.add_argument('--dir')
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.dir, args.worker)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{args.chunks}個のチャンクでテストデータを作成中...")
+        build_corpus(directory, args.chunks)
+        for mode in ('pickle', 'mmap'):
+            rss, pss = measure(directory, mode, args.workers)
+            print(f"{mode:>6}: ワーカー{args.workers}個 / 1ワーカーあたり RSS {rss:.1f} MB, PSS {pss:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import datetime
+import os
+import random
+
+from flask_bcrypt import Bcrypt
+
+import database
+from permissions import PERMISSION_MAP, ROLE_HIERARCHY
+
+# 性能計測用のWikiのデータ（ページ・タグ・ユーザー）を作る。
+# 同じ seed なら同じ内容になるので、別の日に計測した結果と比べられる（パスワードのハッシュだけは毎回変わる）。
+#   - ページは日本語と英語のMarkdown（見出し・段落・箇条書き・表・コード）。長さはまちまち
+#   - タグはよく使われるものとほとんど使われないものがある（Zipf分布）
+#   - ユーザーはすべての役職を含む。パスワードはすべて BENCH_PASSWORD
+# 指定したパスに schema.sql を流し直して作るので、リポジトリの wiki.db を指定しないこと。
+# 使い方: python -m benchmarks.corpus /tmp/bench/wiki.db --pages 10000 --tags 200 --users 100 --seed 0
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_PATH = os.path.join(REPO_ROOT, 'schema.sql')
+BENCH_PASSWORD = 'bench'
+# ハッシュの計算回数（計測用なので小さくする。ログインの計測では照合が軽くなる点に注意）
+BCRYPT_ROUNDS = 4
+# ページの作成日時の起点（実行した日時によらず同じ内容にする）
+BASE_TIME = datetime.datetime(2026, 1, 1)
+
+# 権限レベルの割合
+PERMISSION_WEIGHTS = {'全員に公開': 60, '社員以上': 20, 'インターン生以上': 10, '管理者のみ': 10}
+# 日本語のページの割合
+JAPANESE_RATIO = 0.7
+MAX_TAGS_PER_PAGE = 5
+
+JA_TOPICS = ['経費精算', '勤怠管理', '議事録', '採用', '新人研修', 'セキュリティ', '障害対応', 'リリース手順',
+             '顧客対応', '請求書', '開発環境', 'デプロイ', '在宅勤務', '福利厚生', '情報システム', '営業会議']
+JA_WORDS = ['申請', '承認', '締め日', '手順', '担当者', '確認', 'システム', '設定', 'ログイン', '権限', '資料',
+            '会議室', '予約', '提出', '期限', '連絡先', '問い合わせ', '更新', '変更', '注意点', '対象', '方法',
+            'サーバー', 'データベース', 'バックアップ', '監視', 'アラート', '報告', '共有', 'テンプレート']
+JA_ENDINGS = ['してください。', 'となります。', 'は不要です。', 'を参照してください。', 'に注意してください。',
+              'が必要です。', 'は月末までです。', 'を忘れないでください。']
+EN_TOPICS = ['Onboarding', 'Deployment', 'Incident', 'Expense', 'Security', 'Release', 'Database', 'Monitoring',
+             'Backup', 'Interview', 'Architecture', 'Roadmap']
+EN_WORDS = ['request', 'approval', 'deadline', 'procedure', 'owner', 'review', 'system', 'settings', 'login',
+            'permission', 'document', 'meeting', 'server', 'database', 'backup', 'alert', 'report', 'template',
+            'deploy', 'rollback', 'cluster', 'queue', 'latency', 'budget', 'customer', 'invoice']
+CODE_SNIPPETS = ['$ git pull origin main\n$ make deploy', 'SELECT id, title FROM pages WHERE id = 1;',
+                 'def handler(event):\n    return {"status": 200}', 'curl -X POST https://example.com/api/v1/jobs']
+
+
+def ja_sentence(rng):
+    words = rng.sample(JA_WORDS, rng.randint(2, 4))
+    return 'の'.join(words[:-1]) + 'は' + words[-1] + rng.choice(JA_ENDINGS)
+
+
+def en_sentence(rng):
+    words = [rng.choice(EN_WORDS) for _ in range(rng.randint(6, 14))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def make_content(rng, japanese):
+    """ページの本文（Markdown）を作る"""
+    sentence = ja_sentence if japanese else en_sentence
+    topics = JA_TOPICS if japanese else EN_TOPICS
+    blocks = []
+    for _ in range(rng.randint(1, 5)):
+        blocks.append(f"## {rng.choice(topics)}")
+        for _ in range(rng.randint(1, 3)):
+            blocks.append(' '.join(sentence(rng) for _ in range(rng.randint(1, 6))))
+        shape = rng.random()
+        if shape < 0.3:
+            blocks.append('\n'.join(f"- {sentence(rng)}" for _ in range(rng.randint(2, 6))))
+        elif shape < 0.4:
+            rows = [f"| {rng.choice(topics)} | {rng.randint(1, 100)} |" for _ in range(rng.randint(2, 5))]
+            blocks.append('\n'.join(['| 項目 | 値 |' if japanese else '| Item | Value |', '| --- | --- |'] + rows))
+        elif shape < 0.5:
+            blocks.append(f"```\n{rng.choice(CODE_SNIPPETS)}\n```")
+    return '\n\n'.join(blocks)
+
+
+def make_tag_names(rng, n_tags):
+    names = []
+    for i in range(n_tags):
+        topic = rng.choice(JA_TOPICS + EN_TOPICS)
+        names.append(f"{topic}-{i}")
+    return names
+
+
+def generate(path, n_pages, n_tags, n_users, seed=0):
+    """path に計測用のデータベースを作り、作った件数を返す"""
+    rng = random.Random(seed)
+    connection = database.connect(path)
+    with open(SCHEMA_PATH, encoding='utf-8') as f:
+        connection.executescript(f.read())
+
+    # ユーザー（役職を順番に割り当てるので、すべての役職が含まれる）
+    hashed_password = Bcrypt().generate_password_hash(BENCH_PASSWORD, BCRYPT_ROUNDS).decode('utf-8')
+    roles = list(ROLE_HIERARCHY)
+    users = [(f"bench-{roles[i % len(roles)].lower()}-{i}", hashed_password, roles[i % len(roles)])
+             for i in range(max(n_users, len(roles)))]
+    connection.executemany('INSERT INTO users (username, password, role) VALUES (?, ?, ?)', users)
+    user_ids = [row[0] for row in connection.execute('SELECT id FROM users ORDER BY id')]
+
+    # タグ
+    tag_names = make_tag_names(rng, n_tags)
+    connection.executemany('INSERT INTO tags (name) VALUES (?)', ((name,) for name in tag_names))
+    tag_ids = [row[0] for row in connection.execute('SELECT id FROM tags ORDER BY id')]
+    # i 番目のタグが選ばれやすさ 1 / (i + 1)
+    tag_weights = [1 / (i + 1) for i in range(len(tag_ids))]
+
+    # ページ（作成順に日時を進める）
+    permission_levels = list(PERMISSION_WEIGHTS)
+    permission_weights = list(PERMISSION_WEIGHTS.values())
+    page_rows = []
+    page_tag_rows = []
+    for i in range(n_pages):
+        japanese = rng.random() < JAPANESE_RATIO
+        title = f"{rng.choice(JA_TOPICS if japanese else EN_TOPICS)} {i}"
+        permission_level = rng.choices(permission_levels, permission_weights)[0]
+        created_at = BASE_TIME + datetime.timedelta(minutes=i)
+        updated_at = created_at + datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+        author_id = rng.choice(user_ids)
+        page_rows.append((title, make_content(rng, japanese), created_at.strftime('%Y-%m-%d %H:%M:%S'), author_id,
+                          rng.choice([None, author_id, rng.choice(user_ids)]), permission_level,
+                          PERMISSION_MAP[permission_level], updated_at.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]))
+        if tag_ids:
+            page_tags = set(rng.choices(tag_ids, tag_weights, k=rng.randint(0, MAX_TAGS_PER_PAGE)))
+            page_tag_rows.extend((i + 1, tag_id) for tag_id in sorted(page_tags))
+    connection.executemany("""
+        INSERT INTO pages (title, content, created_at, author_id, updated_by_id, permission_level, required_level, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, page_rows)
+    connection.executemany('INSERT INTO page_tags (page_id, tag_id) VALUES (?, ?)', page_tag_rows)
+    connection.commit()
+    connection.execute('PRAGMA optimize')
+    connection.close()
+    return {'pages': n_pages, 'tags': len(tag_ids), 'users': len(user_ids), 'page_tags': len(page_tag_rows)}
+
+
+def search_terms(rng, n):
+    """全文検索の計測に使う検索語（本文に出てくる語）を n 個返す"""
+    words = JA_WORDS + JA_TOPICS + EN_WORDS
+    return [' '.join(rng.sample(words, rng.randint(1, 2))) for _ in range(n)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='性能計測用のデータベースを作る')
+    parser.add_argument('path')
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--tags', type=int, default=50)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if os.path.abspath(args.path) == os.path.join(REPO_ROOT, database.DATABASE):
+        parser.error('リポジトリの wiki.db 以外のパスを指定してください。')
+    counts = generate(args.path, args.pages, args.tags, args.users, args.seed)
+    print(f"{args.path} を作成しました: {counts}")
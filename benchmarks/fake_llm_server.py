@@ -0,0 +1,90 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# OpenAI互換の chat.completions を真似するローカルの偽LLMサーバー。
+# 最初のトークンまでの待ち時間とトークンごとの間隔を指定して、本物のLLMの生成速度を再現する。
+# 使い方:
+#   python -m benchmarks.fake_llm_server --port 8001 --first-token-ms 500 --token-ms 30
+#   OPENAI_API_KEY=dummy OPENAI_BASE_URL=http://127.0.0.1:8001/v1 python app.py
+
+ANSWER = "経費精算の締め日は毎月25日です。詳しくは社内Wikiの「経費精算の手順」を参照してください。"
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    first_token_delay = 0.5
+    token_delay = 0.03
+    # クライアントが途中で切断した回数（キャンセルの確認用）
+    cancelled = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        model = body.get('model', 'fake')
+        time.sleep(self.first_token_delay)
+
+        if not body.get('stream'):
+            time.sleep(self.token_delay * len(ANSWER))
+            data = json.dumps({
+                'id': 'fake', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': ANSWER}}],
+            }).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        try:
+            # 1文字ずつを1トークンとして送る
+            for i, char in enumerate(ANSWER):
+                if i:
+                    time.sleep(self.token_delay)
+                self._send_chunk(model, {'content': char}, None)
+            self._send_chunk(model, {}, 'stop')
+            self.wfile.write(b'data: [DONE]\n\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            FakeLLMHandler.cancelled += 1
+
+    def _send_chunk(self, model, delta, finish_reason):
+        chunk = {
+            'id': 'fake', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+        }
+        self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+
+def start_server(port=0, first_token_ms=500, token_ms=30):
+    """別スレッドで偽LLMサーバーを起動し、(サーバー, ベースURL) を返す"""
+    FakeLLMHandler.first_token_delay = first_token_ms / 1000
+    FakeLLMHandler.token_delay = token_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeLLMHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='OpenAI互換の偽LLMサーバー')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--first-token-ms', type=float, default=500)
+    parser.add_argument('--token-ms', type=float, default=30)
+    args = parser.parse_args()
+    FakeLLMHandler.first_token_delay = args.first_token_ms / 1000
+    FakeLLMHandler.token_delay = args.token_ms / 1000
+    print(f"偽LLMサーバーを起動しました: http://127.0.0.1:{args.port}/v1")
+    ThreadingHTTPServer(('127.0.0.1', args.port), FakeLLMHandler).serve_forever()
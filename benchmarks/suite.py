@@ -0,0 +1,324 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Wikiの主な処理（ページ表示・一覧・検索・タグの書き込み・/ask の検索）とベクトルDBの作成を、
+# benchmarks.corpus で作ったデータで計測し、結果をJSONで出力する。
+#   - 作業用のディレクトリに wiki.db・ベクトルDB・添付ファイルを作るので、リポジトリの wiki.db には触れない
+#     （終わったあとも調べられるように、作業用のディレクトリは消さない）
+#   - リクエストは Flask のテストクライアントから1つずつ送る（ネットワークとWSGIサーバーの時間は含まない）
+#   - 同じ --scale / --seed なら同じデータ・同じリクエストの並びになるので、--compare で前回の結果と比べられる
+# 使い方:
+#   python -m benchmarks.suite --scale 1k --output bench-1k.json
+#   python -m benchmarks.suite --scale 10k --skip-vectors --compare bench-10k.json
+# --compare を付けると、p95 が --threshold（既定10%）より悪くなった項目を標準エラーに表示し、終了コード1で終わる。
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 規模ごとの (ページ数, タグ数, ユーザー数)
+SCALES = {
+    '1k': (1000, 50, 20),
+    '10k': (10000, 200, 100),
+    '100k': (100000, 1000, 500),
+}
+# 計測の前に捨てるリクエストの数（キャッシュを温める）
+WARMUP_REQUESTS = 20
+DEFAULT_THRESHOLD = 0.10
+
+
+def summarize(times, elapsed):
+    """1リクエストごとの秒数のリストから、パーセンタイル（ミリ秒）とスループットを返す"""
+    ms = np.array(times) * 1000
+    return {
+        'count': len(times),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'mean_ms': round(float(ms.mean()), 3),
+        'throughput_rps': round(len(times) / elapsed, 1) if elapsed else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # Linux の ru_maxrss は kB
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def measure(requests, send):
+    """requests の各要素を send に渡して時間を計る（先頭の WARMUP_REQUESTS 件は捨てる）"""
+    for item in requests[:WARMUP_REQUESTS]:
+        send(item)
+    times = []
+    started = time.perf_counter()
+    for item in requests[WARMUP_REQUESTS:]:
+        t = time.perf_counter()
+        send(item)
+        times.append(time.perf_counter() - t)
+    return summarize(times, time.perf_counter() - started)
+
+
+def check_status(response, allowed=(200, 304, 403)):
+    if response.status_code not in allowed:
+        raise RuntimeError(f"想定外のステータス {response.status_code}: {response.request.path}")
+    return response
+
+
+def run_script(args, workdir):
+    """リポジトリのスクリプトを作業用のディレクトリで実行し、(秒数, 最大RSS MB) を返す"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable] + args, cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    # 子プロセスごとの最大RSSを取るため、wait ではなく wait4 で待つ
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - started
+    stderr = proc.stderr.read().decode('utf-8', 'replace')
+    proc.stderr.close()
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f"{args[0]} が失敗しました:\n{stderr[-2000:]}")
+    return round(elapsed, 3), round(usage.ru_maxrss / 1024, 1)
+
+
+def build_vectors(workdir, rng, n_edits):
+    """ベクトルDBの全件作成と、いくつかのページを編集したあとの差分更新を計測する"""
+    import database
+
+    results = {}
+    seconds, rss = run_script([os.path.join(REPO_ROOT, 'create_vector_store.py')], workdir)
+    results['create_vector_store'] = {'seconds': seconds, 'peak_rss_mb': rss}
+
+    connection = database.connect(os.path.join(workdir, 'wiki.db'))
+    page_ids = [row[0] for row in connection.execute('SELECT id FROM pages')]
+    for page_id in rng.sample(page_ids, min(n_edits, len(page_ids))):
+        connection.execute(
+            "UPDATE pages SET content = content || ?, updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = ?",
+            (f"\n\n追記 {page_id}", page_id)
+        )
+    connection.commit()
+    connection.close()
+    seconds, rss = run_script([os.path.join(REPO_ROOT, 'smart_update_vector_store.py')], workdir)
+    results['smart_update_vector_store'] = {'seconds': seconds, 'peak_rss_mb': rss, 'edited_pages': n_edits}
+    return results
+
+
+def login(client, username):
+    from benchmarks.corpus import BENCH_PASSWORD
+
+    response = client.post('/login', data={'username': username, 'password': BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f"{username} でログインできませんでした。")
+
+
+def run_http(app_module, rng, args, with_vectors):
+    """テストクライアントで各処理を計測する"""
+    from benchmarks.corpus import search_terms
+
+    app = app_module.app
+    db = app_module.db_connections.connection(readonly=True)
+    page_ids = [row[0] for row in db.execute('SELECT id FROM pages')]
+    tag_names = [row[0] for row in db.execute('SELECT name FROM tags ORDER BY id')]
+    users = db.execute('SELECT username, role FROM users ORDER BY id').fetchall()
+
+    # 役職ごとにログインしたクライアント（None はログインしていない人）
+    clients = {None: app.test_client()}
+    for user in users:
+        if user['role'] not in clients:
+            clients[user['role']] = app.test_client()
+            login(clients[user['role']], user['username'])
+    roles = list(clients)
+    admin_client = clients['Admin']
+    n = args.requests + WARMUP_REQUESTS
+    results = {}
+
+    # 1. ページ表示（ETag なし: 毎回本文を返す / ETag あり: 304）
+    requests = [(rng.choice(roles), rng.choice(page_ids)) for _ in range(n)]
+    results['view_page'] = measure(
+        requests, lambda item: check_status(clients[item[0]].get(f'/page/{item[1]}')))
+    etags = {}
+    for role, page_id in requests:
+        response = clients[role].get(f'/page/{page_id}')
+        etags[role, page_id] = response.headers.get('ETag')
+    results['view_page_304'] = measure(requests, lambda item: check_status(
+        clients[item[0]].get(f'/page/{item[1]}', headers={'If-None-Match': etags[item] or ''})))
+
+    # 2. 一覧（トップページと、/api/pages で続きをたどる）
+    results['show_pages'] = measure([rng.choice(roles) for _ in range(n)],
+                                    lambda role: check_status(clients[role].get('/')))
+
+    def scroll(role):
+        cursor = None
+        for _ in range(args.scroll_pages):
+            response = check_status(clients[role].get('/api/pages', query_string={'cursor': cursor} if cursor else {}))
+            cursor = response.get_json()['next_cursor']
+            if not cursor:
+                break
+
+    results['api_pages_scroll'] = measure([rng.choice(roles) for _ in range(n)], scroll)
+
+    # 3. 検索（全文検索とタグ検索）
+    terms = search_terms(rng, n)
+    results['search_fulltext'] = measure(
+        [(rng.choice(roles), term) for term in terms],
+        lambda item: check_status(clients[item[0]].get('/search', query_string={'q': item[1]})))
+    if tag_names:
+        results['search_tags'] = measure(
+            [(rng.choice(roles), ' '.join(rng.sample(tag_names, min(2, len(tag_names))))) for _ in range(n)],
+            lambda item: check_status(clients[item[0]].get('/search', query_string={'q': item[1]})))
+
+    # 4. タグの書き込み（管理者がページのタグを付け替える）
+    def edit_tags(item):
+        page_id, tags = item
+        page = db.execute('SELECT title, content, permission_level FROM pages WHERE id = ?', (page_id,)).fetchone()
+        check_status(admin_client.post(f'/edit/{page_id}', data={
+            'title': page['title'], 'content': page['content'], 'tags': ', '.join(tags),
+            'permission_level': page['permission_level'],
+        }), allowed=(302,))
+
+    if tag_names:
+        results['tag_write'] = measure(
+            [(rng.choice(page_ids), rng.sample(tag_names, min(rng.randint(1, 5), len(tag_names))))
+             for _ in range(min(n, args.write_requests + WARMUP_REQUESTS))],
+            edit_tags)
+
+    # 5. /ask の検索（LLMは APIキーなしのデモ応答なので、ほぼ検索の時間になる）
+    questions = search_terms(rng, n)
+    modes = ['lexical'] + (['vector', 'hybrid'] if with_vectors else [])
+    if with_vectors:
+        app_module.retrieval.start()
+        deadline = time.monotonic() + 600
+        while not app_module.retrieval.is_ready:
+            if app_module.retrieval.state == app_module.STATE_ERROR or time.monotonic() > deadline:
+                raise RuntimeError("ベクトルDBを読み込めませんでした。")
+            time.sleep(0.5)
+    for mode in modes:
+        results[f'ask_{mode}'] = measure(questions, lambda question: check_status(
+            admin_client.post('/ask', json={'message': question, 'retrieval_mode': mode}), allowed=(200,)))
+
+    # ログイン（bcrypt の照合。corpus のハッシュは計算回数を減らしてあるので、本番より軽い）
+    results['login'] = measure([rng.choice(users)['username'] for _ in range(min(n, 50 + WARMUP_REQUESTS))],
+                               lambda username: login(app.test_client(), username))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """p95 が threshold より悪くなった項目の一覧を返す（条件が違う結果とは比べない）"""
+    keys = ('scale', 'pages', 'tags', 'users', 'seed', 'requests')
+    if any(current['config'].get(key) != baseline['config'].get(key) for key in keys):
+        print("注意: 規模・seed・リクエスト数が違うため比較できません。", file=sys.stderr)
+        return []
+    regressions = []
+    print(f"{'項目':<28}{'前回 p95':>12}{'今回 p95':>12}{'変化':>9}", file=sys.stderr)
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if not before:
+            continue
+        change = result['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0.0
+        mark = ' ←' if change > threshold else ''
+        print(f"{name:<28}{before['p95_ms']:>10.2f}ms{result['p95_ms']:>10.2f}ms{change:>+8.0%}{mark}", file=sys.stderr)
+        if change > threshold:
+            regressions.append(name)
+    for name, result in current['build'].items():
+        before = baseline['build'].get(name)
+        if before and before['seconds'] and result['seconds'] / before['seconds'] - 1 > threshold:
+            print(f"{name}: {before['seconds']:.1f}秒 → {result['seconds']:.1f}秒 ←", file=sys.stderr)
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Wiki と RAG の主な処理の性能計測')
+    parser.add_argument('--scale', choices=SCALES, default='1k')
+    parser.add_argument('--pages', type=int, help='ページ数（--scale の値を上書きする）')
+    parser.add_argument('--tags', type=int)
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=500, help='処理ごとに計測するリクエスト数')
+    parser.add_argument('--write-requests', type=int, default=100, help='タグの書き込みを計測する回数')
+    parser.add_argument('--scroll-pages', type=int, default=5, help='/api/pages で続きをたどるページ数')
+    parser.add_argument('--edits', type=int, default=50, help='差分更新の前に編集するページ数')
+    parser.add_argument('--skip-vectors', action='store_true', help='ベクトルDBの作成とベクトル検索を計測しない')
+    parser.add_argument('--workdir', help='作業用のディレクトリ（既定は一時ディレクトリ）')
+    parser.add_argument('--output', help='結果のJSONを書き出すファイル（既定は標準出力）')
+    parser.add_argument('--compare', help='比べる前回の結果のJSON')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    n_pages, n_tags, n_users = SCALES[args.scale]
+    n_pages = args.pages or n_pages
+    n_tags = n_tags if args.tags is None else args.tags
+    n_users = args.users or n_users
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='wiki-bench-'))
+    os.makedirs(workdir, exist_ok=True)
+    sys.path.insert(0, REPO_ROOT)
+    from benchmarks.corpus import generate
+
+    # データ・リクエストの並びはすべて seed から作る
+    rng = random.Random(args.seed)
+    print(f"{workdir} にデータを作成しています（{n_pages}ページ）...", file=sys.stderr)
+    started = time.perf_counter()
+    counts = generate(os.path.join(workdir, 'wiki.db'), n_pages, n_tags, n_users, args.seed)
+    build = {'corpus': {'seconds': round(time.perf_counter() - started, 3), 'peak_rss_mb': peak_rss_mb()}}
+
+    with_vectors = not args.skip_vectors
+    if with_vectors:
+        print("ベクトルDBを作成しています...", file=sys.stderr)
+        build.update(build_vectors(workdir, rng, args.edits))
+
+    # アプリは作業用のディレクトリの wiki.db・ベクトルDBを開く（相対パスで指定されているため）
+    os.chdir(workdir)
+    os.environ['RETRIEVAL_PRELOAD'] = '0'
+    import app as app_module
+
+    print("リクエストを計測しています...", file=sys.stderr)
+    results = run_http(app_module, rng, args, with_vectors)
+
+    report = {
+        'config': {
+            'scale': args.scale, 'pages': n_pages, 'tags': n_tags, 'users': n_users, 'seed': args.seed,
+            'requests': args.requests, 'write_requests': args.write_requests, 'vectors': with_vectors,
+        },
+        'environment': {
+            'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'corpus': counts,
+        'build': build,
+        'results': results,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)}項目が {args.threshold:.0%} 以上遅くなりました: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
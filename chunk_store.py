@@ -0,0 +1,247 @@
+import fcntl
+import os
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+# --- チャンクストア ---
+# 各チャンクのメタデータ（FAISSのID・ページID・ページ内のチャンク番号・ページ本文の中の位置・
+# 本文のチェックサム・閲覧に必要な権限レベル）を <prefix>.meta.npy に保存する。
+# チャンクの本文はコピーせず、検索結果を返すときにページ本文から切り出す（chunker.py を参照）。
+# ベクトル化した後にページが編集されて位置がずれた場合は、チェックサムが合わないので使わない。
+# 読み込み時は mmap で開くので、複数のgunicornワーカーが同じファイルを開いても
+# OSのページキャッシュを共有し、各プロセスのヒープにはほとんど載らない。
+# ベクトルDB（インデックスとチャンクストア）を書き換えるプロセスは write_lock() を取ってから読み込み・置き換えを行う。
+
+CHUNK_STORE_PREFIX = 'wiki_chunks'
+
+META_DTYPE = np.dtype([('id', '<i8'), ('page_id', '<i8'), ('chunk_no', '<i4'), ('start', '<i4'), ('end', '<i4'),
+                       ('checksum', '<u4'), ('required_level', '<i1')])
+# 削除済みのチャンクに付けるページID
+DELETED_PAGE_ID = -1
+# 本文をコピーして保存していた以前の形式のファイル
+LEGACY_SUFFIXES = ('.text', '.offsets.npy')
+
+
+def _meta_path(prefix):
+    return prefix + '.meta.npy'
+
+
+def chunk_store_exists(prefix=CHUNK_STORE_PREFIX):
+    return os.path.exists(_meta_path(prefix))
+
+
+@contextmanager
+def write_lock(prefix=CHUNK_STORE_PREFIX):
+    """ベクトルDBを書き換える間、他のプロセス（ワーカー・差分更新・全件作成）を待たせる（<prefix>.lock の flock）"""
+    with open(prefix + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def text_checksum(text):
+    """チャンク本文のチェックサム（ページが編集されて位置がずれていないかの確認に使う）"""
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def _write_meta(path, meta):
+    """一時ファイルに書いてから置き換える（np.saveは拡張子.npyを勝手に付けるので、ファイルオブジェクトに書き込む）"""
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, meta)
+    os.replace(path + '.tmp', path)
+
+
+def remove_legacy_files(prefix=CHUNK_STORE_PREFIX):
+    """以前の形式の本文ファイルが残っていれば消す"""
+    for suffix in LEGACY_SUFFIXES:
+        if os.path.exists(prefix + suffix):
+            os.remove(prefix + suffix)
+
+
+class ChunkStoreWriter:
+    """チャンクを追加していき、close()でファイルに書き出す。
+
+    FAISSのIDは昇順で追加すること（読み込み時に二分探索で引くため）。
+    append_to に既存のChunkStoreを渡すと、その続きに追加し、
+    削除したチャンクは page_id を -1 にした「削除済み」として残す（compact()で取り除く）。
+    """
+
+    def __init__(self, prefix=CHUNK_STORE_PREFIX, append_to=None):
+        self.prefix = prefix
+        if append_to is None:
+            self._base_meta = np.empty(0, dtype=META_DTYPE)
+        else:
+            self._base_meta = np.array(append_to.meta, dtype=META_DTYPE)
+        self._rows = []
+
+    @property
+    def next_id(self):
+        """次に追加するチャンクに使えるID"""
+        if self._rows:
+            return self._rows[-1][0] + 1
+        if len(self._base_meta):
+            return int(self._base_meta['id'][-1]) + 1
+        return 0
+
+    def add(self, faiss_id, page_id, chunk_no, start, end, checksum, required_level=0):
+        """チャンクを1件追加する。
+
+        start・end はページ本文の中の位置、checksum は本文の text_checksum()。
+        required_level はページの閲覧に必要なレベル（不明なら最も厳しい0）。
+        """
+        if faiss_id < self.next_id:
+            raise ValueError("チャンクのIDは昇順で追加してください。")
+        self._rows.append((faiss_id, page_id, chunk_no, start, end, checksum, required_level))
+
+    def delete_pages(self, page_ids):
+        """既存のチャンクのうち、指定したページのものを削除済みにし、そのIDの配列を返す"""
+        mask = np.isin(self._base_meta['page_id'], np.fromiter(page_ids, dtype=np.int64))
+        mask &= self._base_meta['page_id'] >= 0
+        removed = self._base_meta['id'][mask].copy()
+        self._base_meta['page_id'][mask] = DELETED_PAGE_ID
+        return removed
+
+    def copy_from(self, store):
+        """既存のチャンクストアの内容を引き継ぐ（削除済みのチャンクは除く）"""
+        live = np.array(store.meta[store.meta['page_id'] != DELETED_PAGE_ID])
+        if len(live) and len(self) and live['id'][0] < self.next_id:
+            raise ValueError("チャンクのIDは昇順で追加してください。")
+        self._base_meta = np.concatenate([self._base_meta, live])
+
+    def __len__(self):
+        return len(self._base_meta) + len(self._rows)
+
+    def close(self):
+        meta = np.concatenate([self._base_meta, np.array(self._rows, dtype=META_DTYPE)])
+        _write_meta(_meta_path(self.prefix), meta)
+
+
+class ChunkSpool:
+    """全件作成の途中のチャンクを、メモリに貯めずにファイルへ追記していく（create_vector_store.py 用）。
+
+    <prefix>.meta.bin に追記し、finish() でチャンクストアの形式（.meta.npy）にして置き換える。
+    finish() の後も .meta.bin は残すので、インデックスを置き換える前に止まっても、もう一度 finish() できる。
+    途中で止まった場合は、チェックポイントに記録した count を渡すと、その時点から追記を続けられる。
+    """
+
+    def __init__(self, prefix, count=0):
+        self.prefix = prefix
+        self._meta_path = prefix + '.meta.bin'
+        self._file = open(self._meta_path, 'r+b' if os.path.exists(self._meta_path) else 'w+b')
+        # チェックポイントより後に書かれた分（書き込み途中のもの）を捨てる
+        self._file.truncate(count * META_DTYPE.itemsize)
+        self._file.seek(count * META_DTYPE.itemsize)
+        self.count = count
+
+    def add_many(self, ids, page_ids, chunk_nos, starts, ends, checksums, required_levels):
+        """チャンクをまとめて追記する（IDは昇順にすること）"""
+        meta = np.empty(len(ids), dtype=META_DTYPE)
+        meta['id'] = ids
+        meta['page_id'] = page_ids
+        meta['chunk_no'] = chunk_nos
+        meta['start'] = starts
+        meta['end'] = ends
+        meta['checksum'] = checksums
+        meta['required_level'] = required_levels
+        self._file.write(meta.tobytes())
+        self.count += len(meta)
+
+    def flush(self):
+        """書いた分をディスクに書き出す（チェックポイントを記録する前に呼ぶ）"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def finish(self, prefix=CHUNK_STORE_PREFIX, block=1 << 20):
+        """チャンクストアの形式に変換して prefix のファイルを置き換える"""
+        self.flush()
+        self._file.close()
+        meta_path = _meta_path(prefix)
+        meta = np.memmap(self._meta_path, dtype=META_DTYPE, mode='r', shape=(self.count,)) if self.count else np.empty(0, META_DTYPE)
+        # 全件をメモリに読み込まないよう、block 件ずつ .npy に書き写す
+        meta_out = np.lib.format.open_memmap(meta_path + '.tmp', mode='w+', dtype=META_DTYPE, shape=(self.count,))
+        for start in range(0, self.count, block):
+            meta_out[start:start + block] = meta[start:start + block]
+        meta_out.flush()
+        del meta_out, meta
+        os.replace(meta_path + '.tmp', meta_path)
+        remove_legacy_files(prefix)
+
+
+def compact(prefix=CHUNK_STORE_PREFIX):
+    """削除済みのチャンクを取り除いてチャンクストアを書き直す。取り除いた件数を返す。"""
+    store = ChunkStore(prefix)
+    dead = store.dead_count
+    writer = ChunkStoreWriter(prefix)
+    writer.copy_from(store)
+    store.close()
+    writer.close()
+    return dead
+
+
+class ChunkStore:
+    """mmapでチャンクストアを開き、FAISSのIDからチャンクを引く"""
+
+    def __init__(self, prefix=CHUNK_STORE_PREFIX):
+        self.prefix = prefix
+        self.meta = np.load(_meta_path(prefix), mmap_mode='r')
+        if self.meta.dtype != META_DTYPE:
+            raise ValueError(f"チャンクストア {prefix} は以前の形式です。`python create_vector_store.py` で作り直してください。")
+
+    def __len__(self):
+        return len(self.meta)
+
+    @property
+    def ids(self):
+        return self.meta['id']
+
+    @property
+    def page_ids(self):
+        return self.meta['page_id']
+
+    @property
+    def dead_count(self):
+        """削除済みのチャンク数"""
+        return int(np.count_nonzero(self.meta['page_id'] == DELETED_PAGE_ID))
+
+    def allowed_ids(self, user_level):
+        """指定したレベルのユーザーが閲覧できる（削除済みでない）チャンクのIDを返す"""
+        meta = self.meta
+        mask = (meta['page_id'] != DELETED_PAGE_ID) & (meta['required_level'] >= user_level)
+        return np.array(meta['id'][mask])
+
+    def position(self, faiss_id):
+        """FAISSのIDから配列上の位置を返す。見つからなければ-1。"""
+        ids = self.meta['id']
+        pos = int(np.searchsorted(ids, faiss_id))
+        if pos < len(ids) and ids[pos] == faiss_id:
+            return pos
+        return -1
+
+    def text_in(self, pos, content):
+        """ページ本文 content から pos のチャンクの本文を切り出す。
+
+        ベクトル化した後にページが編集されて位置がずれていれば None を返す。
+        """
+        row = self.meta[pos]
+        text = content[int(row['start']):int(row['end'])]
+        if text_checksum(text) != int(row['checksum']):
+            return None
+        return text
+
+    def get(self, faiss_id):
+        """FAISSのIDから (page_id, chunk_no, start, end) を返す。見つからないか削除済みならNone。"""
+        pos = self.position(faiss_id)
+        if pos < 0:
+            return None
+        row = self.meta[pos]
+        if row['page_id'] == DELETED_PAGE_ID:
+            return None
+        return int(row['page_id']), int(row['chunk_no']), int(row['start']), int(row['end'])
+
+    def close(self):
+        # mmap は参照がなくなったときに閉じられる
+        self.meta = np.empty(0, dtype=META_DTYPE)
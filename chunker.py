@@ -0,0 +1,201 @@
+import re
+from collections import namedtuple
+
+# --- Markdownの構造に沿ったチャンク分割 ---
+# 空行（'\n\n'）だけで区切ると、1行だけの断片や巨大なコードブロックがそのまま1つのチャンクになる。
+# 本文を見出し・段落・箇条書き・表・コードブロックのブロックに分け、同じ見出しの下のブロックを
+# CHUNK_TOKENS に収まるまでまとめる。収まらないブロックは行 → 文 → 語の順に細かく分け、
+# 前のチャンクの末尾 CHUNK_OVERLAP_TOKENS 分を次のチャンクの先頭に重ねる。
+# チャンクはページ本文の中の位置 (start, end)（文字単位）で表すので、本文のコピーは保存しない。
+# 全件作成（create_vector_store.py）と差分更新（smart_update_vector_store.py・vector_worker.py）で共通に使う。
+# CHUNK_TOKENS・CHUNK_OVERLAP_TOKENS を変更したら create_vector_store.py で作り直すこと。
+
+# 1チャンクのトークン数の目安（all-MiniLM-L6-v2 は256トークンより後ろを切り捨てるので、見出しの分の余裕を残す）
+CHUNK_TOKENS = 200
+# 大きなブロックを分けたとき、前のチャンクと重ねるトークン数
+CHUNK_OVERLAP_TOKENS = 32
+# これより短いチャンクは、見出しが変わっても次のブロックとまとめる（1行だけの断片を作らない）
+MIN_CHUNK_TOKENS = 16
+
+# トークン数の見積もり用（英数字の語は1つ、それ以外は1文字を1トークンと数える。
+# MiniLMのWordPieceは漢字・かなを1文字ずつに分けるので、日本語ではほぼ一致する）
+TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_]+|\S')
+LINE_PATTERN = re.compile(r'[^\n]*\n|[^\n]+')
+SENTENCE_PATTERN = re.compile(r'.*?(?:[。．！？]+|[.!?]+(?=\s)|$)\s*', re.S)
+SENTENCE_END_PATTERN = re.compile(r'[。．！？\n]|[.!?](?=\s)')
+HEADING_PATTERN = re.compile(r' {0,3}(#{1,6})[ \t]+(.*?)[ \t#]*$')
+FENCE_PATTERN = re.compile(r' {0,3}(`{3,}|~{3,})')
+LIST_PATTERN = re.compile(r'\s*(?:[-*+]|\d+[.)])\s')
+
+Chunk = namedtuple('Chunk', ['start', 'end', 'heading'])
+Block = namedtuple('Block', ['start', 'end', 'kind', 'level', 'title'])
+
+
+def count_tokens(text):
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def _lines(content):
+    """(開始位置, 終了位置, 行) を返す（行末の改行を含む）"""
+    pos = 0
+    for line in content.splitlines(keepends=True):
+        yield pos, pos + len(line), line
+        pos += len(line)
+
+
+def iter_blocks(content):
+    """本文を Block（kind は heading / code / table / list / paragraph）に分ける"""
+    block_start = block_end = None
+    block_kind = None
+    fence = None
+    for start, end, line in _lines(content):
+        if fence is not None:
+            # コードブロックは閉じるまで（閉じていなければ最後まで）1つのブロックにする
+            block_end = end
+            if line.strip().startswith(fence):
+                yield Block(block_start, block_end, 'code', 0, '')
+                block_start = None
+                fence = None
+            continue
+
+        stripped = line.strip()
+        heading = HEADING_PATTERN.match(line.rstrip('\r\n'))
+        fence_match = FENCE_PATTERN.match(line)
+        if not stripped or heading or fence_match:
+            if block_start is not None:
+                yield Block(block_start, block_end, block_kind, 0, '')
+                block_start = None
+            if heading:
+                yield Block(start, end, 'heading', len(heading.group(1)), heading.group(2))
+            elif fence_match:
+                block_start, block_end = start, end
+                fence = fence_match.group(1)
+            continue
+
+        if block_start is None:
+            block_start = start
+            if stripped.startswith('|'):
+                block_kind = 'table'
+            elif LIST_PATTERN.match(line):
+                block_kind = 'list'
+            else:
+                block_kind = 'paragraph'
+        block_end = end
+    if block_start is not None:
+        yield Block(block_start, block_end, 'code' if fence is not None else block_kind, 0, '')
+
+
+def _pack(units, limit):
+    """(開始位置, 終了位置, トークン数) の並びを、limit トークン以下になるように前からまとめる"""
+    pieces = []
+    for start, end, tokens in units:
+        if pieces and pieces[-1][2] + tokens <= limit:
+            pieces[-1] = (pieces[-1][0], end, pieces[-1][2] + tokens)
+        else:
+            pieces.append((start, end, tokens))
+    return pieces
+
+
+def _split(content, start, end, limit):
+    """start〜end を limit トークン以下の区間に分ける（行 → 文 → 語の順に細かくする）"""
+    text = content[start:end]
+    tokens = count_tokens(text)
+    if tokens <= limit:
+        return [(start, end, tokens)]
+    for pattern in (LINE_PATTERN, SENTENCE_PATTERN):
+        parts = [(start + m.start(), start + m.end()) for m in pattern.finditer(text) if m.end() > m.start()]
+        if len(parts) > 1:
+            units = []
+            for part_start, part_end in parts:
+                units.extend(_split(content, part_start, part_end, limit))
+            return _pack(units, limit)
+    # 1文が長すぎる場合は limit 語ごとに切る
+    matches = list(TOKEN_PATTERN.finditer(text))
+    bounds = [start] + [start + matches[i].start() for i in range(limit, len(matches), limit)] + [end]
+    return [(s, e, count_tokens(content[s:e])) for s, e in zip(bounds, bounds[1:])]
+
+
+def _overlap_start(content, start, end, overlap_tokens):
+    """start〜end の末尾 overlap_tokens 語の開始位置を返す（重ねられなければ end）。
+
+    その範囲に文の区切りがあれば、文の途中から始まらないよう次の文の先頭にずらす。
+    """
+    if overlap_tokens <= 0:
+        return end
+    matches = list(TOKEN_PATTERN.finditer(content, start, end))
+    if len(matches) <= overlap_tokens:
+        return end
+    pos = matches[-overlap_tokens].start()
+    sentence_end = SENTENCE_END_PATTERN.search(content, pos, end)
+    if sentence_end and sentence_end.end() < end and content[sentence_end.end():end].strip():
+        return sentence_end.end()
+    return pos
+
+
+def _strip(content, start, end):
+    """前後の空白・改行を除いた範囲を返す"""
+    text = content[start:end]
+    return start + len(text) - len(text.lstrip()), start + len(text.rstrip())
+
+
+def chunk_page(content, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """ページ本文を Chunk(start, end, heading) のリストに分ける。
+
+    heading はチャンクが属する見出し（親の見出しから ' > ' でつないだもの）。
+    チャンクが見出しの行から始まる場合は、その見出し自体は含めない（本文に入っているため）。
+    """
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+    chunks = []
+    headings = []
+    current = None  # [開始位置, 終了位置, トークン数, 見出し, 見出し以外を含むか]
+
+    def flush():
+        start, end = _strip(content, current[0], current[1])
+        if end > start:
+            chunks.append(Chunk(start, end, current[3]))
+
+    for block in iter_blocks(content):
+        if block.kind == 'heading':
+            # 新しい見出しからチャンクを始める（見出しが続くだけ、または短すぎる場合は同じチャンクにまとめる）
+            if current is not None and current[4] and current[2] >= MIN_CHUNK_TOKENS:
+                flush()
+                current = None
+            headings[block.level - 1:] = [''] * (block.level - 1 - len(headings)) + [block.title]
+            if current is None:
+                current = [block.start, block.end, count_tokens(content[block.start:block.end]),
+                           ' > '.join(h for h in headings[:-1] if h), False]
+            else:
+                current[1] = block.end
+                current[2] += count_tokens(content[block.start:block.end])
+            continue
+
+        for start, end, tokens in _split(content, block.start, block.end, max_tokens - overlap_tokens):
+            if current is None:
+                current = [start, end, tokens, ' > '.join(h for h in headings if h), True]
+            elif current[2] + tokens <= max_tokens:
+                current[1], current[2], current[4] = end, current[2] + tokens, True
+            else:
+                flush()
+                # 前のチャンクの末尾を重ねて、文脈が途切れないようにする
+                overlap = _overlap_start(content, current[0], current[1], overlap_tokens)
+                current = [overlap, end, count_tokens(content[overlap:end]), ' > '.join(h for h in headings if h), True]
+    if current is not None:
+        flush()
+    return chunks
+
+
+def split_paragraphs(content):
+    """以前の分割方法（空行で区切り、空の段落は捨てる）。比較用。"""
+    chunks = []
+    pos = 0
+    for para in content.split('\n\n'):
+        if para.strip():
+            chunks.append(Chunk(pos, pos + len(para), ''))
+        pos += len(para) + 2
+    return chunks
+
+
+def embedding_text(content, chunk):
+    """ベクトルにするテキスト（チャンクの本文の前に、属する見出しを付ける）"""
+    text = content[chunk.start:chunk.end]
+    return f"{chunk.heading}\n{text}" if chunk.heading else text
@@ -0,0 +1,55 @@
+import os
+import pickle
+import sys
+
+import database
+from chunk_store import CHUNK_STORE_PREFIX, DELETED_PAGE_ID, ChunkStoreWriter, text_checksum
+from permissions import required_level
+
+# 旧形式の chunks.pkl を mmap で読めるチャンクストアに変換するスクリプト
+# 使い方: python convert_chunks_pkl.py [chunks.pkl] [出力先のプレフィックス]
+# 各チャンクの閲覧権限と、ページ本文の中の位置は wiki.db から取得する
+# （見つからないページは「管理者のみ」扱い、本文の中に見つからないチャンクは削除済みにする）。
+
+source = sys.argv[1] if len(sys.argv) > 1 else 'chunks.pkl'
+prefix = sys.argv[2] if len(sys.argv) > 2 else CHUNK_STORE_PREFIX
+
+if not os.path.exists(source):
+    print(f"エラー: {source} が見つかりません。")
+    sys.exit(1)
+
+with open(source, 'rb') as f:
+    chunk_data = pickle.load(f)
+
+required_levels = {}
+contents = {}
+if os.path.exists(database.DATABASE):
+    connection = database.connect()
+    for page_id, permission_level, content in connection.execute('SELECT id, permission_level, content FROM pages'):
+        required_levels[page_id] = required_level(permission_level)
+        contents[page_id] = content
+    connection.close()
+
+# 旧形式ではリストの位置がそのままFAISSのIDになっている
+writer = ChunkStoreWriter(prefix)
+chunk_no_by_page = {}
+# 段落はページの先頭から順に並んでいるので、前の段落の後ろから探す
+search_from = {}
+missing = 0
+for faiss_id, (chunk, reference) in enumerate(zip(chunk_data['chunks'], chunk_data['references'])):
+    page_id = reference['page_id']
+    chunk_no = chunk_no_by_page.get(page_id, 0)
+    chunk_no_by_page[page_id] = chunk_no + 1
+    start = contents.get(page_id, '').find(chunk, search_from.get(page_id, 0))
+    if start < 0:
+        missing += 1
+        writer.add(faiss_id, DELETED_PAGE_ID, chunk_no, 0, 0, 0)
+        continue
+    search_from[page_id] = start + len(chunk)
+    writer.add(faiss_id, page_id, chunk_no, start, start + len(chunk), text_checksum(chunk),
+               required_levels.get(page_id, 0))
+writer.close()
+
+print(f"{len(writer)}個のチャンクを {prefix}.meta.npy に変換しました。")
+if missing:
+    print(f"注意: {missing}個のチャンクはページ本文に見つからなかったため、削除済みにしました。")
@@ -1,46 +1,349 @@
-import sqlite3
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
 import numpy as np
-import faiss
-import pickle
-from sentence_transformers import SentenceTransformer
-
-print("モデルを読み込んでいます...")
-# 日本語にも対応した高性能なモデルを読み込む
-model = SentenceTransformer('all-MiniLM-L6-v2')
-print("モデルの読み込み完了。")
-
-# データベースから全ページのコンテンツを取得
-connection = sqlite3.connect('wiki.db')
-connection.row_factory = sqlite3.Row
-cur = connection.execute('SELECT id, title, content FROM pages')
-pages = cur.fetchall()
-connection.close()
-
-# チャンク（検索対象のテキスト断片）と参照元情報を保存するリスト
-chunks = []
-chunk_references = []
-
-print(f"{len(pages)}件のページを処理中...")
-for page in pages:
-    # ページの内容を段落ごとに分割（簡易的なチャンキング）
-    paragraphs = page['content'].split('\n\n')
-    for para in paragraphs:
-        if para.strip(): # 空の段落は無視
-            chunks.append(para)
-            chunk_references.append({'page_id': page['id'], 'title': page['title']})
-
-print(f"{len(chunks)}個のチャンクを作成しました。ベクトルに変換します...")
-# 全チャンクをベクトルに変換
-chunk_embeddings = model.encode(chunks, convert_to_tensor=False)
-
-print("ベクトルデータベースを構築中...")
-# FAISSインデックスを作成
-index = faiss.IndexIDMap(faiss.IndexFlatL2(chunk_embeddings.shape[1]))
-index.add_with_ids(np.array(chunk_embeddings, dtype=np.float32), np.arange(len(chunks)))
-
-# 作成したインデックスと、参照情報をファイルに保存
-faiss.write_index(index, 'wiki_faiss.index')
-with open('chunks.pkl', 'wb') as f:
-    pickle.dump({'chunks': chunks, 'references': chunk_references}, f)
-
-print("ベクトルデータベースの作成が完了しました。")
\ No newline at end of file
+
+import database
+from ann_index import DEFAULT_INDEX_TYPE, INDEX_TYPES, build_index
+from chunk_store import CHUNK_STORE_PREFIX, ChunkSpool, text_checksum, write_lock
+from chunker import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, chunk_page, embedding_text
+from embedding_cache import EmbeddingCache
+from retrieval import INDEX_PATH, MODEL_NAME
+from permissions import required_level
+from vector_queue import bump_generation as bump_vector_generation
+
+# ベクトルDBの全件作成スクリプト
+# 全ページを読み込んでから一度に encode するのではなく、ページを少しずつ読んで流れ作業で処理する。
+#   1. ページを id 順に PAGE_FETCH_SIZE 件ずつ読み、chunker.py でチャンクに分ける
+#      （fetchall しない。長い読み込みのトランザクションも開かない）
+#   2. 約 WINDOW_CHUNKS 個のチャンクごとに、キャッシュにないものを長さ順に並べて BATCH_SIZE 個ずつに分け、
+#      プロセスプール（使えるCPUの数に合わせる）で encode する（長さの近いものをまとめるとパディングが減る）
+#   3. できたベクトルとチャンクを作業用のディレクトリ（BUILD_DIR）のファイルに追記し、チェックポイントを記録する
+#   4. 全ページが終わったら、ベクトルのファイル（mmap）からインデックスを作り、チャンクストア → インデックスの順に置き換える
+# 途中で止まっても、もう一度実行すればチェックポイントから続きを処理する（--restart で最初からやり直す）。
+# メモリに載るのは処理中のチャンクとベクトル（WINDOW_CHUNKS 個 × IN_FLIGHT_WINDOWS）と、最後に作るインデックスだけ。
+# プロセスプールの各プロセスはモデルを1つずつ読み込むので、その分のメモリは --workers に比例する。
+# 使い方: python create_vector_store.py [--index-type flat|ivf_flat|ivf_pq|hnsw|sq8] [--workers N] [--restart]
+
+BUILD_DIR = 'vector_build'
+PAGE_FETCH_SIZE = 200
+# チェックポイントを記録する単位（チャンク数。ページの途中では区切らない）
+WINDOW_CHUNKS = 4096
+# 1回の encode に渡すチャンク数
+BATCH_SIZE = 64
+# encode の結果を待たずに読み進めるウィンドウの数（読み込み・書き出しと encode を重ねる）
+IN_FLIGHT_WINDOWS = 2
+# IVF・SQ8 の学習に使うベクトルの最大数（全体から等間隔に取り出す）
+TRAIN_SAMPLE_SIZE = 50000
+# インデックスに一度に追加するベクトルの数
+ADD_BATCH_SIZE = 65536
+# vectorized_at をまとめて更新する件数
+UPDATE_BATCH_SIZE = 1000
+
+CHECKPOINT_PATH = os.path.join(BUILD_DIR, 'checkpoint.json')
+VECTORS_PATH = os.path.join(BUILD_DIR, 'vectors.f32')
+PAGES_PATH = os.path.join(BUILD_DIR, 'pages.tsv')
+SPOOL_PREFIX = os.path.join(BUILD_DIR, 'chunks')
+
+
+# --- encode（プロセスプールの各プロセスで動く） ---
+_model = None
+
+
+def init_encoder(model_name, threads):
+    global _model
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    from sentence_transformers import SentenceTransformer
+    _model = SentenceTransformer(model_name)
+
+
+def encode_batch(texts):
+    return np.asarray(_model.encode(texts, convert_to_tensor=False, batch_size=len(texts)), dtype=np.float32)
+
+
+class InlineEncoder:
+    """プロセスを1つしか使わない場合は、プールを作らずにこのプロセスで encode する"""
+
+    def __init__(self, model_name):
+        init_encoder(model_name, available_cpus())
+
+    def submit(self, func, texts):
+        future = Future()
+        future.set_result(func(texts))
+        return future
+
+    def shutdown(self):
+        pass
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# --- ページの読み込みとチャンク分割 ---
+def iter_windows(connection, after_page_id):
+    """after_page_id より後のページを id 順に読み、約 WINDOW_CHUNKS 個のチャンクごとにまとめて返す"""
+    window = new_window()
+    while True:
+        pages = connection.execute(
+            'SELECT id, content, permission_level, updated_at FROM pages WHERE id > ? ORDER BY id LIMIT ?',
+            (after_page_id, PAGE_FETCH_SIZE)
+        ).fetchall()
+        if not pages:
+            break
+        for page in pages:
+            level = required_level(page['permission_level'])
+            content = page['content']
+            # チャンクストアには本文の位置だけを記録する
+            for chunk_no, chunk in enumerate(chunk_page(content)):
+                window['texts'].append(embedding_text(content, chunk))
+                window['page_ids'].append(page['id'])
+                window['chunk_nos'].append(chunk_no)
+                window['starts'].append(chunk.start)
+                window['ends'].append(chunk.end)
+                window['checksums'].append(text_checksum(content[chunk.start:chunk.end]))
+                window['levels'].append(level)
+            window['pages'].append((page['id'], page['updated_at']))
+            if len(window['texts']) >= WINDOW_CHUNKS:
+                yield window
+                window = new_window()
+        after_page_id = pages[-1]['id']
+    if window['pages']:
+        yield window
+
+
+def new_window():
+    return {'texts': [], 'page_ids': [], 'chunk_nos': [], 'starts': [], 'ends': [], 'checksums': [], 'levels': [],
+            'pages': []}
+
+
+def submit_window(window, embedding_cache, encoder):
+    """キャッシュにないチャンクを長さ順に並べて encode に出す"""
+    window['vectors'] = embedding_cache.lookup(MODEL_NAME, window['texts'])
+    # 同じ本文が複数回出てきても1回だけ encode する
+    missing = {}
+    for i, (text, vector) in enumerate(zip(window['texts'], window['vectors'])):
+        if vector is None:
+            missing.setdefault(text, []).append(i)
+    texts = sorted(missing, key=len)
+    window['missing'] = missing
+    window['futures'] = [
+        (texts[start:start + BATCH_SIZE], encoder.submit(encode_batch, texts[start:start + BATCH_SIZE]))
+        for start in range(0, len(texts), BATCH_SIZE)
+    ]
+    return window
+
+
+def complete_window(window, embedding_cache):
+    """encode の結果を待ち、ウィンドウのベクトルの配列を返す"""
+    for texts, future in window['futures']:
+        embeddings = future.result()
+        embedding_cache.store(MODEL_NAME, texts, embeddings)
+        for text, vector in zip(texts, embeddings):
+            for i in window['missing'][text]:
+                window['vectors'][i] = vector
+    if not window['vectors']:
+        # 空のページだけのウィンドウ
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack(window['vectors']).astype(np.float32, copy=False)
+
+
+# --- チェックポイント ---
+def load_checkpoint():
+    if not os.path.exists(CHECKPOINT_PATH):
+        return None
+    with open(CHECKPOINT_PATH, encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('model') != MODEL_NAME:
+        print("モデルが変わったため、最初から作り直します。")
+        return None
+    if checkpoint.get('chunking') != [CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS]:
+        print("チャンクの分け方が変わったため、最初から作り直します。")
+        return None
+    return checkpoint
+
+
+def save_checkpoint(checkpoint):
+    """一時ファイルに書いてから置き換える（書き込み途中で止まっても前のチェックポイントが残る）"""
+    with open(CHECKPOINT_PATH + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(CHECKPOINT_PATH + '.tmp', CHECKPOINT_PATH)
+
+
+def open_truncated(path, size):
+    """ファイルを size バイトに切り詰めて、末尾に追記できるように開く"""
+    f = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+    f.truncate(size)
+    f.seek(size)
+    return f
+
+
+def append_window(window, vectors, spool, vectors_file, pages_file, checkpoint):
+    """ウィンドウのチャンク・ベクトル・ページを追記し、チェックポイントを進める"""
+    first_id = spool.count
+    spool.add_many(np.arange(first_id, first_id + len(window['texts'])), window['page_ids'], window['chunk_nos'],
+                   window['starts'], window['ends'], window['checksums'], window['levels'])
+    if len(vectors):
+        vectors_file.write(vectors.tobytes())
+        checkpoint['dim'] = int(vectors.shape[1])
+    pages_file.write(''.join(f"{page_id}\t{updated_at}\n" for page_id, updated_at in window['pages']).encode('utf-8'))
+
+    # 追記した分をディスクに書き出してから、チェックポイントを記録する
+    spool.flush()
+    for f in (vectors_file, pages_file):
+        f.flush()
+        os.fsync(f.fileno())
+    checkpoint.update({
+        'last_page_id': window['pages'][-1][0],
+        'pages': checkpoint['pages'] + len(window['pages']),
+        'chunks': spool.count,
+        'pages_bytes': pages_file.tell(),
+    })
+    save_checkpoint(checkpoint)
+
+
+# --- 仕上げ ---
+def build_final_index(index_type, n_chunks, dim):
+    """ベクトルのファイルからインデックスを作り、INDEX_PATH.tmp に書く（学習には全体から等間隔に取り出したベクトルを使う）"""
+    import faiss
+
+    vectors = np.memmap(VECTORS_PATH, dtype=np.float32, mode='r', shape=(n_chunks, dim))
+    if index_type in ('ivf_flat', 'ivf_pq', 'sq8'):
+        sample = np.unique(np.linspace(0, n_chunks - 1, min(n_chunks, TRAIN_SAMPLE_SIZE)).astype(np.int64))
+    else:
+        sample = np.arange(min(n_chunks, 1))
+    print("ベクトルデータベースを構築中...")
+    index = build_index(index_type, np.ascontiguousarray(vectors[sample]), n_vectors=n_chunks)
+    for start in range(0, n_chunks, ADD_BATCH_SIZE):
+        end = min(start + ADD_BATCH_SIZE, n_chunks)
+        index.add_with_ids(np.ascontiguousarray(vectors[start:end]), np.arange(start, end, dtype=np.int64))
+    # 読み込み中のアプリを壊さないよう、一時ファイルに書いておき、チャンクストアの後で置き換える（main）
+    faiss.write_index(index, INDEX_PATH + '.tmp')
+    del index, vectors
+
+
+def mark_vectorized(connection):
+    """読み込んだ時点の updated_at を vectorized_at に記録する（以降は差分更新の対象外になる）"""
+    with open(PAGES_PATH, encoding='utf-8') as f:
+        batch = []
+        for line in f:
+            page_id, updated_at = line.rstrip('\n').split('\t')
+            batch.append((updated_at, int(page_id)))
+            if len(batch) >= UPDATE_BATCH_SIZE:
+                connection.executemany('UPDATE pages SET vectorized_at = ? WHERE id = ?', batch)
+                batch = []
+        connection.executemany('UPDATE pages SET vectorized_at = ? WHERE id = ?', batch)
+    # ベクトルDBを作り直したことをアプリに知らせる（/ask のときに読み込み直す）
+    bump_vector_generation(connection)
+    connection.commit()
+
+
+def peak_rss_mb():
+    """このプロセスと、終了した子プロセス（encode のプール）の最大RSS（Linux の ru_maxrss は kB）"""
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ベクトルDBの全件作成')
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default=DEFAULT_INDEX_TYPE,
+                        help='FAISSインデックスの種類（大規模なWikiでは ivf_flat / ivf_pq / hnsw など）')
+    parser.add_argument('--workers', type=int, default=available_cpus(),
+                        help='encode するプロセスの数（既定は使えるCPUの数。1ならプールを作らない）')
+    parser.add_argument('--restart', action='store_true', help='チェックポイントを捨てて最初から作り直す')
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(BUILD_DIR):
+        shutil.rmtree(BUILD_DIR)
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    checkpoint = load_checkpoint()
+    if checkpoint is None:
+        checkpoint = {'model': MODEL_NAME, 'chunking': [CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS], 'last_page_id': 0,
+                      'pages': 0, 'chunks': 0, 'pages_bytes': 0, 'dim': None}
+    else:
+        print(f"チェックポイントから再開します（{checkpoint['pages']}ページ・{checkpoint['chunks']}チャンク処理済み）。")
+
+    print("モデルを読み込んでいます...")
+    if args.workers > 1:
+        # fork だと親のスレッド（FAISS・torch）の状態を引き継いで固まることがあるので spawn で起動する
+        encoder = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn'),
+                                      initializer=init_encoder,
+                                      initargs=(MODEL_NAME, max(1, available_cpus() // args.workers)))
+    else:
+        encoder = InlineEncoder(MODEL_NAME)
+    print(f"モデルの読み込み完了。（encode のプロセス数: {max(args.workers, 1)}）")
+
+    connection = database.connect()
+    total_pages = connection.execute('SELECT count(*) FROM pages').fetchone()[0]
+    embedding_cache = EmbeddingCache()
+    spool = ChunkSpool(SPOOL_PREFIX, checkpoint['chunks'])
+    vectors_file = open_truncated(VECTORS_PATH, checkpoint['chunks'] * (checkpoint['dim'] or 0) * 4)
+    pages_file = open_truncated(PAGES_PATH, checkpoint['pages_bytes'])
+
+    started = time.perf_counter()
+    pages_at_start = checkpoint['pages']
+    print(f"{total_pages}件のページを処理中...")
+    try:
+        in_flight = deque()
+        for window in iter_windows(connection, checkpoint['last_page_id']):
+            in_flight.append(submit_window(window, embedding_cache, encoder))
+            if len(in_flight) >= IN_FLIGHT_WINDOWS:
+                done = in_flight.popleft()
+                append_window(done, complete_window(done, embedding_cache), spool, vectors_file, pages_file, checkpoint)
+                elapsed = time.perf_counter() - started
+                print(f"  {checkpoint['pages']}/{total_pages}ページ, {checkpoint['chunks']}チャンク "
+                      f"({(checkpoint['pages'] - pages_at_start) / elapsed:.1f}ページ/秒)")
+        while in_flight:
+            done = in_flight.popleft()
+            append_window(done, complete_window(done, embedding_cache), spool, vectors_file, pages_file, checkpoint)
+    finally:
+        encoder.shutdown()
+        vectors_file.close()
+        pages_file.close()
+    elapsed = time.perf_counter() - started
+    embedding_cache.report()
+    embedding_cache.close()
+
+    if not checkpoint['chunks']:
+        print("チャンクが1つもないため、ベクトルデータベースを作成できません。")
+        connection.close()
+        return
+
+    build_final_index(args.index_type, checkpoint['chunks'], checkpoint['dim'])
+    # 全件作成ではIDを0から振り直すので、新しいインデックスを古いチャンクストアと組み合わせると、
+    # 別のチャンク（と古い required_level）を引いてしまう。チャンクストアを先に置き換える。
+    # 逆の組み合わせ（古いインデックスと新しいチャンクストア）なら、引けるのは今の権限・本文と一致するチャンクだけになる。
+    # 2つの置き換えの間で止まっても、作業用のファイルは残っているので、もう一度実行すれば続きから仕上げる。
+    # 差分更新（vector_worker.py など）が同時に置き換えないよう、ロックを取ってから置き換える
+    with write_lock(CHUNK_STORE_PREFIX):
+        spool.finish(CHUNK_STORE_PREFIX)
+        os.replace(INDEX_PATH + '.tmp', INDEX_PATH)
+    mark_vectorized(connection)
+    connection.close()
+    shutil.rmtree(BUILD_DIR)
+
+    self_rss, children_rss = peak_rss_mb()
+    processed = checkpoint['pages'] - pages_at_start
+    print(f"ベクトルデータベースの作成が完了しました。（{checkpoint['pages']}ページ・{checkpoint['chunks']}チャンク, "
+          f"{processed / elapsed if elapsed else 0:.1f}ページ/秒, 最大RSS {self_rss:.0f} MB"
+          + (f" + encode のプロセス {children_rss:.0f} MB" if args.workers > 1 else '') + "）")
+
+
+if __name__ == '__main__':
+    main()
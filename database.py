@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import threading
+import urllib.parse
+
+# --- SQLiteの接続 ---
+# アプリ・スクリプトのどちらも、ここの connect() でデータベースに接続する。
+#   journal_mode=WAL   : 読み込みが書き込みを待たない（書き込み中も直前の内容を読める）
+#   synchronous=NORMAL : WALではコミットごとのfsyncを省いても壊れない（電源断で直前のコミットが消えることはある）
+#   busy_timeout       : 他の接続が書き込み中なら、すぐに「database is locked」にせず待つ
+#   cache_size / mmap_size : ページキャッシュを大きくし、読み込みはmmapで行う
+# アプリでは ConnectionManager でスレッドごとに接続を使い回す（リクエストごとに開き直さない）。
+
+DATABASE = 'wiki.db'
+BUSY_TIMEOUT_MS = 5000
+# ページキャッシュの大きさ（負の値はKiB単位。-16000 は約16MB）
+CACHE_SIZE = -16000
+MMAP_SIZE = 256 * 1024 * 1024
+# 接続ごとにコンパイル済みのSQLを覚えておく数（既定の128では、IN (?, ?, ...) の個数違いなどで溢れる）
+STATEMENT_CACHE_SIZE = 512
+
+
+def connect(path=DATABASE, readonly=False, factory=sqlite3.Connection):
+    """設定済みの接続を返す。readonly=True なら書き込めない接続にする（GETのリクエスト用）。
+
+    factory には接続のクラスを指定できる（SQLの時間を計る metrics.TracedConnection など）。
+    """
+    if readonly:
+        uri = 'file:' + urllib.parse.quote(os.path.abspath(path)) + '?mode=ro'
+        connection = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT_MS / 1000,
+                                     cached_statements=STATEMENT_CACHE_SIZE, factory=factory)
+    else:
+        connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000,
+                                     cached_statements=STATEMENT_CACHE_SIZE, factory=factory)
+    connection.row_factory = sqlite3.Row
+    connection.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    if not readonly:
+        # WALはデータベースファイルに記録されるので、書き込める接続で一度設定すれば残る
+        connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = NORMAL')
+    connection.execute(f'PRAGMA cache_size = {CACHE_SIZE}')
+    connection.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    return connection
+
+
+class ConnectionManager:
+    """スレッドごとに接続を1つずつ（読み書き用・読み込み専用）持ち、使い回す"""
+
+    def __init__(self, path=DATABASE, factory=sqlite3.Connection):
+        self.path = path
+        self.factory = factory
+        self._local = threading.local()
+
+    def connection(self, readonly=False):
+        """このスレッドの接続を返す（なければ作る）"""
+        name = 'readonly' if readonly else 'readwrite'
+        connection = getattr(self._local, name, None)
+        if connection is None:
+            connection = connect(self.path, readonly=readonly, factory=self.factory)
+            setattr(self._local, name, connection)
+        return connection
+
+    def release(self):
+        """リクエストの終わりに呼ぶ。コミットされなかった変更を取り消し、接続は閉じずに残す。"""
+        for name in ('readonly', 'readwrite'):
+            connection = getattr(self._local, name, None)
+            if connection is not None and connection.in_transaction:
+                connection.rollback()
+
+    def close(self):
+        """このスレッドの接続を閉じる"""
+        for name in ('readonly', 'readwrite'):
+            connection = getattr(self._local, name, None)
+            if connection is not None:
+                connection.close()
+                setattr(self._local, name, None)
@@ -1,5 +1,7 @@
 import sys
-import sqlite3
+
+import database
+from user_cache import bump_generation
 
 # コマンドラインからの引数が正しいかチェック
 # 例: python delete_user.py ユーザー名
@@ -17,7 +19,7 @@ if username_to_delete == 'admin':
 
 try:
     # データベースに接続
-    connection = sqlite3.connect('wiki.db')
+    connection = database.connect()
     cur = connection.cursor()
 
     # 削除対象のユーザーが存在するか確認
@@ -27,6 +29,8 @@ try:
     if user_exists:
         # ユーザーが存在すれば、削除を実行
         cur.execute("DELETE FROM users WHERE username = ?", (username_to_delete,))
+        # 動いているアプリにユーザー情報のキャッシュを捨てさせる（削除したユーザーのセッションを無効にする）
+        bump_generation(connection)
         # 変更を保存
         connection.commit()
         print(f"ユーザー '{username_to_delete}' が正常に削除されました。")
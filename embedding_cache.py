@@ -0,0 +1,168 @@
+import hashlib
+import sqlite3
+import sys
+
+import numpy as np
+
+# --- 埋め込みベクトルのキャッシュ ---
+# 「モデル名 + チャンク本文」のハッシュをキーにしてベクトルを embedding_cache.db に保存する。
+# 全件作成・差分更新のどちらでも、キャッシュにない（本文が変わった）チャンクだけを encode する。
+# 使い方（メンテナンス用）:
+#   python embedding_cache.py stats   # 件数とサイズを表示
+#   python embedding_cache.py gc      # 現在のページのチャンクにない古いエントリを削除
+
+EMBEDDING_CACHE_PATH = 'embedding_cache.db'
+# 一度に IN (...) で問い合わせるキーの数
+LOOKUP_BATCH_SIZE = 500
+
+
+def cache_key(model_name, text):
+    """モデル名とチャンク本文からキャッシュのキーを作る"""
+    h = hashlib.sha256()
+    h.update(model_name.encode('utf-8'))
+    h.update(b'\0')
+    h.update(text.encode('utf-8'))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """SQLiteに保存する埋め込みベクトルのキャッシュ"""
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model_name TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, keys):
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        for i in range(0, len(unique_keys), LOOKUP_BATCH_SIZE):
+            batch = unique_keys[i:i + LOOKUP_BATCH_SIZE]
+            placeholders = ', '.join('?' for _ in batch)
+            cur = self.connection.execute(
+                f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', batch
+            )
+            for key, vector in cur:
+                found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def lookup(self, model_name, texts):
+        """キャッシュにあるベクトルを texts と同じ順のリストで返す（ないものは None）"""
+        keys = [cache_key(model_name, text) for text in texts]
+        found = self._lookup(keys)
+        vectors = [found.get(key) for key in keys]
+        hit_count = sum(1 for vector in vectors if vector is not None)
+        self.hits += hit_count
+        self.misses += len(texts) - hit_count
+        return vectors
+
+    def store(self, model_name, texts, vectors):
+        """encode したベクトルを保存する"""
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO embeddings (key, model_name, dim, vector) VALUES (?, ?, ?, ?)',
+            [(cache_key(model_name, text), model_name, vector.shape[0], np.asarray(vector, dtype=np.float32).tobytes())
+             for text, vector in zip(texts, vectors)]
+        )
+        self.connection.commit()
+
+    def encode(self, model, model_name, texts, **encode_kwargs):
+        """キャッシュにないテキストだけを model.encode し、全テキストのベクトルを返す"""
+        keys = [cache_key(model_name, text) for text in texts]
+        found = self._lookup(keys)
+
+        # 同じ本文が複数回出てきても1回だけ encode する
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        miss_count = sum(1 for key in keys if key not in found)
+        self.hits += len(keys) - miss_count
+        self.misses += miss_count
+
+        if missing:
+            embeddings = model.encode(list(missing.values()), convert_to_tensor=False, **encode_kwargs)
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            rows = []
+            for key, vector in zip(missing, embeddings):
+                found[key] = vector
+                rows.append((key, model_name, vector.shape[0], vector.tobytes()))
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, model_name, dim, vector) VALUES (?, ?, ?, ?)', rows
+            )
+            self.connection.commit()
+
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([found[key] for key in keys])
+
+    def stats(self):
+        """今回の実行でのヒット率と、キャッシュ全体の件数を返す"""
+        count, size = self.connection.execute(
+            'SELECT count(*), coalesce(sum(length(vector)), 0) FROM embeddings'
+        ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': count,
+            'bytes': size,
+        }
+
+    def report(self):
+        stats = self.stats()
+        print(f"埋め込みキャッシュ: ヒット {stats['hits']}件 / ミス {stats['misses']}件 "
+              f"(ヒット率 {stats['hit_rate']:.1%}), 保存件数 {stats['entries']}件")
+
+    def gc(self, model_name, live_texts):
+        """live_texts に含まれないエントリ（と、他のモデルのエントリ）を削除し、削除件数を返す"""
+        self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS live_keys (key TEXT PRIMARY KEY)')
+        self.connection.execute('DELETE FROM live_keys')
+        self.connection.executemany(
+            'INSERT OR IGNORE INTO live_keys (key) VALUES (?)',
+            ((cache_key(model_name, text),) for text in live_texts)
+        )
+        cur = self.connection.execute('DELETE FROM embeddings WHERE key NOT IN (SELECT key FROM live_keys)')
+        deleted = cur.rowcount
+        self.connection.commit()
+        self.connection.execute('VACUUM')
+        return deleted
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    cache = EmbeddingCache()
+    try:
+        if command == 'stats':
+            stats = cache.stats()
+            print(f"保存件数: {stats['entries']}件, サイズ: {stats['bytes'] / 1024 / 1024:.1f} MB")
+        elif command == 'gc':
+            import database
+            from chunker import chunk_page, embedding_text
+            from retrieval import MODEL_NAME
+
+            # チャンクストアには本文がないので、今のページ本文からチャンクを作り直して比べる
+            connection = database.connect(readonly=True)
+            live_texts = (embedding_text(content, chunk)
+                          for (content,) in connection.execute('SELECT content FROM pages')
+                          for chunk in chunk_page(content))
+            deleted = cache.gc(MODEL_NAME, live_texts)
+            connection.close()
+            print(f"使われていないエントリを{deleted}件削除しました。")
+        else:
+            print("使い方: python embedding_cache.py [stats|gc]")
+            sys.exit(1)
+    finally:
+        cache.close()
@@ -0,0 +1,55 @@
+import hashlib
+import os
+import threading
+
+# --- HTTPの条件付きGET（ETag / 304）とキャッシュの指定 ---
+# ページ・一覧は、内容を決める値（ページの updated_at と本文のハッシュ、Wiki全体の世代番号、
+# 閲覧しているユーザーなど）から ETag を作る。ブラウザが同じ ETag を If-None-Match で送ってきたら、
+# テンプレートを描画せずに 304 を返す。ETag は権限のチェックを通ったあとで比べる。
+# static/ のファイルは中身のハッシュを URL（?v=...）に付け、URLが変わらない限り変わらないものとして長くキャッシュさせる。
+
+# ログイン状態で内容が変わるページ: 共有キャッシュには置かせず、毎回 ETag で確認させる
+PRIVATE_REVALIDATE = 'private, no-cache'
+# 中身のハッシュ付きURLの静的ファイル: 1年間、確認なしで使わせる
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# URLに付ける中身のハッシュの長さ
+FINGERPRINT_LENGTH = 12
+
+
+def make_etag(*parts):
+    """ETag の値（引用符なし）を作る。parts のどれかが変われば別の値になる。"""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()[:32]
+
+
+class StaticFingerprints:
+    """static/ のファイル名 → 中身のハッシュ（ファイルの更新日時・サイズが変わったら計算し直す）"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def fingerprint(self, filename):
+        """ファイルの中身のハッシュを返す。ファイルがなければ None。"""
+        path = os.path.join(self.folder, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(filename)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                h.update(block)
+        digest = h.hexdigest()[:FINGERPRINT_LENGTH]
+        with self._lock:
+            self._entries[filename] = (key, digest)
+        return digest
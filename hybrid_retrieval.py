@@ -0,0 +1,174 @@
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+
+from chunker import chunk_page
+from database import ConnectionManager
+from metrics import TracedConnection, record_span
+from search_index import question_terms, rank_pages_for_question
+
+logger = logging.getLogger(__name__)
+
+# --- ハイブリッド検索（キーワード検索 + ベクトル検索） ---
+# MiniLMのベクトル検索は英語中心のモデルなので、日本語の製品名やチケット番号の完全一致を取りこぼす。
+# FTS5（bm25）のキーワード検索とFAISSのベクトル検索を並列に実行し、
+# Reciprocal Rank Fusion（順位の逆数の和）でページ単位に統合する。
+# それぞれに時間の上限を設け、間に合わなかった側は捨てて、間に合った側の結果だけを使う。
+# 捨てた検索がスレッドを使い続けないよう、各検索には締め切りを渡して途中でやめさせ（ベクトル検索は結果を待つのをやめ、
+# キーワード検索は SQLite の progress handler で中断する）、スレッドプールも検索の種類ごとに分ける。
+# 捨てたがまだ動いている検索の数は abandoned で見られる（/metrics に出す）。
+
+MODE_HYBRID = 'hybrid'
+MODE_VECTOR = 'vector'
+MODE_LEXICAL = 'lexical'
+MODES = (MODE_HYBRID, MODE_VECTOR, MODE_LEXICAL)
+
+# RRFの定数（順位が下の結果の重みを緩やかにする）
+RRF_K = 60
+# 統合前に各検索から取り出す件数（k件の何倍か）
+CANDIDATE_MULTIPLIER = 4
+# キーワード検索の締め切りを確認する間隔（SQLiteの仮想マシンの命令数）
+PROGRESS_CHECK_STEPS = 1000
+STAGES = ('vector', 'lexical')
+
+
+def best_passage(content, terms):
+    """ページ本文から、検索語を最も多く含むチャンク（ベクトル検索と同じ分け方）を返す"""
+    passages = [content[chunk.start:chunk.end] for chunk in chunk_page(content)]
+    if not passages:
+        return content
+    return max(passages, key=lambda passage: sum(1 for term in terms if term in passage))
+
+
+def reciprocal_rank_fusion(result_lists, k):
+    """複数の [(ページID, 本文), ...] をRRFで統合し、ページごとに1件ずつ上位k件を返す。
+
+    同じページの本文は、先に渡したリスト（ベクトル検索）の最上位のものを使う。
+    """
+    scores = {}
+    passages = {}
+    for results in result_lists:
+        seen = set()
+        rank = 0
+        for page_id, text in results:
+            # 同じページの2件目以降のチャンクは順位に数えない
+            if page_id in seen:
+                continue
+            seen.add(page_id)
+            rank += 1
+            scores[page_id] = scores.get(page_id, 0.0) + 1.0 / (RRF_K + rank)
+            passages.setdefault(page_id, text)
+    ranked = sorted(scores, key=lambda page_id: scores[page_id], reverse=True)
+    return [(page_id, passages[page_id]) for page_id in ranked[:k]]
+
+
+class HybridRetriever:
+    """キーワード検索とベクトル検索を並列に実行して統合する"""
+
+    def __init__(self, vector_search, database, vector_budget_ms=1000, lexical_budget_ms=200, max_workers=8):
+        # vector_search(query, k, user_level, timeout) -> [(ページID, 本文), ...]（QueryBatcher.search）
+        self.vector_search = vector_search
+        # 検索スレッドごとに読み込み専用の接続を使い回す
+        self._connections = ConnectionManager(database, factory=TracedConnection)
+        self.vector_budget = vector_budget_ms / 1000
+        self.lexical_budget = lexical_budget_ms / 1000
+        # 片方の検索が遅くなっても、もう片方がスレッドの空きを待たされないよう、プールを分ける
+        self._executors = {
+            name: ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'hybrid-{name}') for name in STAGES
+        }
+        # 上限に間に合わずに捨てたが、まだ動いている検索の数
+        self.abandoned = dict.fromkeys(STAGES, 0)
+        self._abandoned_lock = threading.Lock()
+
+    def vector_search_until(self, query, k, user_level, deadline):
+        """締め切り（time.perf_counter() の値）を過ぎたら結果を待つのをやめる"""
+        return self.vector_search(query, k, user_level, timeout=max(deadline - time.perf_counter(), 0))
+
+    def lexical_search(self, query, k, user_level, deadline=None):
+        """FTS5で質問文に関係するページを探し、それぞれ最も関係するチャンクを返す。
+
+        deadline（time.perf_counter() の値）を過ぎたらSQLを中断して TimeoutError にする。
+        """
+        # SQLiteの接続はスレッドをまたいで使えないので、このスレッドの接続を使う
+        if deadline is not None and time.perf_counter() > deadline:
+            raise TimeoutError('キーワード検索が始まる前に時間の上限を超えました。')
+        connection = self._connections.connection(readonly=True)
+        if deadline is not None:
+            connection.set_progress_handler(lambda: time.perf_counter() > deadline, PROGRESS_CHECK_STEPS)
+        try:
+            rows = rank_pages_for_question(connection, query, k, user_level)
+        except sqlite3.OperationalError:
+            if deadline is not None and time.perf_counter() > deadline:
+                raise TimeoutError('キーワード検索が時間の上限を超えたため中断しました。')
+            raise
+        finally:
+            if deadline is not None:
+                connection.set_progress_handler(None, 0)
+        terms = question_terms(query)
+        return [(page_id, best_passage(content, terms)) for page_id, title, content in rows]
+
+    def _abandon(self, name, future):
+        """上限に間に合わなかった検索を、終わるまで abandoned に数える"""
+        with self._abandoned_lock:
+            self.abandoned[name] += 1
+
+        def done(_):
+            with self._abandoned_lock:
+                self.abandoned[name] -= 1
+        future.add_done_callback(done)
+
+    def _timed(self, func, *args):
+        started = time.perf_counter()
+        return func(*args), (time.perf_counter() - started) * 1000
+
+    def retrieve(self, query, k=3, user_level=0, mode=MODE_HYBRID):
+        """上位k件の [(ページID, 本文), ...] と、各段階の所要時間などの情報を返す"""
+        n_candidates = k * CANDIDATE_MULTIPLIER
+        started = time.perf_counter()
+        stages = {}
+        if mode in (MODE_HYBRID, MODE_VECTOR):
+            stages['vector'] = (self._executors['vector'].submit(
+                self._timed, self.vector_search_until, query, n_candidates, user_level, started + self.vector_budget
+            ), self.vector_budget)
+        if mode in (MODE_HYBRID, MODE_LEXICAL):
+            stages['lexical'] = (self._executors['lexical'].submit(
+                self._timed, self.lexical_search, query, n_candidates, user_level, started + self.lexical_budget
+            ), self.lexical_budget)
+
+        # 各段階はそれぞれの上限（開始時刻から数える）まで待ち、間に合わなければ捨てる
+        # errors には失敗した段階の名前だけを入れる（/ask の応答に含まれるので、例外の内容はログにだけ出す）
+        info = {'mode': mode, 'dropped': [], 'errors': []}
+        result_lists = []
+        for name in STAGES:
+            if name not in stages:
+                continue
+            future, budget = stages[name]
+            wait([future], timeout=max(started + budget - time.perf_counter(), 0))
+            if not future.done():
+                info['dropped'].append(name)
+                self._abandon(name, future)
+                continue
+            try:
+                results, elapsed_ms = future.result()
+            except TimeoutError:
+                # 締め切りで自分から打ち切った
+                info['dropped'].append(name)
+                continue
+            except Exception:
+                logger.exception('%s の検索に失敗しました', name)
+                info['errors'].append(name)
+                continue
+            info[f'{name}_ms'] = round(elapsed_ms, 1)
+            # 検索スレッドでかかった時間を、このリクエストの区間として記録する
+            record_span(f'{name}_search', elapsed_ms / 1000)
+            if elapsed_ms > budget * 1000:
+                info['dropped'].append(name)
+                continue
+            result_lists.append(results)
+
+        # 片方だけの場合も、同じページのチャンクは1件にまとめる
+        fused = reciprocal_rank_fusion(result_lists, k)
+        info['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return fused, info
@@ -1,11 +1,12 @@
-import sqlite3
 from flask_bcrypt import Bcrypt
 
+import database
+
 # このスクリプトは独立して実行されるため、一時的にBcryptを初期化
 bcrypt = Bcrypt()
 
 # データベースファイルに接続（なければ新規作成される）
-connection = sqlite3.connect('wiki.db')
+connection = database.connect()
 
 # schema.sqlファイルを開いて中身を読み込む
 with open('schema.sql', encoding='utf-8') as f:
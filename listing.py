@@ -0,0 +1,104 @@
+import base64
+import binascii
+import json
+
+import numpy as np
+
+from permissions import visible_page_levels
+
+# --- 一覧のページ分割（キーセット方式） ---
+# OFFSET で n ページ目を取ると、前のページの行を全部読み飛ばすので深いページほど遅くなる。
+# 代わりに「前のページの最後の行のキー」をカーソルとして渡し、その続きから LIMIT 件だけ読む。
+# 並び順の列にはインデックスがあるので（schema.sql）、何ページ目でも同じ手間で取り出せる。
+# 閲覧できないページはSQLの段階で除く（要求レベルごとにインデックスを引く）。
+#   new     : 新しく作られた順（id の降順）
+#   updated : 最近更新された順（updated_at, id の降順）
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+ORDERS = ('new', 'updated')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """カーソルのキーをURLに使える文字列にする"""
+    data = json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """encode_cursor の逆。空なら None、壊れていれば InvalidCursor を送出する。"""
+    if not cursor:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (binascii.Error, ValueError):
+        raise InvalidCursor("カーソルが正しくありません。")
+    if not isinstance(values, list):
+        raise InvalidCursor("カーソルが正しくありません。")
+    return values
+
+
+def _union_by_level(columns, where, order_by, params, levels, limit):
+    """要求レベルごとに並び順のインデックスで limit 件ずつ取り出し、まとめて並べ直すSQLを作る。
+
+    「required_level >= ?」の範囲条件だと、並び順どおりに読みながら閲覧できないページを読み飛ばすことになり、
+    隠れたページが多いほど遅くなる。レベルごとに (required_level, 並び順) のインデックスを引けば、
+    読む行数は「レベルの数 × limit」で決まる。
+    """
+    parts = []
+    all_params = []
+    for level in levels:
+        condition = 'required_level = ?' + (f' AND {where}' if where else '')
+        parts.append(f'SELECT * FROM (SELECT {columns} FROM pages WHERE {condition} ORDER BY {order_by} LIMIT ?)')
+        all_params.extend([level] + list(params) + [limit])
+    sql = ' UNION ALL '.join(parts) + f' ORDER BY {order_by} LIMIT ?'
+    return sql, all_params + [limit]
+
+
+def list_pages(db, order='new', cursor=None, limit=PAGE_SIZE, user_level=0):
+    """user_level のユーザーが閲覧できるページの一覧を1ページ分取り出し、
+    ([{id, title}, ...], 次のページのカーソル) を返す。最後のページなら次のカーソルは None。
+    """
+    after = decode_cursor(cursor)
+    levels = visible_page_levels(user_level)
+    # 1件多く読んで、次のページがあるかどうかを調べる
+    if order == 'new':
+        where, params = ('id < ?', [_int_key(after, 0)]) if after is not None else ('', [])
+        sql, params = _union_by_level('id, title', where, 'id DESC', params, levels, limit + 1)
+        key = lambda row: [row['id']]
+    elif order == 'updated':
+        if after is not None and (len(after) != 2 or not isinstance(after[0], str)):
+            raise InvalidCursor("カーソルが正しくありません。")
+        where, params = ('(updated_at, id) < (?, ?)', [after[0], _int_key(after, 1)]) if after is not None else ('', [])
+        sql, params = _union_by_level('id, title, updated_at', where, 'updated_at DESC, id DESC', params, levels, limit + 1)
+        key = lambda row: [row['updated_at'], row['id']]
+    else:
+        raise ValueError(f"不明な並び順です: {order}（{', '.join(ORDERS)} のいずれか）")
+
+    rows = db.execute(sql, params).fetchall() if levels else []
+    next_cursor = encode_cursor(key(rows[limit - 1])) if len(rows) > limit else None
+    return [{'id': row['id'], 'title': row['title']} for row in rows[:limit]], next_cursor
+
+
+def page_id_window(page_ids, cursor=None, limit=PAGE_SIZE):
+    """昇順のページID配列（タグの索引の結果）から、新しい順に1ページ分を取り出す。
+
+    (ページIDのリスト, 次のページのカーソル) を返す。
+    """
+    after = decode_cursor(cursor)
+    end = len(page_ids) if after is None else int(np.searchsorted(page_ids, _int_key(after, 0)))
+    start = max(end - limit, 0)
+    window = [int(page_id) for page_id in page_ids[start:end][::-1]]
+    next_cursor = encode_cursor([window[-1]]) if start > 0 else None
+    return window, next_cursor
+
+
+def _int_key(values, i):
+    if len(values) <= i or not isinstance(values[i], int):
+        raise InvalidCursor("カーソルが正しくありません。")
+    return values[i]
@@ -0,0 +1,68 @@
+import os
+
+import openai
+
+# --- LLMクライアント ---
+# OpenAI互換のAPI（chat.completions）に回答をストリーミングで生成させる。
+# 接続先は環境変数で切り替えられる（ローカルの偽LLMサーバーで試す場合など）。
+#   OPENAI_API_KEY  : APIキー（未設定ならLLMは呼ばず、デモとしてプロンプトをそのまま返す）
+#   OPENAI_BASE_URL : 接続先（例: http://127.0.0.1:8001/v1）
+#   LLM_MODEL       : モデル名
+
+DEFAULT_MODEL = 'gpt-4o-mini'
+# LLMの接続・応答待ちの上限（秒）
+LLM_TIMEOUT = 60
+
+SYSTEM_PROMPT = (
+    "あなたは優秀な社内アシスタントです。以下の社内Wikiの情報だけを使って、ユーザーからの質問に日本語で回答してください。"
+    "情報が見つからない場合は、「関連情報が見つかりませんでした」と正直に答えてください。"
+)
+
+
+def build_prompt(context, question):
+    """検索結果のコンテキストと質問からユーザー側のメッセージを作る"""
+    return f"--- 参考情報 ---\n{context}\n---\n\n質問: {question}\n回答:"
+
+
+class LLMClient:
+    """回答をトークンごとに返すLLMクライアント"""
+
+    def __init__(self, model=None, base_url=None, api_key=None, timeout=LLM_TIMEOUT):
+        self.model = model or os.environ.get('LLM_MODEL', DEFAULT_MODEL)
+        api_key = api_key or os.environ.get('OPENAI_API_KEY')
+        base_url = base_url or os.environ.get('OPENAI_BASE_URL')
+        # APIキーがなければデモモード（プロンプトをそのまま返す）
+        self._client = openai.OpenAI(api_key=api_key, base_url=base_url, timeout=timeout) if api_key else None
+
+    @property
+    def is_demo(self):
+        return self._client is None
+
+    def stream(self, context, question):
+        """回答の断片（文字列）を生成されたそばから返すジェネレーター。
+
+        途中で close() される（ブラウザが切断した）と、LLMへの接続も閉じて生成を打ち切る。
+        """
+        prompt = build_prompt(context, question)
+        if self._client is None:
+            yield f"【AIへのプロンプト（デモ）】\n{SYSTEM_PROMPT}\n\n{prompt}"
+            return
+
+        response = self._client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {'role': 'system', 'content': SYSTEM_PROMPT},
+                {'role': 'user', 'content': prompt},
+            ],
+            stream=True,
+        )
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            response.close()
+
+    def complete(self, context, question):
+        """回答全体を1つの文字列で返す"""
+        return ''.join(self.stream(context, question))
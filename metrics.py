@@ -0,0 +1,215 @@
+import bisect
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# --- 計測（Prometheus形式のヒストグラム・SQLの計測・処理の区間） ---
+# 本番で常に有効にしておけるよう、1回の記録は「時刻を2回読んで、ロックを取って数を足す」だけにしている。
+#   - Histogram: 値をバケットごとに数える。/metrics で Prometheus のテキスト形式にして返す
+#   - span(name): with で囲んだ区間の時間を wiki_span_seconds{span=name} に記録する
+#     （Markdownの変換、encode、FAISSの検索、テンプレートの描画など）
+#   - TracedConnection: db.execute / executemany の回数と時間を数え、遅いSQLをログに出す
+#   - RequestTrace: リクエスト1回分のSQLの回数・時間と区間の時間（スレッドごと）。
+#     別のスレッドで行う処理（QueryBatcher の encode など）はヒストグラムには入るが、リクエストには数えない
+# 値はプロセスごと。複数のワーカーで動かす場合は、Prometheus 側でワーカーごとに集計する。
+
+# 秒のヒストグラムのバケット（Prometheus の既定に近いもの）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 1リクエストあたりのSQLの回数のバケット
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+# これより遅いSQLはログに出す（秒）
+SLOW_QUERY_SECONDS = 0.1
+# ログに出すSQLの最大文字数
+SLOW_QUERY_MAX_CHARS = 500
+
+logger = logging.getLogger(__name__)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class Histogram:
+    """ラベルの値の組ごとに、バケットごとの件数・合計・件数を持つ"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # ラベルの値の組 → [バケットごとの件数（累積ではない）..., +Inf の件数, 合計]
+        self._series = {}
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labelvalues, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {_format_value(series[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """/metrics を返すときに func() を呼んで値を読む"""
+
+    def __init__(self, name, help_text, func):
+        self.name = name
+        self.help_text = help_text
+        self.func = func
+
+    def render(self):
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.warning('%s を読めませんでした: %s', self.name, e)
+            return []
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge',
+                f'{self.name} {_format_value(value)}']
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus のテキスト形式（text/plain; version=0.0.4）の文字列を返す"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'wiki_request_seconds', 'リクエストの処理時間', ('endpoint', 'method', 'status')))
+REQUEST_SQL_QUERIES = REGISTRY.register(Histogram(
+    'wiki_request_sql_queries', '1リクエストで実行したSQLの回数', ('endpoint',), buckets=COUNT_BUCKETS))
+REQUEST_SQL_SECONDS = REGISTRY.register(Histogram(
+    'wiki_request_sql_seconds', '1リクエストでSQLにかかった時間の合計', ('endpoint',)))
+SQL_SECONDS = REGISTRY.register(Histogram(
+    'wiki_sql_seconds', 'SQL 1回の実行時間（execute / executemany）'))
+SPAN_SECONDS = REGISTRY.register(Histogram(
+    'wiki_span_seconds', '処理の区間ごとの時間', ('span',)))
+
+
+class RequestTrace:
+    """リクエスト1回分の計測値"""
+
+    __slots__ = ('started', 'sql_count', 'sql_seconds', 'spans')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        # 区間の名前 → 合計秒数
+        self.spans = {}
+
+
+_local = threading.local()
+
+
+def start_request():
+    """このスレッドでリクエストの計測を始める"""
+    trace = _local.trace = RequestTrace()
+    return trace
+
+
+def finish_request(endpoint, method, status):
+    """このスレッドのリクエストの計測を終えてヒストグラムに記録し、RequestTrace を返す"""
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return None
+    _local.trace = None
+    REQUEST_SECONDS.observe(time.perf_counter() - trace.started, endpoint, method, str(status))
+    REQUEST_SQL_QUERIES.observe(trace.sql_count, endpoint)
+    REQUEST_SQL_SECONDS.observe(trace.sql_seconds, endpoint)
+    return trace
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+def record_span(name, seconds):
+    SPAN_SECONDS.observe(seconds, name)
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.spans[name] = trace.spans.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name):
+    """with で囲んだ区間の時間を記録する"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def _record_sql(sql, started):
+    seconds = time.perf_counter() - started
+    SQL_SECONDS.observe(seconds)
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.sql_count += 1
+        trace.sql_seconds += seconds
+    if seconds >= SLOW_QUERY_SECONDS:
+        logger.warning('遅いSQL (%.1f ms): %s', seconds * 1000, ' '.join(sql.split())[:SLOW_QUERY_MAX_CHARS])
+
+
+class TracedConnection(sqlite3.Connection):
+    """execute / executemany の時間を計る接続（database.connect(factory=TracedConnection) で使う）
+
+    時間は最初の行を取り出すまで。fetchall で残りの行を読む時間は含まない。
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_sql(sql, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_sql(sql, started)
@@ -0,0 +1,241 @@
+import sys
+
+from database import DATABASE, connect
+from permissions import required_level
+from search_index import rebuild_search_index
+
+# 既存の wiki.db を最新のスキーマに移行するスクリプト
+# 使い方: python migrate_db.py [データベースファイル]
+# 新規作成する場合は init_db.py (schema.sql) を使う。schema.sql と同じ内容をここにも定義する。
+
+
+def migrate_0001_search_index(connection):
+    """全文検索用のFTS5インデックスとトリガーを作成し、既存ページを登録する"""
+    connection.executescript("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+            title,
+            content,
+            tags,
+            authors,
+            tokenize = 'trigram'
+        );
+
+        DROP TRIGGER IF EXISTS pages_fts_after_insert;
+        CREATE TRIGGER pages_fts_after_insert AFTER INSERT ON pages BEGIN
+            INSERT INTO pages_fts (rowid, title, content, tags, authors)
+            VALUES (
+                new.id, new.title, new.content, '',
+                (SELECT group_concat(username, ' ') FROM users WHERE id IN (new.author_id, new.updated_by_id))
+            );
+        END;
+
+        DROP TRIGGER IF EXISTS pages_fts_after_update;
+        CREATE TRIGGER pages_fts_after_update AFTER UPDATE OF title, content, author_id, updated_by_id ON pages BEGIN
+            UPDATE pages_fts
+            SET title = new.title,
+                content = new.content,
+                authors = (SELECT group_concat(username, ' ') FROM users WHERE id IN (new.author_id, new.updated_by_id))
+            WHERE rowid = new.id;
+        END;
+
+        DROP TRIGGER IF EXISTS pages_fts_after_delete;
+        CREATE TRIGGER pages_fts_after_delete AFTER DELETE ON pages BEGIN
+            DELETE FROM pages_fts WHERE rowid = old.id;
+        END;
+
+        DROP TRIGGER IF EXISTS page_tags_fts_after_insert;
+        CREATE TRIGGER page_tags_fts_after_insert AFTER INSERT ON page_tags BEGIN
+            UPDATE pages_fts
+            SET tags = (SELECT group_concat(t.name, ' ') FROM tags t JOIN page_tags pt ON t.id = pt.tag_id WHERE pt.page_id = new.page_id)
+            WHERE rowid = new.page_id;
+        END;
+
+        DROP TRIGGER IF EXISTS page_tags_fts_after_delete;
+        CREATE TRIGGER page_tags_fts_after_delete AFTER DELETE ON page_tags BEGIN
+            UPDATE pages_fts
+            SET tags = coalesce((SELECT group_concat(t.name, ' ') FROM tags t JOIN page_tags pt ON t.id = pt.tag_id WHERE pt.page_id = old.page_id), '')
+            WHERE rowid = old.page_id;
+        END;
+    """)
+    rebuild_search_index(connection)
+
+
+def migrate_0002_page_renders(connection):
+    """Markdownのレンダリング結果を保存するテーブルを作成する"""
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS page_renders (
+            page_id INTEGER PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            content_html TEXT NOT NULL,
+            FOREIGN KEY (page_id) REFERENCES pages (id)
+        )
+    """)
+
+
+def migrate_0003_updated_at(connection):
+    """pagesテーブルに updated_at（と、古いDBにない vectorized_at）を追加する"""
+    columns = {row['name'] for row in connection.execute('PRAGMA table_info(pages)')}
+    if 'vectorized_at' not in columns:
+        connection.execute('ALTER TABLE pages ADD COLUMN vectorized_at TIMESTAMP')
+    if 'updated_at' not in columns:
+        # ALTER TABLE では式のデフォルト値を付けられないので、既存の行は created_at で埋める
+        connection.execute('ALTER TABLE pages ADD COLUMN updated_at TIMESTAMP')
+        connection.execute('UPDATE pages SET updated_at = created_at WHERE updated_at IS NULL')
+    # 以前の datetime.isoformat() 形式の値を updated_at と比較できる形式にそろえる
+    connection.execute("UPDATE pages SET vectorized_at = replace(vectorized_at, 'T', ' ') WHERE vectorized_at LIKE '%T%'")
+
+
+def migrate_0004_generations(connection):
+    """タグの索引などの世代番号を保存するテーブルを作成する"""
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS generations (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    connection.execute("INSERT OR IGNORE INTO generations (name, value) VALUES ('tags', 0)")
+
+
+def migrate_0005_listing_indexes(connection):
+    """一覧のページ分割とタグの付け替えで使うインデックスを作成する"""
+    connection.execute('CREATE INDEX IF NOT EXISTS idx_pages_updated_at ON pages (updated_at DESC, id DESC)')
+    connection.execute('CREATE INDEX IF NOT EXISTS idx_page_tags_tag_id ON page_tags (tag_id, page_id)')
+
+
+def migrate_0006_required_level(connection):
+    """pagesテーブルに閲覧に必要なレベル（整数）の列とインデックスを追加する"""
+    columns = {row['name'] for row in connection.execute('PRAGMA table_info(pages)')}
+    if 'required_level' not in columns:
+        connection.execute('ALTER TABLE pages ADD COLUMN required_level INTEGER NOT NULL DEFAULT 1')
+    # 既存の権限レベル（文字列）から計算する（不明な値は最も厳しい0になる）
+    cur = connection.execute('SELECT DISTINCT permission_level FROM pages')
+    connection.executemany(
+        'UPDATE pages SET required_level = ? WHERE permission_level = ?',
+        [(required_level(row['permission_level']), row['permission_level']) for row in cur.fetchall()]
+    )
+    connection.execute('DROP INDEX IF EXISTS idx_pages_updated_at')
+    connection.execute('CREATE INDEX IF NOT EXISTS idx_pages_level_id ON pages (required_level, id)')
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS idx_pages_level_updated_at ON pages (required_level, updated_at DESC, id DESC)'
+    )
+
+
+def migrate_0007_user_generation(connection):
+    """ユーザー情報のキャッシュを捨てるための世代番号を追加する"""
+    connection.execute("INSERT OR IGNORE INTO generations (name, value) VALUES ('users', 0)")
+
+
+def migrate_0008_page_generation(connection):
+    """ページの追加・変更・削除で進む世代番号とトリガーを追加する（一覧の ETag に使う）"""
+    connection.executescript("""
+        INSERT OR IGNORE INTO generations (name, value) VALUES ('pages', 0);
+        DROP TRIGGER IF EXISTS pages_generation_after_insert;
+        DROP TRIGGER IF EXISTS pages_generation_after_update;
+        DROP TRIGGER IF EXISTS pages_generation_after_delete;
+        CREATE TRIGGER pages_generation_after_insert AFTER INSERT ON pages BEGIN
+            UPDATE generations SET value = value + 1 WHERE name = 'pages';
+        END;
+        CREATE TRIGGER pages_generation_after_update AFTER UPDATE OF title, content, permission_level, required_level, updated_at ON pages BEGIN
+            UPDATE generations SET value = value + 1 WHERE name = 'pages';
+        END;
+        CREATE TRIGGER pages_generation_after_delete AFTER DELETE ON pages BEGIN
+            UPDATE generations SET value = value + 1 WHERE name = 'pages';
+        END;
+    """)
+
+
+def migrate_0009_uploads(connection):
+    """ページの添付ファイルを記録するテーブルを作成する"""
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS uploads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            page_id INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            content_type TEXT,
+            size INTEGER NOT NULL,
+            uploaded_by_id INTEGER,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (page_id) REFERENCES pages (id),
+            FOREIGN KEY (uploaded_by_id) REFERENCES users (id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_uploads_page_id ON uploads (page_id);
+        CREATE INDEX IF NOT EXISTS idx_uploads_sha256 ON uploads (sha256);
+    """)
+
+
+def migrate_0010_page_revisions(connection):
+    """ページの版の履歴を保存するテーブルを作成する（既存のページは次の編集時に最初の版を記録する）"""
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS page_revisions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            page_id INTEGER NOT NULL,
+            revision INTEGER NOT NULL,
+            is_snapshot INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            content_sha1 TEXT NOT NULL,
+            title TEXT NOT NULL,
+            edited_by_id INTEGER,
+            created_at TIMESTAMP NOT NULL,
+            UNIQUE (page_id, revision),
+            FOREIGN KEY (page_id) REFERENCES pages (id),
+            FOREIGN KEY (edited_by_id) REFERENCES users (id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_page_revisions_snapshots ON page_revisions (page_id, revision) WHERE is_snapshot = 1;
+    """)
+
+
+def migrate_0011_vector_jobs(connection):
+    """保存時のベクトル化の予約テーブルと、ベクトルDBの世代番号を追加する"""
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS vector_jobs (
+            page_id INTEGER PRIMARY KEY,
+            enqueued_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            run_after REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            state TEXT NOT NULL DEFAULT 'pending',
+            last_error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_vector_jobs_ready ON vector_jobs (state, run_after);
+        INSERT OR IGNORE INTO generations (name, value) VALUES ('vectors', 0);
+    """)
+
+
+# 番号順に適用するマイグレーションの一覧（PRAGMA user_version に適用済みの番号を保存する）
+MIGRATIONS = [
+    migrate_0001_search_index,
+    migrate_0002_page_renders,
+    migrate_0003_updated_at,
+    migrate_0004_generations,
+    migrate_0005_listing_indexes,
+    migrate_0006_required_level,
+    migrate_0007_user_generation,
+    migrate_0008_page_generation,
+    migrate_0009_uploads,
+    migrate_0010_page_revisions,
+    migrate_0011_vector_jobs,
+]
+
+
+def migrate(connection):
+    """未適用のマイグレーションを順番に適用する"""
+    version = connection.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        print(f"マイグレーション {number}: {migration.__doc__}")
+        migration(connection)
+        connection.execute(f'PRAGMA user_version = {number}')
+        connection.commit()
+    return len(MIGRATIONS)
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else DATABASE
+    connection = connect(path)
+    try:
+        version = migrate(connection)
+        print(f"データベースはバージョン {version} です。")
+    finally:
+        connection.close()
@@ -0,0 +1,49 @@
+# --- 閲覧権限の定義 ---
+# 役職とページの権限レベルを「数字が小さいほど偉い」レベルに変換する。
+# ユーザーのレベルがページの要求レベル以下（同じか小さい）なら閲覧できる。
+# app.py の check_permission と、ベクトルDB（チャンクごとに要求レベルを保存する）で共有する。
+# pagesテーブルにも要求レベルを required_level 列（整数）として保存し、一覧や検索のSQLで絞り込む。
+
+# 役職の階層を定義（数字が小さいほど偉い）
+ROLE_HIERARCHY = {'Admin': 0, 'Member': 1, 'Intern': 2, 'Customer': 3}
+
+# ページの権限レベルを定義
+PERMISSION_MAP = {
+    '管理者のみ': 0,
+    '社員以上': 1,
+    'インターン生以上': 2,
+    '全員に公開': 4 # ログインしていない人も含めて全員
+}
+
+# ログインしていない人・不明な役職のレベル（「全員に公開」のページだけ見られる）
+ANONYMOUS_LEVEL = 4
+
+# ページの要求レベルが取りうる値の一覧（不明な権限レベルは0になる）
+PAGE_LEVELS = sorted(set(PERMISSION_MAP.values()) | {0})
+
+# ユーザーが取りうるレベルの一覧（ベクトル検索のレベル別フィルタを作るのに使う）
+VIEWER_LEVELS = sorted(set(ROLE_HIERARCHY.values()) | {ANONYMOUS_LEVEL})
+
+
+def required_level(page_permission_level):
+    """ページの権限レベル（文字列）から、閲覧に必要なレベルを返す"""
+    # 不明な場合は最も厳しい「管理者のみ」
+    return PERMISSION_MAP.get(page_permission_level, 0)
+
+
+def viewer_level(user):
+    """ユーザーのレベルを返す（ログインしていなければ ANONYMOUS_LEVEL）"""
+    if not user.is_authenticated:
+        return ANONYMOUS_LEVEL
+    # 不明な役職は最も権限が低い
+    return ROLE_HIERARCHY.get(user.role, ANONYMOUS_LEVEL)
+
+
+def can_view(user_level, page_required_level):
+    """ユーザーのレベルが、ページの要求レベル以上（数字が同じか小さい）かチェック"""
+    return user_level <= page_required_level
+
+
+def visible_page_levels(user_level):
+    """指定したレベルのユーザーが閲覧できるページの要求レベルの一覧を返す"""
+    return [level for level in PAGE_LEVELS if can_view(user_level, level)]
@@ -0,0 +1,63 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import time
+import uuid
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:  # pyinstrument がなければ cProfile だけを使う
+    PyinstrumentProfiler = None
+
+# --- リクエスト1回分のプロファイル ---
+# 管理者が X-Profile ヘッダーを付けたリクエスト（または PROFILE_SAMPLE_RATE の割合で選んだリクエスト）だけ
+# プロファイラを動かし、結果を PROFILE_FOLDER に保存する。
+#   X-Profile: cprofile     → .prof（python -m pstats や snakeviz で開く）と上位の関数の .txt
+#   X-Profile: pyinstrument → .html（pyinstrument がインストールされている場合のみ）
+# cProfile はプロセスで同時に1つしか動かせないので、他のリクエストを計測中ならプロファイルしない。
+
+KIND_CPROFILE = 'cprofile'
+KIND_PYINSTRUMENT = 'pyinstrument'
+KINDS = (KIND_CPROFILE, KIND_PYINSTRUMENT)
+# .txt に書き出す関数の数
+STATS_LINES = 40
+
+
+class RequestProfiler:
+    def __init__(self, folder):
+        self.folder = folder
+
+    def start(self, kind=KIND_CPROFILE):
+        """プロファイラを動かし始めて返す。動かせなければ None。"""
+        try:
+            if kind == KIND_PYINSTRUMENT and PyinstrumentProfiler is not None:
+                profiler = PyinstrumentProfiler()
+                profiler.start()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+        except (ValueError, RuntimeError):
+            # 他のスレッドでプロファイラが動いている
+            return None
+        return profiler
+
+    def stop(self, profiler, name):
+        """プロファイラを止めて結果をファイルに保存し、そのファイル名を返す"""
+        os.makedirs(self.folder, exist_ok=True)
+        # 同じ秒に同じエンドポイントを計測しても上書きしないよう、乱数を付ける
+        base = (f"{time.strftime('%Y%m%d-%H%M%S')}-{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}-{os.getpid()}"
+                f"-{uuid.uuid4().hex[:8]}")
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            profiler.dump_stats(os.path.join(self.folder, base + '.prof'))
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(STATS_LINES)
+            with open(os.path.join(self.folder, base + '.txt'), 'w', encoding='utf-8') as f:
+                f.write(text.getvalue())
+            return base + '.prof'
+        profiler.stop()
+        with open(os.path.join(self.folder, base + '.html'), 'w', encoding='utf-8') as f:
+            f.write(profiler.output_html())
+        return base + '.html'
@@ -0,0 +1,79 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# --- 質問文のベクトル化をまとめて行うバッチ処理 ---
+# /ask に同時に届いた質問を数ミリ秒だけ待って集め、1回の encode と1回の FAISS 検索で処理する。
+# バッチサイズ1の推論がCPUスレッドを奪い合うより、まとめて処理した方がスループットが高い。
+
+DEFAULT_MAX_BATCH_SIZE = 16
+DEFAULT_MAX_WAIT_MS = 5
+
+
+class QueryBatcher:
+    """retrieval.search_batch を呼び出す専用スレッドに、質問をまとめて渡す"""
+
+    def __init__(self, retrieval, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.retrieval = retrieval
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='query-batcher', daemon=True)
+                self._thread.start()
+
+    def search(self, query, k=3, user_level=0, timeout=None):
+        """質問を1件投入し、検索結果（user_level のユーザーが閲覧できるもの）が出るまで待つ"""
+        if self.max_batch_size <= 1:
+            # バッチ処理を無効にしている場合はそのまま検索する
+            return self.retrieval.search(query, k, user_level)
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((query, k, user_level, future))
+        return future.result(timeout)
+
+    def _collect(self):
+        """最初の1件が届いてから max_wait 秒か max_batch_size 件まで集める"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            queries = [query for query, k, user_level, future in batch]
+            user_levels = [user_level for query, k, user_level, future in batch]
+            k_max = max(k for query, k, user_level, future in batch)
+            try:
+                all_results = self.retrieval.search_batch(queries, k_max, user_levels)
+            except Exception as e:
+                for query, k, user_level, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.queries += len(batch)
+            for (query, k, user_level, future), results in zip(batch, all_results):
+                future.set_result(results[:k])
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'queries': self.queries,
+            'average_batch_size': self.queries / self.batches if self.batches else 0.0,
+        }
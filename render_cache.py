@@ -0,0 +1,124 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import markdown
+
+from metrics import span
+
+# --- Markdownのレンダリングキャッシュ ---
+# キャッシュのキーは「拡張機能の一覧 + markdownのバージョン + 本文」のハッシュなので、
+# 拡張機能を変更した場合や本文が変わった場合は自動的に別のキーになる。
+# プロセス内のLRUに加えて page_renders テーブルにも保存し、再起動直後のワーカーでも効くようにする。
+
+MARKDOWN_EXTENSIONS = ['tables', 'fenced_code', 'nl2br', 'sane_lists']
+DEFAULT_MAX_ENTRIES = 512
+
+
+def content_hash(content, extensions=MARKDOWN_EXTENSIONS):
+    """レンダリング結果を一意に決める要素からハッシュを作る"""
+    h = hashlib.sha256()
+    h.update(markdown.__version__.encode('utf-8'))
+    h.update(b'\0')
+    h.update(','.join(extensions).encode('utf-8'))
+    h.update(b'\0')
+    h.update(content.encode('utf-8'))
+    return h.hexdigest()
+
+
+class RenderCache:
+    """ハッシュをキーにしたレンダリング済みHTMLのLRUキャッシュ"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, extensions=MARKDOWN_EXTENSIONS):
+        self.max_entries = max_entries
+        self.extensions = list(extensions)
+        self._entries = OrderedDict()  # content_hash -> (html, そのHTMLを使うページIDの集合)
+        self._page_hashes = {}  # page_id -> content_hash（_entries にあるものだけ）
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _evict(self, key):
+        """エントリと、それを指している page_id を取り除く（ロックを取ってから呼ぶ）"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            for page_id in entry[1]:
+                if self._page_hashes.get(page_id) == key:
+                    del self._page_hashes[page_id]
+
+    def _remember(self, page_id, key, html):
+        with self._lock:
+            old_key = self._page_hashes.get(page_id)
+            if old_key is not None and old_key != key:
+                self._evict(old_key)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = (html, set())
+            entry[1].add(page_id)
+            self._page_hashes[page_id] = key
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def render(self, db, page_id, content):
+        """ページ本文をHTMLに変換する（メモリ → DB → 実際の変換 の順に探す）"""
+        key = content_hash(content, self.extensions)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        cur = db.execute(
+            'SELECT content_html FROM page_renders WHERE page_id = ? AND content_hash = ?',
+            (page_id, key)
+        )
+        row = cur.fetchone()
+        if row is not None:
+            with self._lock:
+                self.db_hits += 1
+            self._remember(page_id, key, row['content_html'])
+            return row['content_html']
+
+        with self._lock:
+            self.misses += 1
+        with span('markdown'):
+            html = markdown.markdown(content, extensions=self.extensions)
+        try:
+            db.execute(
+                'INSERT OR REPLACE INTO page_renders (page_id, content_hash, content_html) VALUES (?, ?, ?)',
+                (page_id, key, html)
+            )
+            db.commit()
+        except sqlite3.OperationalError:
+            # 書き込みが混み合っている場合は保存を諦める（次回また変換するだけ）
+            db.rollback()
+        self._remember(page_id, key, html)
+        return html
+
+    def invalidate(self, db, page_id):
+        """ページの編集・削除時にキャッシュを破棄する（コミットは呼び出し側で行う）"""
+        with self._lock:
+            key = self._page_hashes.pop(page_id, None)
+            if key is not None:
+                self._evict(key)
+        db.execute('DELETE FROM page_renders WHERE page_id = ?', (page_id,))
+
+    def stats(self):
+        """ヒット数・ミス数などの統計を返す"""
+        with self._lock:
+            size = len(self._entries)
+            hits, db_hits, misses = self.hits, self.db_hits, self.misses
+        lookups = hits + db_hits + misses
+        return {
+            'hits': hits,
+            'db_hits': db_hits,
+            'misses': misses,
+            'hit_rate': (hits + db_hits) / lookups if lookups else 0.0,
+            'size': size,
+            'max_entries': self.max_entries,
+        }
@@ -0,0 +1,270 @@
+import os
+import threading
+import time
+
+from chunk_store import CHUNK_STORE_PREFIX, ChunkStore
+from database import DATABASE, ConnectionManager
+from metrics import TracedConnection, span
+
+# --- RAG用の検索サービス ---
+# SentenceTransformer・FAISSインデックス・チャンクデータの読み込みには数秒かかり、
+# メモリも大きく使うため、import時ではなくバックグラウンドのスレッドで読み込む。
+# 読み込みが終わるまでの間、Wikiの通常ページはそのまま表示でき、/ask だけが「準備中」を返す。
+# FAISSインデックスとチャンクストアはmmapで開くので、複数のワーカーでメモリを共有できる。
+# チャンクストアには本文の位置しかないので、検索結果の本文はヒットしたページの本文から切り出す。
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+INDEX_PATH = 'wiki_faiss.index'
+
+# ベクトルDBのファイルが更新されていないか確認する間隔（秒）
+RELOAD_CHECK_INTERVAL = 30
+
+STATE_IDLE = 'idle'
+STATE_LOADING = 'loading'
+STATE_READY = 'ready'
+STATE_ERROR = 'error'
+
+
+def read_index_mmap(path):
+    """FAISSインデックスをmmapで読み込む（対応していない形式なら通常の読み込みにする）"""
+    import faiss
+
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+    try:
+        return faiss.read_index(path, flags)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+
+class RetrievalService:
+    """埋め込みモデルとベクトルDBを遅延読み込みし、類似チャンクを検索する"""
+
+    def __init__(self, model_name=MODEL_NAME, index_path=INDEX_PATH, chunk_store_prefix=CHUNK_STORE_PREFIX,
+                 search_params=None, database=DATABASE):
+        self.model_name = model_name
+        self.search_params = search_params
+        self.index_path = index_path
+        self.chunk_store_prefix = chunk_store_prefix
+        self.state = STATE_IDLE
+        self.error = None
+        self.load_seconds = None
+        self.embedding_model = None
+        self.faiss_index = None
+        self.chunk_store = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loaded_mtime = None
+        # 読み込んだベクトルDBの世代番号（generations テーブルの 'vectors'。vector_worker.py が進める）
+        self._loaded_generation = None
+        self._last_check = 0.0
+        self._reloading = False
+        self._selector_cache = None
+        # 検索するスレッドごとに読み込み専用の接続を使い回す
+        self._connections = ConnectionManager(database, factory=TracedConnection)
+
+    @property
+    def is_ready(self):
+        return self.state == STATE_READY
+
+    def start(self):
+        """バックグラウンドで読み込みを開始する（すでに開始していれば何もしない）"""
+        with self._lock:
+            if self.state != STATE_IDLE:
+                return
+            self.state = STATE_LOADING
+            self._thread = threading.Thread(target=self._load, name='retrieval-loader', daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        """読み込みの完了を待つ（スクリプトやテスト用）"""
+        self.start()
+        self._thread.join(timeout)
+        return self.is_ready
+
+    def _load(self):
+        started = time.perf_counter()
+        print("AIモデルとベクトルDBを読み込み中...")
+        try:
+            # 重いライブラリはここで初めてimportする
+            from sentence_transformers import SentenceTransformer
+            from ann_index import set_search_params
+
+            embedding_model = SentenceTransformer(self.model_name)
+            mtime = self._files_mtime()
+            faiss_index = read_index_mmap(self.index_path)
+            set_search_params(faiss_index, self.search_params)
+            chunk_store = ChunkStore(self.chunk_store_prefix)
+        except FileNotFoundError as e:
+            print("エラー: ベクトルデータベースが見つかりません。")
+            print("先に `python create_vector_store.py` を実行してください。")
+            self.error = str(e)
+            self.state = STATE_ERROR
+            return
+        except Exception as e:
+            print(f"エラー: AIモデルの読み込みに失敗しました: {e}")
+            self.error = str(e)
+            self.state = STATE_ERROR
+            return
+
+        self.embedding_model = embedding_model
+        self.faiss_index = faiss_index
+        self.chunk_store = chunk_store
+        self._loaded_mtime = mtime
+        self._last_check = time.monotonic()
+        self.load_seconds = time.perf_counter() - started
+        self.state = STATE_READY
+        print(f"読み込み完了。({self.load_seconds:.1f}秒)")
+
+    def _files_mtime(self):
+        meta_path = self.chunk_store_prefix + '.meta.npy'
+        return max(os.path.getmtime(self.index_path), os.path.getmtime(meta_path))
+
+    def reload_if_changed(self, generation=None):
+        """差分更新でファイルが書き換えられていたら、バックグラウンドで読み込み直す。
+
+        generation（ベクトルDBの世代番号）が読み込んだときから変わっていれば、確認の間隔を待たずに読み込み直す。
+        """
+        if not self.is_ready or self._reloading:
+            return
+        if generation is not None and self._loaded_generation is None:
+            # 最初に見た世代番号を、読み込み済みのベクトルDBの世代とする
+            self._loaded_generation = generation
+        elif generation is not None and generation != self._loaded_generation:
+            self._start_reload(generation)
+            return
+        now = time.monotonic()
+        if now - self._last_check < RELOAD_CHECK_INTERVAL:
+            return
+        self._last_check = now
+        try:
+            if self._files_mtime() == self._loaded_mtime:
+                return
+        except OSError:
+            return
+        self._start_reload(generation)
+
+    def _start_reload(self, generation):
+        self._reloading = True
+        self._last_check = time.monotonic()
+        threading.Thread(target=self._reload, args=(generation,), name='retrieval-reloader', daemon=True).start()
+
+    def _reload(self, generation=None):
+        from ann_index import set_search_params
+
+        try:
+            mtime = self._files_mtime()
+            faiss_index = read_index_mmap(self.index_path)
+            set_search_params(faiss_index, self.search_params)
+            chunk_store = ChunkStore(self.chunk_store_prefix)
+        except Exception as e:
+            # 書き込み途中などで読めなかった場合は、次の確認時にやり直す
+            print(f"ベクトルDBの再読み込みに失敗しました: {e}")
+            self._reloading = False
+            return
+        # 検索中のリクエストが古いオブジェクトを使い終わるよう、参照の差し替えだけ行う
+        self.faiss_index, self.chunk_store = faiss_index, chunk_store
+        self._loaded_mtime = mtime
+        if generation is not None:
+            self._loaded_generation = generation
+        self._reloading = False
+        print("ベクトルDBを再読み込みしました。")
+
+    def search(self, query, k=3, user_level=0):
+        """質問文に近いチャンクのうち、user_level のユーザーが閲覧できるものを上位k件返す。
+
+        [(ページID, チャンク本文), ...]
+        """
+        return self.search_batch([query], k, [user_level])[0]
+
+    def _search_params(self, faiss_index, chunk_store, user_level):
+        """閲覧できるチャンクだけを検索対象にする SearchParameters を返す（絞り込み不要ならNone）"""
+        import faiss
+        from ann_index import make_search_params
+
+        # チャンクストアを読み込み直したら作り直す
+        cache = self._selector_cache
+        if cache is None or cache[0] is not chunk_store or cache[1] is not faiss_index:
+            cache = self._selector_cache = (chunk_store, faiss_index, {})
+        selectors = cache[2]
+        if user_level not in selectors:
+            allowed_ids = chunk_store.allowed_ids(user_level)
+            if len(allowed_ids) == len(chunk_store) - chunk_store.dead_count:
+                selectors[user_level] = None
+            else:
+                selectors[user_level] = faiss.IDSelectorBatch(allowed_ids)
+        selector = selectors[user_level]
+        if selector is None:
+            return None
+        # IndexIDMap.search は検索中に params.sel を一時的に書き換えるので、SearchParameters はスレッド間で
+        # 共有せず毎回作る（selector は読むだけなので共有してよい）
+        params = make_search_params(faiss_index, selector)
+        # SearchParametersはselectorを参照するだけなので、検索が終わるまで一緒に保持しておく
+        params.selector_ref = selector
+        return params
+
+    def page_contents(self, page_ids):
+        """チャンクの本文を切り出すため、ページの本文をまとめて取得して {ページID: 本文} を返す"""
+        if not page_ids:
+            return {}
+        placeholders = ', '.join('?' for _ in page_ids)
+        cur = self._connections.connection(readonly=True).execute(
+            f'SELECT id, content FROM pages WHERE id IN ({placeholders})', list(page_ids)
+        )
+        return {row['id']: row['content'] for row in cur.fetchall()}
+
+    def search_batch(self, queries, k=3, user_levels=None):
+        """複数の質問文をまとめてベクトル化・検索する。
+
+        encode は1回で行い、FAISSの検索は閲覧レベルごとに1回ずつ行う。
+        閲覧できないチャンクは IDSelector で検索対象から外すので、後から取り除く必要がなく、
+        常に閲覧できるチャンクの中から上位k件が返る。
+        ただし、ベクトル化した後に削除・編集されたページのチャンクは（本文を切り出せないので）除く。
+        """
+        import numpy as np
+
+        if user_levels is None:
+            user_levels = [0] * len(queries)
+        faiss_index, chunk_store = self.faiss_index, self.chunk_store
+        with span('encode'):
+            query_embeddings = np.array(self.embedding_model.encode(queries), dtype=np.float32)
+
+        all_hits = [None] * len(queries)
+        for user_level in set(user_levels):
+            positions = [i for i, level in enumerate(user_levels) if level == user_level]
+            params = self._search_params(faiss_index, chunk_store, user_level)
+            with span('faiss_search'):
+                D, I = faiss_index.search(query_embeddings[positions], k, params=params)
+            for position, row in zip(positions, I):
+                hits = []
+                for i in row:
+                    if i < 0:
+                        continue
+                    pos = chunk_store.position(int(i))
+                    if pos < 0:
+                        continue
+                    meta = chunk_store.meta[pos]
+                    # 念のため、検索結果の権限も確認する
+                    if meta['page_id'] < 0 or meta['required_level'] < user_level:
+                        continue
+                    hits.append((int(meta['page_id']), pos))
+                all_hits[position] = hits
+
+        # ヒットしたページの本文は、全部の質問の分をまとめて1回で取得する
+        contents = self.page_contents(sorted({page_id for hits in all_hits for page_id, pos in hits}))
+        all_results = []
+        for hits in all_hits:
+            results = []
+            for page_id, pos in hits:
+                text = chunk_store.text_in(pos, contents[page_id]) if page_id in contents else None
+                if text is not None:
+                    results.append((page_id, text))
+            all_results.append(results)
+        return all_results
+
+    def status(self):
+        """ヘルスチェック用の状態を返す"""
+        return {
+            'state': self.state,
+            'error': self.error,
+            'load_seconds': self.load_seconds,
+        }
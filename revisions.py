@@ -0,0 +1,142 @@
+import difflib
+import hashlib
+import json
+import zlib
+
+# --- ページの版の履歴（スナップショット + 差分） ---
+# 版ごとに本文を丸ごと保存すると、大きなページを何度も編集したときに wiki.db がすぐに大きくなる。
+# そこで page_revisions には、ときどき本文全体（スナップショット）を、それ以外は直前の版からの差分を
+# zlib で圧縮して保存する。
+#   - 差分は行単位。「直前の版の i〜j 行目をそのまま使う」と「この文字列を挿入する」の並び（JSON）
+#   - 直前のスナップショットから MAX_CHAIN_LENGTH 版たったら、または差分の合計がスナップショットより
+#     大きくなったら、次はスナップショットにする
+# どの版も「スナップショット1つ + 最大 MAX_CHAIN_LENGTH - 1 個の差分」で復元できる。
+
+# スナップショットから数えた差分の最大個数 + 1（版を読むときに当てる差分の数の上限を決める）
+MAX_CHAIN_LENGTH = 32
+ZLIB_LEVEL = 6
+
+
+def _compress(obj):
+    return zlib.compress(json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), ZLIB_LEVEL)
+
+
+def _decompress(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+def content_sha1(content):
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def make_delta(old, new):
+    """old から new を作る差分（[開始行, 終了行] のコピーと、挿入する文字列の並び）を返す"""
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j1 < j2:
+            text = ''.join(new_lines[j1:j2])
+            # 続けて挿入する場合は1つの文字列にまとめる
+            if ops and isinstance(ops[-1], str):
+                ops[-1] += text
+            else:
+                ops.append(text)
+    return ops
+
+
+def apply_delta(old_lines, ops):
+    """make_delta の差分を行のリストに当て、新しい行のリストを返す"""
+    lines = []
+    for op in ops:
+        if isinstance(op, str):
+            lines.extend(op.splitlines(keepends=True))
+        else:
+            lines.extend(old_lines[op[0]:op[1]])
+    return lines
+
+
+def _insert(db, page_id, revision, is_snapshot, data, sha1, title, edited_by_id, created_at=None):
+    db.execute(
+        """INSERT INTO page_revisions (page_id, revision, is_snapshot, data, content_sha1, title, edited_by_id, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, coalesce(?, strftime('%Y-%m-%d %H:%M:%f', 'now')))""",
+        (page_id, revision, 1 if is_snapshot else 0, data, sha1, title, edited_by_id, created_at)
+    )
+
+
+def record_revision(db, page_id, title, content, edited_by_id, previous=None):
+    """ページの新しい版を保存し、その版番号を返す（コミットは呼び出し側）。
+
+    previous は更新する前の pages の行。履歴を取り始める前からあるページなら、その内容を最初の版として残す。
+    """
+    last = db.execute("""
+        SELECT revision, content_sha1 FROM page_revisions WHERE page_id = ? ORDER BY revision DESC LIMIT 1
+    """, (page_id,)).fetchone()
+    if last is None and previous is not None:
+        _insert(db, page_id, 1, True, _compress(previous['content']), content_sha1(previous['content']),
+                previous['title'], previous['updated_by_id'] or previous['author_id'], previous['updated_at'])
+        last = (1, content_sha1(previous['content']))
+    revision = last[0] + 1 if last else 1
+
+    sha1 = content_sha1(content)
+    # 差分の元（直前の版）が pages の本文と一致するときだけ差分にする（スクリプトなどで直接書き換えられていたら丸ごと保存する）
+    if last is not None and previous is not None and last[1] == content_sha1(previous['content']):
+        # 直前のスナップショットの大きさと、そこから続く差分の数・大きさの合計
+        snapshot_size, chain_count, chain_size = db.execute("""
+            SELECT max(CASE WHEN is_snapshot = 1 THEN length(data) END), sum(is_snapshot = 0), sum(CASE WHEN is_snapshot = 0 THEN length(data) ELSE 0 END)
+            FROM page_revisions
+            WHERE page_id = ?
+              AND revision >= (SELECT max(revision) FROM page_revisions WHERE page_id = ? AND is_snapshot = 1)
+        """, (page_id, page_id)).fetchone()
+        delta = _compress(make_delta(previous['content'], content))
+        if chain_count + 1 < MAX_CHAIN_LENGTH and chain_size + len(delta) < snapshot_size:
+            _insert(db, page_id, revision, False, delta, sha1, title, edited_by_id)
+            return revision
+    _insert(db, page_id, revision, True, _compress(content), sha1, title, edited_by_id)
+    return revision
+
+
+def list_revisions(db, page_id):
+    """ページの版の一覧を新しい順に返す"""
+    cur = db.execute("""
+        SELECT r.revision, r.title, r.is_snapshot, length(r.data) AS stored_size, r.created_at, u.username AS editor_name
+        FROM page_revisions r LEFT JOIN users u ON u.id = r.edited_by_id
+        WHERE r.page_id = ?
+        ORDER BY r.revision DESC
+    """, (page_id,))
+    return cur.fetchall()
+
+
+def get_revision(db, page_id, revision):
+    """版の (タイトル, 本文, 作成日時, 編集者ID) を返す。ない版なら None。
+
+    直前のスナップショットから順に差分を当てて復元する（当てる差分は MAX_CHAIN_LENGTH - 1 個まで）。
+    """
+    rows = db.execute("""
+        SELECT revision, is_snapshot, data, content_sha1, title, created_at, edited_by_id FROM page_revisions
+        WHERE page_id = ? AND revision <= ?
+          AND revision >= (SELECT max(revision) FROM page_revisions WHERE page_id = ? AND revision <= ? AND is_snapshot = 1)
+        ORDER BY revision
+    """, (page_id, revision, page_id, revision)).fetchall()
+    if not rows or rows[-1]['revision'] != revision:
+        return None
+    # 途中の版は行のリストのまま差分を当て、最後に1回だけ文字列にする
+    lines = None
+    for row in rows:
+        if row['is_snapshot']:
+            lines = _decompress(row['data']).splitlines(keepends=True)
+        else:
+            lines = apply_delta(lines, _decompress(row['data']))
+    content = ''.join(lines)
+    last = rows[-1]
+    if content_sha1(content) != last['content_sha1']:
+        raise ValueError(f"版の復元に失敗しました（ページ {page_id} の版 {revision}）")
+    return last['title'], content, last['created_at'], last['edited_by_id']
+
+
+def diff_lines(old, new, old_label='', new_label=''):
+    """2つの版の unified diff の行を返す"""
+    return list(difflib.unified_diff(old.splitlines(), new.splitlines(), old_label, new_label, lineterm=''))
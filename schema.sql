@@ -1,5 +1,11 @@
 -- もし既存のテーブルがあれば、安全に削除する
 -- 外部キー制約を考慮し、参照しているテーブル（page_tags）から先に削除する
+DROP TABLE IF EXISTS pages_fts;
+DROP TABLE IF EXISTS vector_jobs;
+DROP TABLE IF EXISTS page_renders;
+DROP TABLE IF EXISTS uploads;
+DROP TABLE IF EXISTS page_revisions;
+DROP TABLE IF EXISTS generations;
 DROP TABLE IF EXISTS page_tags;
 DROP TABLE IF EXISTS pages;
 DROP TABLE IF EXISTS tags;
@@ -29,7 +35,12 @@ CREATE TABLE pages (
     author_id INTEGER NOT NULL,
     updated_by_id INTEGER,
     permission_level TEXT NOT NULL DEFAULT '社員以上',
-    vectorized_at TIMESTAMP, -- ★これを追加。最初はNULL
+    -- 閲覧に必要なレベル（permissions.py の required_level(permission_level)。数字が小さいほど厳しい）
+    -- 一覧・検索のSQLで「ユーザーのレベル以上」のページに絞り込むのに使う。既定値は「社員以上」の1
+    required_level INTEGER NOT NULL DEFAULT 1,
+    -- 最終更新日時（ベクトルDBの差分更新の判定に使う。ミリ秒まで記録する）
+    updated_at TIMESTAMP NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    vectorized_at TIMESTAMP, -- ★これを追加。最初はNULL。ベクトル化した時点の updated_at を入れる
     FOREIGN KEY (author_id) REFERENCES users (id),
     FOREIGN KEY (updated_by_id) REFERENCES users (id)
 );
@@ -43,4 +54,135 @@ CREATE TABLE page_tags (
     FOREIGN KEY (tag_id) REFERENCES tags (id),
     -- 複合主キー：同じページに同じタグが複数付かないようにする
     PRIMARY KEY (page_id, tag_id)
-);
\ No newline at end of file
+);
+
+
+-- 一覧のキーセット方式のページ分割（listing.py）とタグの付け替えで使うインデックス
+-- 一覧は要求レベルごとに並び順のインデックスを引くので、閲覧できないページを読み飛ばさない
+CREATE INDEX idx_pages_level_id ON pages (required_level, id);
+CREATE INDEX idx_pages_level_updated_at ON pages (required_level, updated_at DESC, id DESC);
+CREATE INDEX idx_page_tags_tag_id ON page_tags (tag_id, page_id);
+
+-- 全文検索用のFTS5インデックス（rowid = pages.id）
+-- trigramトークナイザを使うので、空白で区切られない日本語でも部分一致で検索できる
+CREATE VIRTUAL TABLE pages_fts USING fts5(
+    title,
+    content,
+    tags,
+    authors,
+    tokenize = 'trigram'
+);
+
+-- pages / page_tags の変更をトリガーで検索インデックスに反映する
+CREATE TRIGGER pages_fts_after_insert AFTER INSERT ON pages BEGIN
+    INSERT INTO pages_fts (rowid, title, content, tags, authors)
+    VALUES (
+        new.id, new.title, new.content, '',
+        (SELECT group_concat(username, ' ') FROM users WHERE id IN (new.author_id, new.updated_by_id))
+    );
+END;
+
+CREATE TRIGGER pages_fts_after_update AFTER UPDATE OF title, content, author_id, updated_by_id ON pages BEGIN
+    UPDATE pages_fts
+    SET title = new.title,
+        content = new.content,
+        authors = (SELECT group_concat(username, ' ') FROM users WHERE id IN (new.author_id, new.updated_by_id))
+    WHERE rowid = new.id;
+END;
+
+CREATE TRIGGER pages_fts_after_delete AFTER DELETE ON pages BEGIN
+    DELETE FROM pages_fts WHERE rowid = old.id;
+END;
+
+CREATE TRIGGER page_tags_fts_after_insert AFTER INSERT ON page_tags BEGIN
+    UPDATE pages_fts
+    SET tags = (SELECT group_concat(t.name, ' ') FROM tags t JOIN page_tags pt ON t.id = pt.tag_id WHERE pt.page_id = new.page_id)
+    WHERE rowid = new.page_id;
+END;
+
+CREATE TRIGGER page_tags_fts_after_delete AFTER DELETE ON page_tags BEGIN
+    UPDATE pages_fts
+    SET tags = coalesce((SELECT group_concat(t.name, ' ') FROM tags t JOIN page_tags pt ON t.id = pt.tag_id WHERE pt.page_id = old.page_id), '')
+    WHERE rowid = old.page_id;
+END;
+
+-- Markdownのレンダリング結果のキャッシュ（render_cache.py）
+-- content_hash は本文と拡張機能の一覧から計算するので、どちらかが変われば使われなくなる
+CREATE TABLE page_renders (
+    page_id INTEGER PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    content_html TEXT NOT NULL,
+    FOREIGN KEY (page_id) REFERENCES pages (id)
+);
+
+-- ページの添付ファイル（upload_store.py）
+-- ファイルの中身は uploads/objects/ に sha256 の名前で1つだけ置き、同じ内容の添付はそれを共有する
+CREATE TABLE uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    page_id INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    content_type TEXT,
+    size INTEGER NOT NULL,
+    uploaded_by_id INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (page_id) REFERENCES pages (id),
+    FOREIGN KEY (uploaded_by_id) REFERENCES users (id)
+);
+CREATE INDEX idx_uploads_page_id ON uploads (page_id);
+CREATE INDEX idx_uploads_sha256 ON uploads (sha256);
+
+-- ページの版の履歴（revisions.py）
+-- data は zlib で圧縮した本文全体（is_snapshot = 1）か、直前の版からの差分（is_snapshot = 0）
+CREATE TABLE page_revisions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    page_id INTEGER NOT NULL,
+    revision INTEGER NOT NULL,
+    is_snapshot INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    content_sha1 TEXT NOT NULL,
+    title TEXT NOT NULL,
+    edited_by_id INTEGER,
+    created_at TIMESTAMP NOT NULL,
+    UNIQUE (page_id, revision),
+    FOREIGN KEY (page_id) REFERENCES pages (id),
+    FOREIGN KEY (edited_by_id) REFERENCES users (id)
+);
+CREATE INDEX idx_page_revisions_snapshots ON page_revisions (page_id, revision) WHERE is_snapshot = 1;
+
+-- ベクトル化の予約（vector_queue.py）。ページの保存と同じトランザクションで入れ、vector_worker.py が取り出す
+CREATE TABLE vector_jobs (
+    page_id INTEGER PRIMARY KEY,
+    enqueued_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    run_after REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    last_error TEXT
+);
+CREATE INDEX idx_vector_jobs_ready ON vector_jobs (state, run_after);
+
+-- プロセス内のキャッシュ・索引の世代番号（tag_index.py, user_cache.py）
+-- 変更のたびに同じトランザクションで value を1増やし、他のワーカーは値の違いで古くなったことに気付く
+CREATE TABLE generations (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+INSERT INTO generations (name, value) VALUES ('tags', 0);
+INSERT INTO generations (name, value) VALUES ('users', 0);
+INSERT INTO generations (name, value) VALUES ('pages', 0);
+INSERT INTO generations (name, value) VALUES ('vectors', 0);
+
+-- ページの追加・変更・削除で 'pages' の世代番号を進める（一覧の ETag に使う。app.py の wiki_generation）
+CREATE TRIGGER pages_generation_after_insert AFTER INSERT ON pages BEGIN
+    UPDATE generations SET value = value + 1 WHERE name = 'pages';
+END;
+CREATE TRIGGER pages_generation_after_update AFTER UPDATE OF title, content, permission_level, required_level, updated_at ON pages BEGIN
+    UPDATE generations SET value = value + 1 WHERE name = 'pages';
+END;
+CREATE TRIGGER pages_generation_after_delete AFTER DELETE ON pages BEGIN
+    UPDATE generations SET value = value + 1 WHERE name = 'pages';
+END;
+
+-- スキーマのバージョン（migrate_db.py が既存DBの移行に使う）
+PRAGMA user_version = 11;
@@ -0,0 +1,176 @@
+import re
+
+from markupsafe import Markup, escape
+
+# --- 全文検索 (SQLite FTS5) ---
+# pages_fts テーブルは schema.sql のトリガーで pages / page_tags と同期される。
+# trigramトークナイザは3文字以上の語でしかインデックスを使えないため、
+# 1〜2文字の語は pages_fts に対する LIKE で絞り込む。
+
+# bm25の列ごとの重み（title, content, tags, authors の順）
+BM25_WEIGHTS = (10.0, 1.0, 5.0, 2.0)
+SNIPPET_TOKENS = 32
+RESULTS_PER_PAGE = 20
+
+# 質問文から取り出す検索語の上限（trigramが多すぎるとMATCHが遅くなる）
+MAX_QUESTION_TERMS = 48
+
+# 英数字の語（製品名・チケット番号など）と、日本語の連続した文字列
+_WORD_RE = re.compile(r'[A-Za-z0-9][A-Za-z0-9_\-.]*[A-Za-z0-9]')
+_CJK_RE = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uff66-\uff9f]+')
+
+# スニペット中のハイライト位置を表す制御文字（エスケープ後に<mark>へ置き換える）
+_HIGHLIGHT_START = '\x02'
+_HIGHLIGHT_END = '\x03'
+
+
+def _quote_fts_term(term):
+    """検索語をFTS5のフレーズとしてクォートする"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _escape_like(term):
+    """LIKEのワイルドカード文字をエスケープする"""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def highlight_snippet(snippet):
+    """FTS5のスニペットをHTMLエスケープし、ヒット箇所を<mark>で囲む"""
+    if not snippet:
+        return ''
+    html = str(escape(snippet))
+    html = html.replace(_HIGHLIGHT_START, '<mark>').replace(_HIGHLIGHT_END, '</mark>')
+    return Markup(html)
+
+
+def _make_snippet(text, terms, width=40):
+    """MATCHが使えない短い検索語用に、Python側でスニペットを作る"""
+    terms = [term for term in terms if term]
+    if not terms:
+        return text[:width * 2]
+    # 見つけるときと同じく大文字・小文字を区別せずに強調する（長い語を先に試す）
+    pattern = re.compile('|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    match = pattern.search(text)
+    if match is None:
+        return text[:width * 2]
+    start = max(match.start() - width, 0)
+    snippet = pattern.sub(lambda m: f'{_HIGHLIGHT_START}{m.group(0)}{_HIGHLIGHT_END}', text[start:start + width * 2])
+    prefix = '…' if start > 0 else ''
+    suffix = '…' if start + width * 2 < len(text) else ''
+    return prefix + snippet + suffix
+
+
+def _build_where(search_terms):
+    """検索語のリストからWHERE句と引数を組み立てる（全ての語を含むページにヒット）"""
+    long_terms = [term for term in search_terms if len(term) >= 3]
+    short_terms = [term for term in search_terms if len(term) < 3]
+
+    conditions = []
+    params = []
+    if long_terms:
+        conditions.append('pages_fts MATCH ?')
+        params.append(' '.join(_quote_fts_term(term) for term in long_terms))
+    for term in short_terms:
+        pattern = f'%{_escape_like(term)}%'
+        conditions.append(
+            "(pages_fts.title LIKE ? ESCAPE '\\' OR pages_fts.content LIKE ? ESCAPE '\\'"
+            " OR pages_fts.tags LIKE ? ESCAPE '\\' OR pages_fts.authors LIKE ? ESCAPE '\\')"
+        )
+        params.extend([pattern] * 4)
+    return ' AND '.join(conditions), params, bool(long_terms)
+
+
+def search_pages(db, search_terms, page=1, per_page=RESULTS_PER_PAGE, user_level=0):
+    """user_level のユーザーが閲覧できるページを全文検索し、(結果の行リスト, 総件数) を返す。
+
+    MATCHが使える場合はbm25で順位付けし、FTS5のスニペットを付ける。
+    """
+    if not search_terms:
+        return [], 0
+
+    where, params, use_match = _build_where(search_terms)
+    # 閲覧できないページはSQLの段階で除く（pages.required_level はユーザーのレベル以上）
+    where += ' AND p.required_level >= ?'
+    params = params + [user_level]
+    offset = (max(page, 1) - 1) * per_page
+
+    cur = db.execute(f'SELECT count(*) FROM pages_fts JOIN pages p ON p.id = pages_fts.rowid WHERE {where}', params)
+    total = cur.fetchone()[0]
+    if total == 0:
+        return [], 0
+
+    if use_match:
+        weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+        cur = db.execute(f"""
+            SELECT pages_fts.rowid AS id, pages_fts.title,
+                   snippet(pages_fts, -1, '{_HIGHLIGHT_START}', '{_HIGHLIGHT_END}', '…', {SNIPPET_TOKENS}) AS snippet
+            FROM pages_fts JOIN pages p ON p.id = pages_fts.rowid
+            WHERE {where}
+            ORDER BY bm25(pages_fts, {weights}), pages_fts.rowid DESC
+            LIMIT ? OFFSET ?
+        """, params + [per_page, offset])
+        rows = [
+            {'id': row['id'], 'title': row['title'], 'snippet': highlight_snippet(row['snippet'])}
+            for row in cur.fetchall()
+        ]
+    else:
+        cur = db.execute(f"""
+            SELECT pages_fts.rowid AS id, pages_fts.title, pages_fts.content
+            FROM pages_fts JOIN pages p ON p.id = pages_fts.rowid
+            WHERE {where}
+            ORDER BY pages_fts.rowid DESC
+            LIMIT ? OFFSET ?
+        """, params + [per_page, offset])
+        rows = [
+            {'id': row['id'], 'title': row['title'],
+             'snippet': highlight_snippet(_make_snippet(row['content'], search_terms))}
+            for row in cur.fetchall()
+        ]
+    return rows, total
+
+
+def question_terms(text):
+    """自然文の質問から、trigramインデックスで検索できる語を取り出す。
+
+    空白で区切られない日本語は3文字ずつずらした断片（trigram）に分け、
+    英数字の語はそのまま使う（3文字未満の語は trigram で検索できないので除く）。
+    """
+    terms = []
+    for word in _WORD_RE.findall(text):
+        if len(word) >= 3:
+            terms.append(word)
+    for run in _CJK_RE.findall(text):
+        terms.extend(run[i:i + 3] for i in range(len(run) - 2))
+    return list(dict.fromkeys(terms))[:MAX_QUESTION_TERMS]
+
+
+def rank_pages_for_question(db, text, limit, user_level=0):
+    """質問文に含まれる語のどれかを含み、user_level のユーザーが閲覧できるページを、
+    bm25の順に (id, title, content) で返す。
+    """
+    terms = question_terms(text)
+    if not terms:
+        return []
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    cur = db.execute(f"""
+        SELECT p.id, p.title, p.content
+        FROM pages_fts JOIN pages p ON p.id = pages_fts.rowid
+        WHERE pages_fts MATCH ? AND p.required_level >= ?
+        ORDER BY bm25(pages_fts, {weights})
+        LIMIT ?
+    """, [' OR '.join(_quote_fts_term(term) for term in terms), user_level, limit])
+    return cur.fetchall()
+
+
+def rebuild_search_index(db):
+    """pages / page_tags / users の内容から pages_fts を作り直す"""
+    db.execute('DELETE FROM pages_fts')
+    db.execute("""
+        INSERT INTO pages_fts (rowid, title, content, tags, authors)
+        SELECT p.id, p.title, p.content,
+               coalesce((SELECT group_concat(t.name, ' ')
+                         FROM tags t JOIN page_tags pt ON t.id = pt.tag_id
+                         WHERE pt.page_id = p.id), ''),
+               (SELECT group_concat(username, ' ') FROM users WHERE id IN (p.author_id, p.updated_by_id))
+        FROM pages p
+    """)
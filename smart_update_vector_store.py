@@ -1,118 +1,192 @@
-import sqlite3
+import argparse
+import os
+import time
+
 import numpy as np
 import faiss
-import pickle
 from sentence_transformers import SentenceTransformer
-from datetime import datetime
-import os
+
+import chunk_store as chunk_store_module
+import database
+from chunk_store import ChunkStore, ChunkStoreWriter, chunk_store_exists, text_checksum, write_lock
+from chunker import chunk_page, embedding_text
+from embedding_cache import EmbeddingCache
+from retrieval import INDEX_PATH, MODEL_NAME
+from ann_index import supports_remove
+from permissions import required_level
+from vector_queue import bump_generation as bump_vector_generation
+
+# ベクトルDBの差分更新スクリプト
+# 新規・編集されたページ（updated_at > vectorized_at）と削除されたページだけを処理する。
+# 編集されたページは古いチャンクのベクトルを remove_ids で取り除いてから新しく追加する。
+# 使い方:
+#   python smart_update_vector_store.py                 # 1回だけ差分更新
+#   python smart_update_vector_store.py --interval 60   # 60秒ごとに差分更新を繰り返す
+#   python smart_update_vector_store.py --compact       # 削除済みチャンクを今すぐ整理する
+# 初回（ベクトルDBがない場合）は create_vector_store.py で全件作成すること。
+
+# 削除済みチャンクの割合がこれを超えたら、チャンクストアを自動で整理する
+COMPACT_DEAD_RATIO = 0.2
 
 # --- 共通の関数定義 ---
 
 def get_db_connection():
     """データベース接続を取得する"""
-    connection = sqlite3.connect('wiki.db')
-    connection.row_factory = sqlite3.Row
-    return connection
+    return database.connect()
 
 def create_chunks_from_pages(pages):
-    """ページリストからチャンクと参照情報を作成する"""
+    """ページリストから、ベクトルにするテキストと参照情報（ページ本文の中の位置）を作成する"""
     chunks = []
     chunk_references = []
     for page in pages:
-        paragraphs = page['content'].split('\n\n')
-        for para in paragraphs:
-            if para.strip():
-                chunks.append(para)
-                chunk_references.append({'page_id': page['id'], 'title': page['title']})
+        content = page['content']
+        for chunk_no, chunk in enumerate(chunk_page(content)):
+            chunks.append(embedding_text(content, chunk))
+            chunk_references.append({
+                'page_id': page['id'],
+                'chunk_no': chunk_no,
+                'start': chunk.start,
+                'end': chunk.end,
+                'checksum': text_checksum(content[chunk.start:chunk.end]),
+                'required_level': required_level(page['permission_level'])
+            })
     return chunks, chunk_references
 
-# --- メインロジック ---
+def find_stale_pages(connection):
+    """ベクトル化されていない、またはベクトル化後に編集された（権限の変更を含む）ページを返す"""
+    cur = connection.execute("""
+        SELECT id, title, content, permission_level, updated_at FROM pages
+        WHERE vectorized_at IS NULL OR updated_at > vectorized_at
+    """)
+    return cur.fetchall()
 
-print("更新チェックを開始します...")
-connection = get_db_connection()
-cur = connection.cursor()
-
-# 1. 既存ページで、ベクトル化された後に更新されたものはあるか？
-cur.execute("SELECT 1 FROM pages WHERE vectorized_at IS NOT NULL AND updated_at > vectorized_at LIMIT 1")
-is_existing_page_updated = cur.fetchone() is not None
-
-# 2. 今日は土曜日か？ (月曜日=0, ... 土曜日=5)
-is_saturday = datetime.now().weekday() == 5
-
-# --- 実行モードを決定 ---
-
-# 【条件A】既存ページが更新されており、かつ今日が土曜日なら「全件洗い替え」
-if is_existing_page_updated and is_saturday:
-    print("実行モード: 全件洗い替え（土曜日の定期メンテナンス）")
-    
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    cur.execute('SELECT id, title, content FROM pages')
-    all_pages = cur.fetchall()
-    
-    chunks, chunk_references = create_chunks_from_pages(all_pages)
-    chunk_embeddings = model.encode(chunks, convert_to_tensor=False)
-    
-    index = faiss.IndexIDMap(faiss.IndexFlatL2(chunk_embeddings.shape[1]))
-    index.add_with_ids(np.array(chunk_embeddings, dtype=np.float32), np.arange(len(chunks)))
-    
-    faiss.write_index(index, 'wiki_faiss.index')
-    with open('chunks.pkl', 'wb') as f:
-        pickle.dump({'chunks': chunks, 'references': chunk_references}, f)
-        
-    # 全ページのvectorized_atを更新
-    now_str = datetime.now().isoformat()
-    connection.execute("UPDATE pages SET vectorized_at = ?", (now_str,))
+def find_deleted_page_ids(connection, chunk_store):
+    """チャンクストアには残っているが、pagesテーブルから削除されたページのIDを返す"""
+    stored_page_ids = {int(page_id) for page_id in np.unique(chunk_store.page_ids) if page_id >= 0}
+    if not stored_page_ids:
+        return set()
+    cur = connection.execute('SELECT id FROM pages')
+    existing_page_ids = {row['id'] for row in cur.fetchall()}
+    return stored_page_ids - existing_page_ids
+
+def update_vector_store(connection, model, embedding_cache):
+    """差分更新を1回行い、(追加したチャンク数, 取り除いたチャンク数) を返す"""
+    chunk_store = ChunkStore()
+    stale_pages = find_stale_pages(connection)
+    deleted_page_ids = find_deleted_page_ids(connection, chunk_store)
+    chunk_store.close()
+    return apply_page_changes(connection, model, embedding_cache, stale_pages, deleted_page_ids)
+
+def apply_page_changes(connection, model, embedding_cache, pages, deleted_page_ids):
+    """pages（新規・編集されたページの行）のチャンクを作り直し、deleted_page_ids のページのチャンクを取り除く。
+
+    (追加したチャンク数, 取り除いたチャンク数) を返す。ベクトル化ワーカー（vector_worker.py）からも使う。
+    """
+    if not pages and not deleted_page_ids:
+        return 0, 0
+    # 時間のかかる encode はロックの外で済ませる（編集で変わっていないチャンクはキャッシュから取り出す）
+    new_chunks, new_chunk_references = create_chunks_from_pages(pages)
+    new_chunk_embeddings = embedding_cache.encode(model, MODEL_NAME, new_chunks) if new_chunks else []
+    # 読み込みから置き換えまでの間に他のプロセスが書き換えると、どちらかの更新が失われるので、
+    # ロックを取ってから読み込む
+    with write_lock():
+        removed_ids = _apply_page_changes(pages, deleted_page_ids, new_chunk_embeddings, new_chunk_references)
+
+    # 読み込んだ時点の updated_at を記録する（処理中に編集されたページは次回また対象になる）
+    connection.executemany(
+        'UPDATE pages SET vectorized_at = ? WHERE id = ?',
+        [(page['updated_at'], page['id']) for page in pages]
+    )
+    # ベクトルDBを書き換えたことをアプリに知らせる（/ask のときに読み込み直す）
+    bump_vector_generation(connection)
     connection.commit()
-    print("全ページのベクトル化が完了しました。")
-
-# 【条件B】それ以外の場合（新規ページのみ、または更新があっても平日）は「差分更新」
-else:
-    if is_existing_page_updated:
-        print("注意: 既存ページに更新が検出されました。次回の土曜日に全件洗い替えが実行されます。")
-    
-    print("実行モード: 新規ページのみ差分更新")
-    
+    return len(new_chunks), len(removed_ids)
+
+def _apply_page_changes(pages, deleted_page_ids, new_chunk_embeddings, new_chunk_references):
+    """ベクトルDBを読み込んで書き換え、取り除いたチャンクのIDを返す（write_lock() の中で呼ぶ）"""
+    chunk_store = ChunkStore()
+    faiss_index = faiss.read_index(INDEX_PATH)
+    if not supports_remove(faiss_index):
+        chunk_store.close()
+        raise RuntimeError("このインデックス（HNSW）は削除に対応していません。create_vector_store.py で作り直してください。")
+
+    writer = ChunkStoreWriter(append_to=chunk_store)
+
+    # 1. 編集・削除されたページの古いチャンクを取り除く
+    removed_ids = writer.delete_pages({page['id'] for page in pages} | set(deleted_page_ids))
+    if len(removed_ids):
+        faiss_index.remove_ids(np.array(removed_ids, dtype=np.int64))
+
+    # 2. 新規・編集されたページのチャンクを追加する（IDは既存の最大値の続きから振る）
+    if new_chunk_references:
+        start_id = writer.next_id
+        new_ids = np.arange(start_id, start_id + len(new_chunk_references))
+        faiss_index.add_with_ids(np.array(new_chunk_embeddings, dtype=np.float32), new_ids)
+        for faiss_id, reference in zip(new_ids, new_chunk_references):
+            writer.add(int(faiss_id), reference['page_id'], reference['chunk_no'], reference['start'], reference['end'],
+                       reference['checksum'], reference['required_level'])
+
+    # 両方を一時ファイルに書いてから、チャンクストア → インデックスの順に置き換える。
+    # 間で止まっても「新しいチャンクストア + 古いインデックス」になるだけで、古いインデックスが返す
+    # 編集前のチャンクは削除済み、新しいチャンクはインデックスにないので、検索結果に食い違いは出ない
+    # （vectorized_at は記録されないので、次の実行でそのページを作り直す）。
+    chunk_store.close()
+    faiss.write_index(faiss_index, INDEX_PATH + '.tmp')
+    writer.close()
+    os.replace(INDEX_PATH + '.tmp', INDEX_PATH)
+    return removed_ids
+
+def compact_if_needed(force=False):
+    """削除済みチャンクが溜まっていたらチャンクストアを整理する"""
+    with write_lock():
+        chunk_store = ChunkStore()
+        total = len(chunk_store)
+        dead = chunk_store.dead_count
+        chunk_store.close()
+        if dead and (force or dead / total > COMPACT_DEAD_RATIO):
+            chunk_store_module.compact()
+            print(f"削除済みのチャンク{dead}個を整理しました。")
+
+def run_once(connection, model, embedding_cache):
+    added, removed = update_vector_store(connection, model, embedding_cache)
+    if added or removed:
+        print(f"{added}個のチャンクを追加し、{removed}個のチャンクを取り除きました。")
+        embedding_cache.report()
+    else:
+        print("更新対象のページはありませんでした。")
+    compact_if_needed()
+
+# --- メインロジック ---
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ベクトルDBの差分更新')
+    parser.add_argument('--interval', type=int, default=0, help='指定した秒数ごとに差分更新を繰り返す')
+    parser.add_argument('--compact', action='store_true', help='削除済みチャンクを今すぐ整理する')
+    args = parser.parse_args()
+
     # 既存のベクトルDBがなければ初回実行を促す
-    if not os.path.exists('wiki_faiss.index'):
+    if not os.path.exists(INDEX_PATH) or not chunk_store_exists():
         print("エラー: ベクトルデータベースが見つかりません。")
-        print("初回は `create_vector_store.py` を実行するか、土曜日にこのスクリプトを実行してください。")
+        print("初回は `create_vector_store.py` を実行してください。")
+        exit(1)
+
+    if args.compact:
+        compact_if_needed(force=True)
         exit()
-        
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    faiss_index = faiss.read_index('wiki_faiss.index')
-    with open('chunks.pkl', 'rb') as f:
-        chunk_data = pickle.load(f)
-
-    # 未処理の新規ページのみを取得
-    cur.execute('SELECT id, title, content FROM pages WHERE vectorized_at IS NULL')
-    new_pages = cur.fetchall()
-
-    if not new_pages:
-        print("更新対象の新規ページはありませんでした。")
-    else:
-        print(f"{len(new_pages)}件の新規ページを処理します...")
-        new_chunks, new_chunk_references = create_chunks_from_pages(new_pages)
-        
-        if new_chunks:
-            new_chunk_embeddings = model.encode(new_chunks, convert_to_tensor=False)
-            
-            start_id = faiss_index.ntotal
-            new_ids = np.arange(start_id, start_id + len(new_chunks))
-            faiss_index.add_with_ids(np.array(new_chunk_embeddings, dtype=np.float32), new_ids)
-            
-            chunk_data['chunks'].extend(new_chunks)
-            chunk_data['references'].extend(new_chunk_references)
-            
-            now_str = datetime.now().isoformat()
-            page_ids_to_update = [page['id'] for page in new_pages]
-            for page_id in page_ids_to_update:
-                connection.execute('UPDATE pages SET vectorized_at = ? WHERE id = ?', (now_str, page_id))
-            
-            connection.commit()
-            
-            faiss.write_index(faiss_index, 'wiki_faiss.index')
-            with open('chunks.pkl', 'wb') as f:
-                pickle.dump(chunk_data, f)
-            print(f"{len(new_chunks)}個の新しいチャンクをベクトルデータベースに追加しました。")
-
-connection.close()
\ No newline at end of file
+
+    print("更新チェックを開始します...")
+    model = SentenceTransformer(MODEL_NAME)
+    connection = get_db_connection()
+    embedding_cache = EmbeddingCache()
+    try:
+        while True:
+            run_once(connection, model, embedding_cache)
+            if not args.interval:
+                break
+            time.sleep(args.interval)
+    except RuntimeError as e:
+        print(f"エラー: {e}")
+        exit(1)
+    finally:
+        embedding_cache.close()
+        connection.close()
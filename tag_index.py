@@ -0,0 +1,230 @@
+import math
+import threading
+
+import numpy as np
+
+from permissions import can_view
+
+# --- タグのインメモリ索引 ---
+# タグ名 → そのタグが付いたページIDの昇順配列（int64）をプロセス内に持ち、
+# 複数タグの AND / OR / NOT を配列の積集合・和集合・差集合で求める。
+# タグごとのページ数（タグクラウド）もDBに問い合わせずに返せる。
+# 各ページの閲覧に必要なレベルも持ち、結果はユーザーが閲覧できるページだけに絞る。
+#
+# タグやページを変更したら、同じトランザクションで generations テーブルの 'tags' を1増やす（bump_generation）。
+# 変更したワーカーはコミット後に自分の索引へ差分を反映し、他のワーカーは次に使うときに
+# 世代番号の違いに気付いて作り直す。
+
+GENERATION_NAME = 'tags'
+# タグクラウドの文字の大きさの段階数
+CLOUD_WEIGHTS = 5
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def bump_generation(db):
+    """タグ・ページの変更を記録し、新しい世代番号を返す（コミットは呼び出し側）"""
+    db.execute('UPDATE generations SET value = value + 1 WHERE name = ?', (GENERATION_NAME,))
+    return read_generation(db)
+
+
+def read_generation(db):
+    row = db.execute('SELECT value FROM generations WHERE name = ?', (GENERATION_NAME,)).fetchone()
+    return row[0] if row else 0
+
+
+def parse_tag_query(terms):
+    """検索語をタグの条件 (AND, OR のグループ, NOT) に分ける。
+
+    'a b' は a かつ b、'a|b' は a または b、'-a' は a が付いていないページ。
+    """
+    required = []
+    any_of = []
+    excluded = []
+    for term in terms:
+        if term.startswith('-') and len(term) > 1:
+            excluded.append(term[1:])
+        elif '|' in term:
+            names = [name for name in term.split('|') if name]
+            if names:
+                any_of.append(names)
+        else:
+            required.append(term)
+    return required, any_of, excluded
+
+
+class TagIndex:
+    """タグ名 → ページIDの昇順配列の索引"""
+
+    def __init__(self):
+        self._postings = {}
+        self._all_pages = _EMPTY
+        # _all_pages と同じ並びの、各ページの閲覧に必要なレベル
+        self._all_levels = np.empty(0, dtype=np.int8)
+        # ユーザーのレベル → 閲覧できるページIDの昇順配列（ページが変わったら作り直す）
+        self._visible = {}
+        # ユーザーのレベル → {タグ名: 閲覧できるページ数}
+        self._counts = {}
+        # None は「まだ読み込んでいない（または差分を反映できなかった）」
+        self.generation = None
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def load(self, db):
+        """DBから索引を作り直す"""
+        with self._lock:
+            generation = read_generation(db)
+            names = [row[0] for row in db.execute('SELECT name FROM tags')]
+            rows = db.execute("""
+                SELECT t.name, pt.page_id FROM page_tags pt JOIN tags t ON t.id = pt.tag_id
+                ORDER BY t.name, pt.page_id
+            """).fetchall()
+            postings = {name: _EMPTY for name in names}
+            if rows:
+                tag_names = [row[0] for row in rows]
+                page_ids = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+                # 同じタグの行は連続しているので、タグが変わる位置で切り分ける
+                boundaries = [0] + [i for i in range(1, len(rows)) if tag_names[i] != tag_names[i - 1]] + [len(rows)]
+                for start, end in zip(boundaries, boundaries[1:]):
+                    postings[tag_names[start]] = page_ids[start:end].copy()
+            rows = db.execute('SELECT id, required_level FROM pages ORDER BY id').fetchall()
+            all_pages = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            all_levels = np.fromiter((row[1] for row in rows), dtype=np.int8, count=len(rows))
+
+            self._postings = postings
+            self._all_pages = all_pages
+            self._all_levels = all_levels
+            self._visible = {}
+            self._counts = {}
+            self.generation = generation
+            self.reloads += 1
+
+    def ensure_fresh(self, db):
+        """他のワーカーの変更で世代番号が進んでいたら作り直す"""
+        if self.generation is None or self.generation != read_generation(db):
+            self.load(db)
+
+    def _advance(self, generation):
+        """差分を反映してよいか（直前の世代から1つ進んだだけか）を返す。だめなら次回作り直す。"""
+        if self.generation is not None and self.generation == generation - 1:
+            self.generation = generation
+            return True
+        self.generation = None
+        return False
+
+    def update_page(self, page_id, added_names, removed_names, generation, required_level):
+        """1ページのタグ・閲覧に必要なレベルの変更（とページの追加）を反映する"""
+        with self._lock:
+            if not self._advance(generation):
+                return
+            pos = int(np.searchsorted(self._all_pages, page_id))
+            if pos < len(self._all_pages) and self._all_pages[pos] == page_id:
+                all_levels = self._all_levels.copy()
+                all_levels[pos] = required_level
+                self._all_levels = all_levels
+            else:
+                self._all_pages = np.insert(self._all_pages, pos, page_id)
+                self._all_levels = np.insert(self._all_levels, pos, required_level)
+            self._visible = {}
+            self._counts = {}
+            postings = dict(self._postings)
+            for name in added_names:
+                postings[name] = _insert(postings.get(name, _EMPTY), page_id)
+            for name in removed_names:
+                postings[name] = _remove(postings.get(name, _EMPTY), page_id)
+            # 読み込み中のスレッドがいても壊れないように、辞書ごと置き換える
+            self._postings = postings
+
+    def remove_page(self, page_id, generation):
+        """削除されたページを索引から取り除く"""
+        with self._lock:
+            if not self._advance(generation):
+                return
+            pos = int(np.searchsorted(self._all_pages, page_id))
+            if pos < len(self._all_pages) and self._all_pages[pos] == page_id:
+                self._all_pages = np.delete(self._all_pages, pos)
+                self._all_levels = np.delete(self._all_levels, pos)
+            self._visible = {}
+            self._counts = {}
+            self._postings = {name: _remove(ids, page_id) for name, ids in self._postings.items()}
+
+    def has_tags(self, names):
+        postings = self._postings
+        return all(name in postings for name in names)
+
+    def visible_pages(self, user_level):
+        """user_level のユーザーが閲覧できるページIDの昇順配列"""
+        visible = self._visible
+        if user_level not in visible:
+            all_pages, all_levels = self._all_pages, self._all_levels
+            visible[user_level] = all_pages[can_view(user_level, all_levels)]
+        return visible[user_level]
+
+    def pages_with(self, name, user_level=0):
+        return np.intersect1d(self._postings.get(name, _EMPTY), self.visible_pages(user_level), assume_unique=True)
+
+    def query(self, required=(), any_of=(), excluded=(), user_level=0):
+        """AND（required）・OR（any_of の各グループ）・NOT（excluded）の条件に合い、
+        user_level のユーザーが閲覧できるページIDの昇順配列を返す"""
+        postings = self._postings
+        if required:
+            # 件数の少ないタグから積集合をとると早く小さくなる
+            arrays = sorted((postings.get(name, _EMPTY) for name in required), key=len)
+            result = arrays[0]
+            for ids in arrays[1:]:
+                result = np.intersect1d(result, ids, assume_unique=True)
+        else:
+            result = self.visible_pages(user_level)
+        for names in any_of:
+            union = _EMPTY
+            for name in names:
+                union = np.union1d(union, postings.get(name, _EMPTY))
+            result = np.intersect1d(result, union, assume_unique=True)
+        for name in excluded:
+            result = np.setdiff1d(result, postings.get(name, _EMPTY), assume_unique=True)
+        if required:
+            result = np.intersect1d(result, self.visible_pages(user_level), assume_unique=True)
+        return result
+
+    def counts(self, user_level=0):
+        """{タグ名: user_level のユーザーが閲覧できるページ数} を返す"""
+        cache = self._counts
+        if user_level not in cache:
+            postings, all_pages = self._postings, self._all_pages
+            visible = self.visible_pages(user_level)
+            if len(visible) == len(all_pages):
+                cache[user_level] = {name: len(ids) for name, ids in postings.items()}
+            else:
+                # ページIDで引ける「閲覧できるか」の表を作り、各タグの配列を数える
+                is_visible = np.zeros(int(all_pages[-1]) + 1, dtype=bool)
+                is_visible[visible] = True
+                cache[user_level] = {name: int(np.count_nonzero(is_visible[ids])) for name, ids in postings.items()}
+        return cache[user_level]
+
+    def cloud(self, user_level=0):
+        """タグクラウド用に、名前順の (タグ名, ページ数, 大きさ 1〜CLOUD_WEIGHTS) のリストを返す"""
+        counts = self.counts(user_level)
+        if not counts:
+            return []
+        max_count = max(counts.values())
+        cloud = []
+        for name in sorted(counts):
+            count = counts[name]
+            # ページ数の対数で大きさを決める（よく使われるタグだけが極端に大きくならないように）
+            weight = 1 + round((CLOUD_WEIGHTS - 1) * math.log1p(count) / math.log1p(max_count)) if max_count else 1
+            cloud.append((name, count, weight))
+        return cloud
+
+
+def _insert(ids, page_id):
+    pos = int(np.searchsorted(ids, page_id))
+    if pos < len(ids) and ids[pos] == page_id:
+        return ids
+    return np.insert(ids, pos, page_id)
+
+
+def _remove(ids, page_id):
+    pos = int(np.searchsorted(ids, page_id))
+    if pos < len(ids) and ids[pos] == page_id:
+        return np.delete(ids, pos)
+    return ids
@@ -0,0 +1,102 @@
+from tag_index import bump_generation
+
+# --- タグの保存処理 ---
+# ページのタグは、タグ名をまとめて1回で引き、足りないタグは INSERT OR IGNORE でまとめて作り、
+# page_tags は今の状態との差分（追加・削除）だけを executemany で反映する。
+# 変わっていないタグの行には触れないので、pages_fts を更新するトリガーも余計に動かない。
+# タグ名の変更・統合は、何千ページに付いていても1つのトランザクションで行う（コミットは呼び出し側）。
+# 変更・統合のあとは各ワーカーのタグの索引（tag_index.py）を作り直させる。
+
+# 一度に IN (...) で問い合わせるタグ名の数（SQLiteの変数の上限より小さくする）
+LOOKUP_BATCH_SIZE = 500
+
+
+def parse_tag_names(tags_string):
+    """カンマ区切りのタグ文字列を、空白を除いたタグ名のリスト（重複なし・入力順）にする"""
+    return list(dict.fromkeys(tag.strip() for tag in tags_string.split(',') if tag.strip()))
+
+
+def resolve_tag_ids(db, names, create=True):
+    """タグ名から {タグ名: タグID} を返す。create=True ならないタグを作る。"""
+    names = list(dict.fromkeys(names))
+    if create and names:
+        db.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)', ((name,) for name in names))
+    tag_ids = {}
+    for i in range(0, len(names), LOOKUP_BATCH_SIZE):
+        batch = names[i:i + LOOKUP_BATCH_SIZE]
+        placeholders = ', '.join('?' for _ in batch)
+        cur = db.execute(f'SELECT id, name FROM tags WHERE name IN ({placeholders})', batch)
+        for tag_id, name in cur.fetchall():
+            tag_ids[name] = tag_id
+    return tag_ids
+
+
+def set_page_tags(db, page_id, names):
+    """ページのタグを names にし、(追加したタグ名のリスト, 外したタグ名のリスト) を返す。
+
+    タグの索引の世代番号（tag_index.bump_generation）は呼び出し側で進める。
+    """
+    tag_ids = resolve_tag_ids(db, names)
+    cur = db.execute('SELECT t.id, t.name FROM page_tags pt JOIN tags t ON t.id = pt.tag_id WHERE pt.page_id = ?',
+                     (page_id,))
+    current = {tag_id: name for tag_id, name in cur.fetchall()}
+
+    removed = [(tag_id, name) for tag_id, name in current.items() if name not in tag_ids]
+    added = [(tag_id, name) for name, tag_id in tag_ids.items() if tag_id not in current]
+    if removed:
+        db.executemany('DELETE FROM page_tags WHERE page_id = ? AND tag_id = ?',
+                       ((page_id, tag_id) for tag_id, name in removed))
+    if added:
+        db.executemany('INSERT INTO page_tags (page_id, tag_id) VALUES (?, ?)',
+                       ((page_id, tag_id) for tag_id, name in sorted(added)))
+    return [name for tag_id, name in added], [name for tag_id, name in removed]
+
+
+def _refresh_fts_tags(db, tag_id):
+    """tag_id が付いているページの pages_fts のタグ列を作り直す（タグ名の変更はトリガーで拾えないため）"""
+    db.execute("""
+        UPDATE pages_fts
+        SET tags = coalesce((SELECT group_concat(t.name, ' ') FROM tags t JOIN page_tags pt ON t.id = pt.tag_id
+                             WHERE pt.page_id = pages_fts.rowid), '')
+        WHERE rowid IN (SELECT page_id FROM page_tags WHERE tag_id = ?)
+    """, (tag_id,))
+
+
+def merge_tags(db, source_names, target_name):
+    """source_names のタグが付いたページに target_name のタグを付け、元のタグを削除する。
+
+    付け替えたページ数を返す。
+    """
+    source_ids = [tag_id for name, tag_id in resolve_tag_ids(db, source_names, create=False).items()
+                  if name != target_name]
+    if not source_ids:
+        return 0
+    target_id = resolve_tag_ids(db, [target_name])[target_name]
+    placeholders = ', '.join('?' for _ in source_ids)
+    cur = db.execute(f'SELECT count(DISTINCT page_id) FROM page_tags WHERE tag_id IN ({placeholders})', source_ids)
+    page_count = cur.fetchone()[0]
+
+    db.execute(f"""
+        INSERT OR IGNORE INTO page_tags (page_id, tag_id)
+        SELECT DISTINCT page_id, ? FROM page_tags WHERE tag_id IN ({placeholders})
+    """, [target_id] + source_ids)
+    db.execute(f'DELETE FROM page_tags WHERE tag_id IN ({placeholders})', source_ids)
+    db.execute(f'DELETE FROM tags WHERE id IN ({placeholders})', source_ids)
+    bump_generation(db)
+    return page_count
+
+
+def rename_tag(db, old_name, new_name):
+    """タグ名を変更する。new_name のタグが既にあれば統合する。対象のページ数を返す。"""
+    tag_ids = resolve_tag_ids(db, [old_name, new_name], create=False)
+    if old_name not in tag_ids or old_name == new_name:
+        return 0
+    if new_name in tag_ids:
+        return merge_tags(db, [old_name], new_name)
+
+    tag_id = tag_ids[old_name]
+    db.execute('UPDATE tags SET name = ? WHERE id = ?', (new_name, tag_id))
+    _refresh_fts_tags(db, tag_id)
+    bump_generation(db)
+    cur = db.execute('SELECT count(*) FROM page_tags WHERE tag_id = ?', (tag_id,))
+    return cur.fetchone()[0]
@@ -0,0 +1,128 @@
+import os
+import zlib
+
+import faiss
+import numpy as np
+import pytest
+
+import database
+from benchmarks.corpus import BENCH_PASSWORD, generate
+from chunk_store import CHUNK_STORE_PREFIX, ChunkStoreWriter, text_checksum
+from chunker import chunk_page, embedding_text
+from permissions import PERMISSION_MAP, ROLE_HIERARCHY, required_level
+
+# --- テスト用のWiki ---
+# benchmarks.corpus で作ったWikiに、閲覧できる人を限ったページ（SECRET_MARKER を含む）と、
+# 同じ話題の公開ページを加え、一時ディレクトリで app を動かす。
+# ベクトルDBは本物のFAISSインデックスとチャンクストアを作るが、埋め込みモデルだけは
+# 文字の bigram をハッシュした HashingEncoder を使う（sentence_transformers を読み込まない）。
+
+N_PAGES = 80
+# 管理者・社員だけが見られるページにだけ含まれる語（質問文には含めない）
+SECRET_MARKER = 'ZX-ORCHID'
+SECRET_PAGES = [
+    ('買収計画の交渉条件', '管理者のみ', f"# 買収計画\n\n買収計画の交渉条件は {SECRET_MARKER} です。"),
+    ('買収計画の社内向け資料', '社員以上', f"# 買収計画\n\n買収計画の交渉条件を教えます。{SECRET_MARKER}"),
+]
+PUBLIC_PAGES = [
+    ('買収計画についてのお知らせ', '全員に公開', "# 買収計画\n\n買収計画の交渉条件は公開されていません。"),
+]
+# 質問（SECRET_MARKER を含まず、非公開のページと公開ページの両方に関係する）
+QUESTION = '買収計画の交渉条件を教えてください'
+
+
+class HashingEncoder:
+    """テスト用の埋め込みモデル（SentenceTransformer.encode と同じ形で、文字の bigram のベクトルを返す）"""
+
+    dim = 128
+
+    def encode(self, texts, **kwargs):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for a, b in zip(text, text[1:]):
+                vectors[row, zlib.crc32((a + b).encode('utf-8')) % self.dim] += 1
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-6)
+
+
+def add_pages(connection, pages, author_id=1):
+    ids = []
+    for title, permission_level, content in pages:
+        cur = connection.execute(
+            "INSERT INTO pages (title, content, author_id, permission_level, required_level, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'))",
+            (title, content, author_id, permission_level, PERMISSION_MAP[permission_level])
+        )
+        ids.append(cur.lastrowid)
+    connection.commit()
+    return ids
+
+
+def build_vector_store(connection, directory, encoder):
+    """全ページのチャンクのベクトルDBを directory に作る（create_vector_store.py と同じ形式）"""
+    writer = ChunkStoreWriter(os.path.join(directory, CHUNK_STORE_PREFIX))
+    texts = []
+    for page in connection.execute('SELECT id, content, permission_level FROM pages ORDER BY id'):
+        content = page['content']
+        for chunk_no, chunk in enumerate(chunk_page(content)):
+            writer.add(len(texts), page['id'], chunk_no, chunk.start, chunk.end,
+                       text_checksum(content[chunk.start:chunk.end]), required_level(page['permission_level']))
+            texts.append(embedding_text(content, chunk))
+    writer.close()
+    index = faiss.IndexIDMap(faiss.IndexFlatL2(encoder.dim))
+    index.add_with_ids(encoder.encode(texts), np.arange(len(texts)))
+    faiss.write_index(index, os.path.join(directory, 'wiki_faiss.index'))
+
+
+@pytest.fixture(scope='session')
+def wiki_dir(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('wiki'))
+    path = os.path.join(directory, database.DATABASE)
+    generate(path, N_PAGES, n_tags=10, n_users=8, seed=0)
+    connection = database.connect(path)
+    add_pages(connection, SECRET_PAGES + PUBLIC_PAGES)
+    build_vector_store(connection, directory, HashingEncoder())
+    connection.close()
+    return directory
+
+
+@pytest.fixture(scope='session')
+def wiki_app(wiki_dir):
+    """一時ディレクトリの wiki.db・ベクトルDB・uploads/ を使う app モジュール"""
+    cwd = os.getcwd()
+    # app は import 時に相対パスで設定を読むので、先に移動しておく
+    os.chdir(wiki_dir)
+    os.environ['RETRIEVAL_PRELOAD'] = '0'
+    # LLMはデモモード（プロンプトをそのまま返す）にして、LLMに渡したコンテキストを確かめられるようにする
+    os.environ.pop('OPENAI_API_KEY', None)
+    import app as wiki
+
+    wiki.app.config['TESTING'] = True
+    # モデルの代わりに HashingEncoder を入れ、ベクトルDBを読み込む
+    from retrieval import STATE_READY
+
+    wiki.retrieval.embedding_model = HashingEncoder()
+    wiki.retrieval._reload()
+    wiki.retrieval.state = STATE_READY
+    # 遅いマシンでも検索が時間の上限で捨てられないようにする
+    wiki.hybrid_retriever.vector_budget = wiki.hybrid_retriever.lexical_budget = 10
+    yield wiki
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def db(wiki_app):
+    connection = database.connect()
+    yield connection
+    connection.close()
+
+
+@pytest.fixture
+def login(wiki_app):
+    """役職を指定してログインしたテストクライアントを返す（ユーザーは benchmarks.corpus が作る）"""
+    def login(role):
+        client = wiki_app.app.test_client()
+        username = f"bench-{role.lower()}-{list(ROLE_HIERARCHY).index(role)}"
+        response = client.post('/login', data={'username': username, 'password': BENCH_PASSWORD})
+        assert response.status_code == 302
+        return client
+    return login
@@ -0,0 +1,67 @@
+import json
+import time
+
+import pytest
+
+from benchmarks.fake_llm_server import ANSWER, FakeLLMHandler, start_server
+from llm_client import LLMClient
+
+from conftest import QUESTION
+
+# /ask/stream が Server-Sent Events で sources → token … → done の順に送ること、
+# ブラウザが切断したらLLMへの接続も閉じること（benchmarks/fake_llm_server.py を相手にする）
+
+
+@pytest.fixture
+def fake_llm(wiki_app, monkeypatch):
+    server, base_url = start_server(first_token_ms=0, token_ms=0)
+    monkeypatch.setattr(wiki_app, 'llm_client', LLMClient(base_url=base_url, api_key='dummy'))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_ask_stream_sends_sources_tokens_and_done(login, fake_llm):
+    response = login('Customer').post('/ask/stream', json={'message': QUESTION})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    events = parse_events(response.get_data(as_text=True))
+    names = [name for name, data in events]
+    assert names[0] == 'sources' and names[-1] == 'done'
+    assert set(names[1:-1]) == {'token'}
+    assert events[0][1]['sources']
+    assert ''.join(data['text'] for name, data in events[1:-1]) == ANSWER
+
+
+def test_ask_returns_the_whole_answer(login, fake_llm):
+    response = login('Customer').post('/ask', json={'message': QUESTION})
+    assert response.get_json()['response'] == ANSWER
+
+
+def test_ask_stream_closes_the_llm_connection_when_the_client_disconnects(login, fake_llm):
+    FakeLLMHandler.token_delay = 0.02
+    cancelled = FakeLLMHandler.cancelled
+    response = login('Customer').post('/ask/stream', json={'message': QUESTION}, buffered=False)
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'event: sources')
+    assert next(chunks).startswith(b'event: token')
+    response.close()
+    # 偽LLMサーバーは、送り続けようとして切断に気付く
+    deadline = time.monotonic() + 5
+    while FakeLLMHandler.cancelled == cancelled and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert FakeLLMHandler.cancelled == cancelled + 1
+
+
+def test_ask_stream_requires_login(wiki_app):
+    response = wiki_app.app.test_client().post('/ask/stream', json={'message': QUESTION})
+    assert response.status_code == 302
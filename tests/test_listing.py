@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+import database
+from benchmarks.corpus import generate
+from listing import MAX_PAGE_SIZE, ORDERS, list_pages
+from permissions import ROLE_HIERARCHY
+
+from conftest import SECRET_MARKER, SECRET_PAGES, add_pages
+
+# 一覧・検索に閲覧できないページが出ないこと、一覧の手間が閲覧できないページの数によらないこと（listing.py）
+
+CUSTOMER = ROLE_HIERARCHY['Customer']
+SECRET_TITLES = [title for title, permission_level, content in SECRET_PAGES]
+
+
+def visible_page_ids(db, user_level):
+    return {row['id'] for row in db.execute('SELECT id FROM pages WHERE required_level >= ?', (user_level,))}
+
+
+@pytest.mark.parametrize('order', ORDERS)
+@pytest.mark.parametrize('role', ['Customer', 'Admin'])
+def test_api_pages_lists_exactly_the_visible_pages(login, db, role, order):
+    client = login(role)
+    page_ids = []
+    cursor = None
+    while True:
+        response = client.get('/api/pages', query_string={'order': order, 'limit': MAX_PAGE_SIZE // 4,
+                                                          **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200
+        data = response.get_json()
+        page_ids.extend(page['id'] for page in data['pages'])
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+    assert len(page_ids) == len(set(page_ids))
+    assert set(page_ids) == visible_page_ids(db, ROLE_HIERARCHY[role])
+
+
+@pytest.mark.parametrize('path', ['/', '/search?q=買収計画', f'/search?q={SECRET_MARKER}', '/search?q=買収'])
+def test_listings_hide_restricted_titles(login, path):
+    html = login('Customer').get(path).get_data(as_text=True)
+    for title in SECRET_TITLES:
+        assert title not in html
+
+
+def test_search_shows_restricted_titles_to_admin(login):
+    html = login('Admin').get('/search?q=買収計画').get_data(as_text=True)
+    assert all(title in html for title in SECRET_TITLES)
+
+
+def vm_steps(connection, func):
+    """func() の間に SQLite が実行した仮想マシンの命令数"""
+    steps = 0
+
+    def count():
+        nonlocal steps
+        steps += 1
+        return 0
+    connection.set_progress_handler(count, 1)
+    try:
+        func()
+    finally:
+        connection.set_progress_handler(None, 1)
+    return steps
+
+
+@pytest.mark.parametrize('order', ORDERS)
+def test_listing_cost_does_not_grow_with_hidden_pages(tmp_path, order):
+    path = os.path.join(tmp_path, 'wiki.db')
+    generate(path, 200, n_tags=5, n_users=4, seed=1)
+    connection = database.connect(path)
+    before = vm_steps(connection, lambda: list_pages(connection, order, user_level=CUSTOMER))
+    # 顧客には見えないページを、見えるページの何倍も増やす
+    add_pages(connection, [(f'{title} {i}', permission_level, content)
+                           for i in range(1000) for title, permission_level, content in SECRET_PAGES])
+    pages, _ = list_pages(connection, order, user_level=CUSTOMER)
+    after = vm_steps(connection, lambda: list_pages(connection, order, user_level=CUSTOMER))
+    connection.close()
+    assert not any(page['title'].startswith(tuple(SECRET_TITLES)) for page in pages)
+    assert after <= before * 1.2
@@ -0,0 +1,73 @@
+import pytest
+
+from hybrid_retrieval import MODES
+from permissions import ROLE_HIERARCHY
+
+from conftest import QUESTION, SECRET_MARKER
+
+# 閲覧できないページのチャンクが、ベクトル検索・キーワード検索・ハイブリッド検索と /ask の
+# どこからも返らないこと（検索の段階で除く。retrieval.py / hybrid_retrieval.py）
+
+CUSTOMER = ROLE_HIERARCHY['Customer']
+ADMIN = ROLE_HIERARCHY['Admin']
+
+
+def hidden_page_ids(db, user_level):
+    return {row['id'] for row in db.execute('SELECT id FROM pages WHERE required_level < ?', (user_level,))}
+
+
+def secret_page_ids(db):
+    return {row['id'] for row in db.execute('SELECT id FROM pages WHERE content LIKE ?', (f'%{SECRET_MARKER}%',))}
+
+
+def assert_visible(results, hidden):
+    assert results, '公開ページの検索結果もない'
+    for page_id, text in results:
+        assert page_id not in hidden
+        assert SECRET_MARKER not in text
+
+
+def test_vector_search_excludes_hidden_chunks(wiki_app, db):
+    # k をチャンク数より大きくして、閲覧できるチャンクを全部返させる
+    results = wiki_app.retrieval.search(QUESTION, k=len(wiki_app.retrieval.chunk_store), user_level=CUSTOMER)
+    assert_visible(results, hidden_page_ids(db, CUSTOMER))
+
+
+def test_vector_search_finds_secret_pages_for_admin(wiki_app, db):
+    results = wiki_app.retrieval.search(QUESTION, k=len(wiki_app.retrieval.chunk_store), user_level=ADMIN)
+    assert secret_page_ids(db) <= {page_id for page_id, text in results}
+
+
+def test_lexical_search_excludes_hidden_pages(wiki_app, db):
+    results = wiki_app.hybrid_retriever.lexical_search(QUESTION, 100, CUSTOMER)
+    assert_visible(results, hidden_page_ids(db, CUSTOMER))
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_retrieve_excludes_hidden_chunks(wiki_app, db, mode):
+    # 候補を全部返させて、順位の低い非公開のチャンクも見逃さないようにする
+    results, info = wiki_app.hybrid_retriever.retrieve(QUESTION, k=100, user_level=CUSTOMER, mode=mode)
+    assert not info['dropped'] and not info['errors']
+    assert_visible(results, hidden_page_ids(db, CUSTOMER))
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_retrieve_finds_secret_pages_for_admin(wiki_app, db, mode):
+    results, info = wiki_app.hybrid_retriever.retrieve(QUESTION, k=20, user_level=ADMIN, mode=mode)
+    assert secret_page_ids(db) & {page_id for page_id, text in results}
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_ask_context_excludes_hidden_pages(login, db, mode):
+    # デモモードのLLMはプロンプト（検索したコンテキスト）をそのまま返す
+    response = login('Customer').post('/ask', json={'message': QUESTION, 'retrieval_mode': mode})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert SECRET_MARKER not in data['response']
+    assert data['sources']
+    assert not {source['id'] for source in data['sources']} & hidden_page_ids(db, CUSTOMER)
+
+
+def test_ask_context_includes_secret_pages_for_admin(login):
+    response = login('Admin').post('/ask', json={'message': QUESTION})
+    assert SECRET_MARKER in response.get_json()['response']
@@ -0,0 +1,100 @@
+import io
+import os
+
+import pytest
+
+from upload_store import HashingFile
+
+# 添付ファイルの保存・配信（upload_store.py）: 同じ内容は1つだけ置く、使われなくなったら消す、
+# フォームのファイルはメモリに貯めずに一時ファイルへ書く、閲覧できないページの添付は返さない
+
+
+def create_page(client, title, files, permission_level='全員に公開'):
+    response = client.post('/new', data={
+        'title': title, 'content': f'{title}の本文', 'tags': '', 'permission_level': permission_level,
+        'upload_file': [(io.BytesIO(data), filename) for filename, data in files],
+    }, content_type='multipart/form-data')
+    assert response.status_code == 302
+    return int(response.headers['Location'].rsplit('/', 1)[1])
+
+
+def page_uploads(db, page_id):
+    return db.execute('SELECT id, sha256, filename, size FROM uploads WHERE page_id = ? ORDER BY id', (page_id,)).fetchall()
+
+
+@pytest.fixture
+def member(login):
+    return login('Member')
+
+
+def test_upload_round_trip(wiki_app, db, member):
+    data = os.urandom(300 * 1024)
+    page_id = create_page(member, '添付のテスト', [('report.pdf', data)])
+    [upload] = page_uploads(db, page_id)
+    assert upload['size'] == len(data)
+
+    url = f"/uploads/{upload['id']}/report.pdf"
+    response = member.get(url)
+    assert response.status_code == 200
+    assert response.get_data() == data
+    assert response.headers['ETag'] == f'"{upload["sha256"]}"'
+    assert 'private' in response.headers['Cache-Control']
+    assert member.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    partial = member.get(url, headers={'Range': 'bytes=100-199'})
+    assert partial.status_code == 206
+    assert partial.get_data() == data[100:200]
+
+
+def test_form_files_are_written_to_a_temp_file(wiki_app, db, member, monkeypatch):
+    # 受け取ったファイルはメモリに貯めず、受け取りながら HashingFile に書き込まれる
+    streams = []
+    store = wiki_app.upload_store.store
+    monkeypatch.setattr(wiki_app.upload_store, 'store', lambda stream: streams.append(type(stream)) or store(stream))
+    create_page(member, '大きな添付', [('big.txt', b'x' * (2 * 1024 * 1024))])
+    assert streams == [HashingFile]
+
+
+def test_same_content_is_stored_once_and_removed_when_unreferenced(wiki_app, db, member):
+    data = os.urandom(64 * 1024)
+    first = create_page(member, '重複1', [('a.txt', data)])
+    second = create_page(member, '重複2', [('b.txt', data), ('c.txt', data)])
+    hashes = {row['sha256'] for row in page_uploads(db, first) + page_uploads(db, second)}
+    assert len(hashes) == 1
+    sha256 = hashes.pop()
+    object_path = wiki_app.upload_store.object_path(sha256)
+    assert os.listdir(os.path.dirname(object_path)).count(sha256) == 1
+    # 添付した名前は添付ごとに残る
+    assert [row['filename'] for row in page_uploads(db, second)] == ['b.txt', 'c.txt']
+
+    # 他のページで使われている間は消さない
+    assert member.post(f'/delete/{first}').status_code == 302
+    assert os.path.exists(object_path)
+    upload_id = page_uploads(db, second)[0]['id']
+    assert member.get(f'/uploads/{upload_id}/b.txt').get_data() == data
+
+    assert member.post(f'/delete/{second}').status_code == 302
+    assert not os.path.exists(object_path)
+    assert not os.listdir(wiki_app.upload_store.tmp_dir)
+
+
+def test_attachments_of_restricted_pages_are_forbidden(login, db, member):
+    page_id = create_page(member, '社員向けの添付', [('secret.txt', b'members only')], permission_level='社員以上')
+    [upload] = page_uploads(db, page_id)
+    url = f"/uploads/{upload['id']}/secret.txt"
+    assert member.get(url).status_code == 200
+    assert login('Customer').get(url).status_code == 403
+    # 添付ファイルの置き場所は、権限を確かめない /uploads/<path> からは返さない
+    assert login('Customer').get(f"/uploads/objects/{upload['sha256'][:2]}/{upload['sha256']}").status_code == 404
+
+
+def test_pending_preview_is_not_cached_as_the_original(wiki_app, db, member, monkeypatch):
+    # プレビューがまだない間は、元の画像を別の ETag でキャッシュさせずに返す
+    monkeypatch.setattr(wiki_app.upload_store, 'schedule_previews', lambda sha256: None)
+    data = b'GIF89a' + os.urandom(128)
+    page_id = create_page(member, 'プレビュー待ち', [('image.gif', data)])
+    [upload] = page_uploads(db, page_id)
+    response = member.get(f"/uploads/{upload['id']}/image.gif?size=thumb")
+    assert response.get_data() == data
+    assert 'no-cache' in response.headers['Cache-Control']
+    assert 'max-age' not in response.headers['Cache-Control']
+    assert response.headers['ETag'] == f'"{upload["sha256"]}-thumb-pending"'
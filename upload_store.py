@@ -0,0 +1,164 @@
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:
+    # Pillow がなければ画像のプレビューは作らず、元の画像をそのまま表示する
+    Image = None
+
+# --- 添付ファイルの保存（内容のハッシュで置き場所を決める） ---
+# フォームのファイルは、受け取りながら一時ファイルに書き込みつつ SHA-256 を計算する（HashingFile）。
+# 受け取り終わったら objects/<ハッシュの先頭2文字>/<ハッシュ> に移すので、同じ内容のファイルは1つしか置かれない。
+# どのページにどんな名前で添付されたかは uploads テーブルに記録する。
+# 画像のサムネイル・プレビューは、リクエストが終わったあとにワーカーのスレッドで作る。
+
+CHUNK_SIZE = 64 * 1024
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+# プレビューの名前 → 長辺のピクセル数
+PREVIEW_SIZES = {'thumb': 256, 'preview': 1024}
+PREVIEW_FORMAT = 'webp'
+
+
+def is_image(filename):
+    return filename.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS if '.' in filename else False
+
+
+class HashingFile:
+    """書き込みながら SHA-256 とサイズを計算する一時ファイル。
+
+    UploadStore.store() で保存されずに閉じられたら、一時ファイルを削除する。
+    """
+
+    def __init__(self, directory):
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='upload-')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        self._file.close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    def __getattr__(self, name):
+        # read / seek / flush などは一時ファイルのものを使う
+        return getattr(self._file, name)
+
+
+class UploadStore:
+    """添付ファイルとプレビューの置き場所"""
+
+    def __init__(self, root, preview_workers=2):
+        # send_file は相対パスを app.root_path から探すので、作業ディレクトリからの絶対パスにしておく
+        self.root = os.path.abspath(root)
+        self.objects_dir = os.path.join(self.root, 'objects')
+        self.previews_dir = os.path.join(self.root, 'previews')
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        for directory in (self.objects_dir, self.previews_dir, self.tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=preview_workers, thread_name_prefix='upload-preview')
+        # プレビューを作成中（または作成待ち）のハッシュ
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def temp_file(self):
+        """フォームのファイルを受け取る一時ファイルを返す（Request._get_file_stream から使う）"""
+        return HashingFile(self.tmp_dir)
+
+    def object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    def preview_path(self, sha256, size_name):
+        return os.path.join(self.previews_dir, sha256[:2], f'{sha256}-{size_name}.{PREVIEW_FORMAT}')
+
+    def store(self, stream):
+        """受け取ったファイルを内容のハッシュの場所に置き、(sha256, サイズ) を返す"""
+        if not isinstance(stream, HashingFile):
+            # 一時ファイルを経由していない場合は、少しずつ読みながら一時ファイルに写す
+            source = stream
+            stream = self.temp_file()
+            for block in iter(lambda: source.read(CHUNK_SIZE), b''):
+                stream.write(block)
+        stream.flush()
+        sha256 = stream.hexdigest()
+        # 同じファイルを remove_unreferenced() が消している最中でないことは、呼び出し側の書き込みのトランザクションで保証する
+        path = self.object_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(stream.path, path)
+            stream.path = None
+        # 同じ内容のファイルが既にあれば、一時ファイルは close() で削除される
+        return sha256, stream.size
+
+    def has_preview(self, sha256, size_name):
+        return os.path.exists(self.preview_path(sha256, size_name))
+
+    def schedule_previews(self, sha256):
+        """画像のプレビューの作成をワーカーに頼む（作成済み・作成中なら何もしない）"""
+        if Image is None or all(self.has_preview(sha256, name) for name in PREVIEW_SIZES):
+            return
+        with self._lock:
+            if sha256 in self._pending:
+                return
+            self._pending.add(sha256)
+        self._executor.submit(self._make_previews, sha256)
+
+    def _make_previews(self, sha256):
+        try:
+            with Image.open(self.object_path(sha256)) as image:
+                image.seek(0)
+                for name, pixels in PREVIEW_SIZES.items():
+                    path = self.preview_path(sha256, name)
+                    if os.path.exists(path):
+                        continue
+                    preview = image.copy()
+                    preview.thumbnail((pixels, pixels))
+                    if preview.mode not in ('RGB', 'RGBA'):
+                        preview = preview.convert('RGBA')
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    # 書きかけのファイルを配信しないように、一時ファイルに書いてから置き換える
+                    fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, prefix='preview-')
+                    with os.fdopen(fd, 'wb') as f:
+                        preview.save(f, format=PREVIEW_FORMAT)
+                    os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"プレビューを作成できませんでした ({sha256}): {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(sha256)
+
+    def remove_unreferenced(self, db, hashes):
+        """どの添付にも使われなくなったファイルとプレビューを削除する（コミット後に呼ぶ）。
+
+        同じ内容のファイルを同時に添付されても消してしまわないよう、参照の確認と削除は書き込みのトランザクションの中で行う。
+        添付する側（store() と uploads への INSERT）も書き込みのトランザクションの中で行うこと（app.save_uploads）。
+        """
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            for sha256 in set(hashes):
+                if db.execute('SELECT 1 FROM uploads WHERE sha256 = ? LIMIT 1', (sha256,)).fetchone():
+                    continue
+                paths = [self.object_path(sha256)] + [self.preview_path(sha256, name) for name in PREVIEW_SIZES]
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+        finally:
+            db.commit()
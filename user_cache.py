@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# --- ログイン中のユーザー情報のキャッシュ ---
+# flask_login はリクエストのたびに load_user を呼ぶので、ユーザー情報（id, username, role）を
+# プロセス内に TTL 付きで持ち、毎回 users テーブルを引かないようにする。パスワードのハッシュは持たない。
+#
+# ユーザーを追加・削除・変更したら、同じトランザクションで generations テーブルの 'users' を1増やす（bump_generation）。
+# 各ワーカーは GENERATION_CHECK_SECONDS ごとに世代番号を確かめ、進んでいたらキャッシュを捨てる。
+# 削除したユーザーのセッションは、遅くとも GENERATION_CHECK_SECONDS 後には使えなくなる。
+
+GENERATION_NAME = 'users'
+GENERATION_CHECK_SECONDS = 1.0
+
+UserRecord = namedtuple('UserRecord', ['id', 'username', 'role'])
+
+
+def bump_generation(db):
+    """ユーザーの変更を記録し、新しい世代番号を返す（コミットは呼び出し側）"""
+    db.execute('UPDATE generations SET value = value + 1 WHERE name = ?', (GENERATION_NAME,))
+    return read_generation(db)
+
+
+def read_generation(db):
+    row = db.execute('SELECT value FROM generations WHERE name = ?', (GENERATION_NAME,)).fetchone()
+    return row[0] if row else 0
+
+
+class UserCache:
+    """ユーザーID → UserRecord のキャッシュ（件数の上限と有効期限つき）"""
+
+    def __init__(self, ttl_seconds=300, max_entries=1024, generation_check_seconds=GENERATION_CHECK_SECONDS):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.generation_check = generation_check_seconds
+        # ユーザーID → (期限, UserRecord)。古い順に並ぶ
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _check_generation(self, db, now):
+        """世代番号が進んでいたらキャッシュを捨てる（GENERATION_CHECK_SECONDS に1回だけDBを見る）"""
+        if now - self._checked_at < self.generation_check:
+            return
+        generation = read_generation(db)
+        with self._lock:
+            if generation != self.generation:
+                self._entries.clear()
+                self.generation = generation
+            self._checked_at = now
+
+    def get(self, db, user_id):
+        """ユーザー情報を返す（キャッシュになければDBから読む）。いなければ None。"""
+        user_id = int(user_id)
+        now = time.monotonic()
+        self._check_generation(db, now)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+
+        self.misses += 1
+        row = db.execute('SELECT id, username, role FROM users WHERE id = ?', (user_id,)).fetchone()
+        if row is None:
+            return None
+        record = UserRecord(row['id'], row['username'], row['role'])
+        self.put(record, now)
+        return record
+
+    def put(self, record, now=None):
+        """ユーザー情報を覚える（ログイン直後など、DBから読んだばかりのとき）"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._entries[record.id] = (now + self.ttl, record)
+            self._entries.move_to_end(record.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._entries)
+        total = self.hits + self.misses
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'generation': self.generation,
+        }
@@ -0,0 +1,119 @@
+import time
+
+# --- ベクトル化のジョブキュー（SQLiteのテーブル） ---
+# ページの追加・編集・削除のたびに、同じトランザクションで vector_jobs にページIDを入れる（enqueue_page）。
+# ワーカー（vector_worker.py）はこれを取り出してまとめてベクトル化し、ベクトルDBを書き換えたら
+# generations テーブルの 'vectors' を1増やす。アプリは /ask のときにこの値を見て、変わっていれば読み込み直す。
+#
+#   - 1ページにつき1行。同じページを続けて編集しても、まとめて1回だけ処理する（debounce）
+#     最後の編集から DEBOUNCE_SECONDS 待つが、最初の編集から MAX_DEBOUNCE_SECONDS を超えては待たない
+#   - 失敗したジョブは RETRY_BASE_SECONDS から倍々に待ってやり直し、MAX_ATTEMPTS 回失敗したら failed にする
+#   - 処理中に同じページが再び編集されたら、処理後もジョブを残す（updated_at で見分ける）
+# 時刻はすべてUNIX時間（秒）。
+
+GENERATION_NAME = 'vectors'
+DEBOUNCE_SECONDS = 5
+MAX_DEBOUNCE_SECONDS = 60
+RETRY_BASE_SECONDS = 10
+MAX_RETRY_SECONDS = 3600
+MAX_ATTEMPTS = 8
+
+STATE_PENDING = 'pending'
+STATE_FAILED = 'failed'
+
+
+def bump_generation(db):
+    """ベクトルDBの書き換えを記録し、新しい世代番号を返す（コミットは呼び出し側）"""
+    db.execute('UPDATE generations SET value = value + 1 WHERE name = ?', (GENERATION_NAME,))
+    return read_generation(db)
+
+
+def read_generation(db):
+    row = db.execute('SELECT value FROM generations WHERE name = ?', (GENERATION_NAME,)).fetchone()
+    return row[0] if row else 0
+
+
+def enqueue_page(db, page_id, now=None, debounce=DEBOUNCE_SECONDS):
+    """ページのベクトル化を予約する（コミットは呼び出し側）"""
+    now = time.time() if now is None else now
+    db.execute("""
+        INSERT INTO vector_jobs (page_id, enqueued_at, updated_at, run_after, attempts, state)
+        VALUES (?, ?, ?, ?, 0, ?)
+        ON CONFLICT (page_id) DO UPDATE SET
+            updated_at = excluded.updated_at,
+            run_after = min(excluded.run_after, vector_jobs.enqueued_at + ?),
+            attempts = 0,
+            state = excluded.state,
+            last_error = NULL
+    """, (page_id, now, now, now + debounce, STATE_PENDING, MAX_DEBOUNCE_SECONDS))
+
+
+def enqueue_all_pages(db, now=None):
+    """すべてのページのベクトル化を予約し、件数を返す（ベクトルDBを作り直したいとき）"""
+    now = time.time() if now is None else now
+    page_ids = [row[0] for row in db.execute('SELECT id FROM pages')]
+    for page_id in page_ids:
+        enqueue_page(db, page_id, now, debounce=0)
+    return len(page_ids)
+
+
+def claim_ready(db, limit, now=None, ignore_debounce=False):
+    """処理してよいジョブを古い順に最大 limit 件返す。ignore_debounce=True なら待ち時間を無視する。"""
+    now = time.time() if now is None else now
+    condition = '' if ignore_debounce else 'AND run_after <= ?'
+    params = [STATE_PENDING] + ([] if ignore_debounce else [now]) + [limit]
+    cur = db.execute(f"""
+        SELECT page_id, enqueued_at, updated_at, attempts FROM vector_jobs
+        WHERE state = ? {condition}
+        ORDER BY run_after
+        LIMIT ?
+    """, params)
+    return cur.fetchall()
+
+
+def complete(db, jobs):
+    """処理したジョブを消す。処理中に再び予約されたもの（updated_at が変わったもの）は残す。"""
+    db.executemany('DELETE FROM vector_jobs WHERE page_id = ? AND updated_at = ?',
+                   [(job['page_id'], job['updated_at']) for job in jobs])
+
+
+def fail(db, jobs, error, now=None):
+    """失敗したジョブを、待ち時間を倍々に延ばしてやり直すようにする"""
+    now = time.time() if now is None else now
+    for job in jobs:
+        attempts = job['attempts'] + 1
+        delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), MAX_RETRY_SECONDS)
+        state = STATE_FAILED if attempts >= MAX_ATTEMPTS else STATE_PENDING
+        db.execute("""
+            UPDATE vector_jobs SET attempts = ?, run_after = ?, state = ?, last_error = ?
+            WHERE page_id = ? AND updated_at = ?
+        """, (attempts, now + delay, state, str(error)[:1000], job['page_id'], job['updated_at']))
+
+
+def retry_failed(db, now=None):
+    """failed になったジョブを、すぐにやり直すようにする。件数を返す。"""
+    now = time.time() if now is None else now
+    cur = db.execute("""
+        UPDATE vector_jobs SET state = ?, attempts = 0, run_after = ?, last_error = NULL WHERE state = ?
+    """, (STATE_PENDING, now, STATE_FAILED))
+    return cur.rowcount
+
+
+def queue_stats(db, now=None):
+    """キューの長さと遅れ（いちばん古い未処理の予約からの秒数）を返す"""
+    now = time.time() if now is None else now
+    row = db.execute("""
+        SELECT
+            sum(state = ?) AS pending,
+            sum(state = ? AND run_after <= ?) AS ready,
+            sum(state = ?) AS failed,
+            min(CASE WHEN state = ? THEN enqueued_at END) AS oldest
+        FROM vector_jobs
+    """, (STATE_PENDING, STATE_PENDING, now, STATE_FAILED, STATE_PENDING)).fetchone()
+    return {
+        'depth': row['pending'] or 0,
+        'ready': row['ready'] or 0,
+        'failed': row['failed'] or 0,
+        'lag_seconds': now - row['oldest'] if row['oldest'] is not None else 0.0,
+        'generation': read_generation(db),
+    }
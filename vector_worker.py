@@ -0,0 +1,121 @@
+import argparse
+import os
+import sys
+import time
+
+import database
+import vector_queue
+
+# ベクトル化ワーカー
+# ページの保存時に vector_jobs に入ったジョブを取り出し、まとめてベクトルDBに反映する。
+# 書き換えたら世代番号を進めるので、動いているアプリは次の /ask で新しいベクトルDBを読み込む。
+# ベクトルDBのファイルの書き換えは chunk_store.write_lock() で1プロセスずつ行う（差分更新・全件作成と同時に動いても更新は失われない）。
+# 使い方:
+#   python vector_worker.py                  # ジョブを待ち続けて処理する
+#   python vector_worker.py drain            # 待ち時間を無視して今あるジョブをすべて処理し、終了する
+#   python vector_worker.py replay --failed  # 失敗して止まったジョブをやり直す
+#   python vector_worker.py replay --all     # 全ページを予約し直す（ベクトルDBの作り直しなど）
+#   python vector_worker.py stats            # キューの長さと遅れを表示する
+
+BATCH_SIZE = 32
+POLL_INTERVAL = 1.0
+
+
+def process_jobs(connection, model, embedding_cache, jobs):
+    """ジョブのページをベクトルDBに反映し、(追加したチャンク数, 取り除いたチャンク数) を返す"""
+    from smart_update_vector_store import apply_page_changes
+
+    page_ids = [job['page_id'] for job in jobs]
+    placeholders = ', '.join('?' for _ in page_ids)
+    pages = connection.execute(
+        f'SELECT id, title, content, permission_level, updated_at FROM pages WHERE id IN ({placeholders})', page_ids
+    ).fetchall()
+    # pages にないページは削除されたもの
+    deleted_page_ids = set(page_ids) - {page['id'] for page in pages}
+    return apply_page_changes(connection, model, embedding_cache, pages, deleted_page_ids)
+
+
+def run(connection, batch_size=BATCH_SIZE, poll_interval=POLL_INTERVAL, drain=False):
+    """ジョブを取り出して処理する。drain=True なら、待ち時間を無視して空になるまで処理して戻る。"""
+    from sentence_transformers import SentenceTransformer
+    from chunk_store import chunk_store_exists
+    from embedding_cache import EmbeddingCache
+    from retrieval import INDEX_PATH, MODEL_NAME
+    from smart_update_vector_store import compact_if_needed
+
+    if not os.path.exists(INDEX_PATH) or not chunk_store_exists():
+        print("エラー: ベクトルデータベースが見つかりません。")
+        print("初回は `create_vector_store.py` を実行してください。")
+        sys.exit(1)
+
+    print("モデルを読み込んでいます...")
+    model = SentenceTransformer(MODEL_NAME)
+    embedding_cache = EmbeddingCache()
+    print("ジョブを待っています..." if not drain else "ジョブをすべて処理します...")
+    try:
+        while True:
+            jobs = vector_queue.claim_ready(connection, batch_size, ignore_debounce=drain)
+            if not jobs:
+                if drain:
+                    break
+                time.sleep(poll_interval)
+                continue
+            started = time.perf_counter()
+            try:
+                added, removed = process_jobs(connection, model, embedding_cache, jobs)
+            except Exception as e:
+                connection.rollback()
+                vector_queue.fail(connection, jobs, e)
+                connection.commit()
+                print(f"{len(jobs)}ページのベクトル化に失敗しました（あとでやり直します）: {e}")
+                if drain:
+                    break
+                continue
+            vector_queue.complete(connection, jobs)
+            connection.commit()
+            lag = time.time() - min(job['enqueued_at'] for job in jobs)
+            print(f"{len(jobs)}ページを反映しました（チャンク +{added} / -{removed}、"
+                  f"{(time.perf_counter() - started) * 1000:.0f} ms、保存からの遅れ {lag:.1f}秒）")
+            compact_if_needed()
+    finally:
+        embedding_cache.close()
+
+
+def print_stats(connection):
+    stats = vector_queue.queue_stats(connection)
+    print(f"未処理: {stats['depth']}件（うち処理待ち {stats['ready']}件）、失敗: {stats['failed']}件、"
+          f"遅れ: {stats['lag_seconds']:.1f}秒、世代: {stats['generation']}")
+    for row in connection.execute("""
+        SELECT page_id, attempts, last_error FROM vector_jobs WHERE state = ? ORDER BY page_id LIMIT 20
+    """, (vector_queue.STATE_FAILED,)):
+        print(f"  ページ {row['page_id']}: {row['attempts']}回失敗 {row['last_error']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ベクトル化ワーカー')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='ジョブを待ち続けて処理する（既定）')
+    subparsers.add_parser('drain', help='今あるジョブをすべて処理して終了する')
+    replay_parser = subparsers.add_parser('replay', help='ジョブをやり直す')
+    replay_group = replay_parser.add_mutually_exclusive_group(required=True)
+    replay_group.add_argument('--failed', action='store_true', help='失敗して止まったジョブをやり直す')
+    replay_group.add_argument('--all', action='store_true', help='全ページを予約し直す')
+    subparsers.add_parser('stats', help='キューの長さと遅れを表示する')
+    for sub in (parser, run_parser):
+        sub.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        sub.add_argument('--poll-interval', type=float, default=POLL_INTERVAL)
+    args = parser.parse_args()
+
+    connection = database.connect()
+    try:
+        if args.command == 'stats':
+            print_stats(connection)
+        elif args.command == 'replay':
+            count = vector_queue.enqueue_all_pages(connection) if args.all else vector_queue.retry_failed(connection)
+            connection.commit()
+            print(f"{count}件のジョブを予約しました。")
+        else:
+            run(connection, getattr(args, 'batch_size', BATCH_SIZE), getattr(args, 'poll_interval', POLL_INTERVAL),
+                drain=args.command == 'drain')
+    finally:
+        connection.close()